@@ -1,10 +1,207 @@
 # _author_ = "Jean-Claude Tissier"
 # _github_ = "https://github.com/jctissier/Salesforce-Oauth2-REST-Metadata-API-Python-Examples"
 
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import sf_scheduler
+from ttl_cache import TTLCache
 #import salesforce_username_password_flow as oauth
 
 
+# Pooled keep-alive sessions
+#   -one requests.Session per (instance_url, access_token), shared by every
+#    RESTApi built for that org inside the worker process
+#   -sessions live in a bounded LRU, the least recently used one is dropped
+#    once SESSION_SETTINGS['max_sessions'] is exceeded
+#   -transport level retries only cover idempotent methods (GET, HEAD) and
+#    gateway errors, 503 and API limit errors are retried by sf_scheduler
+SESSION_SETTINGS = {
+    'pool_size': 10,
+    'max_sessions': 32,
+    'timeout': (5, 60),
+    'retries': 2,
+}
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def configure_sessions(pool_size=None, max_sessions=None, timeout=None, retries=None):
+    """
+    Change the pooling settings, sessions created before the call are discarded
+    :param pool_size: max number of keep-alive connections per org session
+    :param max_sessions: max number of org sessions kept by the worker
+    :param timeout: requests timeout, seconds or (connect, read) tuple
+    :param retries: transport level retries for GET/HEAD
+    """
+    with _sessions_lock:
+        if pool_size is not None:
+            SESSION_SETTINGS['pool_size'] = pool_size
+        if max_sessions is not None:
+            SESSION_SETTINGS['max_sessions'] = max_sessions
+        if timeout is not None:
+            SESSION_SETTINGS['timeout'] = timeout
+        if retries is not None:
+            SESSION_SETTINGS['retries'] = retries
+        _sessions.clear()
+
+
+def _new_session():
+    retry = Retry(
+        total=SESSION_SETTINGS['retries'],
+        backoff_factor=0.3,
+        status_forcelist=(502, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=SESSION_SETTINGS['pool_size'],
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(instance_url, access_token):
+    """
+    Return the pooled session of an org, creating it when needed
+    :return: requests.Session
+    """
+    key = (instance_url, access_token)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is not None:
+            _sessions.move_to_end(key)
+            return session
+        session = _new_session()
+        _sessions[key] = session
+        while len(_sessions) > SESSION_SETTINGS['max_sessions']:
+            # not closed explicitly, a request of another thread may still use it
+            _sessions.popitem(last=False)
+        return session
+
+
+# max number of sub-requests of one composite call
+COMPOSITE_LIMIT = 25
+# max number of query/queryAll sub-requests of one composite call, Salesforce rejects the whole call above it
+COMPOSITE_QUERY_LIMIT = 5
+# path of a query or queryAll sub-request, first page or nextRecordsUrl
+QUERY_PATH = re.compile(r'/query(All)?(/|\?|$)')
+
+_REFERENCE = re.compile(r'@\{(\w+)\.(\w+)\}')
+
+
+class CompositeError(Exception):
+    """
+    Raised when a composite call itself fails, keeps the failing response
+    """
+
+    def __init__(self, response):
+        super(CompositeError, self).__init__(response.status_code)
+        self.response = response
+
+
+class CompositeResult(object):
+    """
+    Result of one sub-request, answers status_code and json() like a response
+    """
+
+    def __init__(self, reference_id, status_code, body, headers):
+        self.reference_id = reference_id
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers
+
+    def json(self):
+        return self.body
+
+
+class CompositeBatch(object):
+    """
+        Sub-requests collected to be sent as Composite API calls
+            -execute() sends them COMPOSITE_LIMIT at a time, at most COMPOSITE_QUERY_LIMIT
+             of them being queries, and returns one CompositeResult per sub-request,
+             in the order they were added
+            -a body may reference an earlier sub-request with @{referenceId.field},
+             references to a previous call are resolved before sending the next one
+    """
+
+    def __init__(self, rest, composite_url, all_or_none=False):
+        self.rest = rest
+        self.composite_url = composite_url
+        self.all_or_none = all_or_none
+        self.requests = []
+
+    def add(self, method, url, body=None, reference_id=None):
+        """
+        :param url: url of the sub-request, absolute urls are reduced to their path
+        :return: referenceId of the sub-request
+        """
+        reference_id = reference_id or 'r%d' % len(self.requests)
+        parts = urlsplit(self.rest._url(url))
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        self.requests.append({'method': method, 'url': path, 'body': body, 'referenceId': reference_id})
+        return reference_id
+
+    def _chunks(self):
+        chunk = []
+        queries = 0
+        for r in self.requests:
+            query = QUERY_PATH.search(urlsplit(r['url']).path) is not None
+            if len(chunk) == COMPOSITE_LIMIT or (query and queries == COMPOSITE_QUERY_LIMIT):
+                yield chunk
+                chunk, queries = [], 0
+            chunk.append(r)
+            queries += query
+        if chunk:
+            yield chunk
+
+    def execute(self):
+        results = []
+        known = {}
+        for subrequests in self._chunks():
+            chunk = [self._resolve(r, known) for r in subrequests]
+            response = self.rest.rest_api_post(self.composite_url, json.dumps({
+                'allOrNone': self.all_or_none,
+                'compositeRequest': [dict((k, v) for k, v in r.items() if v is not None) for r in chunk],
+            }), idempotent=all(r['method'] == 'GET' for r in chunk))
+            if response.status_code != 200:
+                raise CompositeError(response)
+            for sub in response.json()['compositeResponse']:
+                result = CompositeResult(sub['referenceId'], sub['httpStatusCode'], sub.get('body'), sub.get('httpHeaders'))
+                known[result.reference_id] = result.body
+                results.append(result)
+        return results
+
+    @staticmethod
+    def _resolve(request, known):
+        if request['body'] is None:
+            return request
+
+        def replace(match):
+            body = known.get(match.group(1))
+            if isinstance(body, dict) and match.group(2) in body:
+                return body[match.group(2)]
+            return match.group(0)
+
+        body = json.loads(_REFERENCE.sub(replace, json.dumps(request['body'])))
+        return dict(request, body=body)
+
+
 class RESTApi(object):
     """
         Salesforce REST API Class
@@ -14,11 +211,22 @@ class RESTApi(object):
                 -example for authenticated headers
                 {
                     'Content-Type': 'application/json',
-                    'X-PrettyPrint': '1',
                     'Authorization': 'Bearer "access_token"'
                 }
+            -Responses are compact JSON (no X-PrettyPrint), callers parse each of them once
+            -Calls go through the pooled session of the org (see get_session) and
+             the API limit aware scheduler of the org (see sf_scheduler)
+            -composite() folds independent calls into Composite API calls
+            -soap_post() calls SOAP APIs (Metadata API), optionally leaving the
+             body unread so it can be streamed with iter_body()
+            -bytes_received counts the response bytes of this instance, calls,
+             bytes and durations also go to metrics.REGISTRY labelled by org host
+            -Userinfo is cached per token in user_info_cache and dropped as soon
+             as any call of that token answers 401/403
     """
 
+    user_info_cache = TTLCache(ttl=60, max_size=256)
+
     def __init__(self, access_token, instance_url, api_version):
         """
         Constructor for RESTApi Class
@@ -29,76 +237,130 @@ class RESTApi(object):
         """
         self.instance = instance_url
         self.api_version = api_version
+        self.access_token = access_token
         self.sf_headers = {
                     'Content-Type': 'application/json',
-                    'X-PrettyPrint': '1',
                     'Authorization': 'Bearer ' + access_token
                 }
+        self.session = get_session(instance_url, access_token)
+        self.token_key = (instance_url, access_token)
+        self.org_label = self.org_label_of(instance_url)
+        self.bytes_received = 0
+        self._stats_lock = threading.Lock()
 
-    def rest_api_get(self, rest_url):
+    @staticmethod
+    def org_label_of(instance_url):
         """
-        GET request to the REST API
-        :return: JSON string of the GET response
+        Name of an org in metrics and sf_scheduler: the host of its instance
+        """
+        return urlsplit(instance_url).netloc or instance_url
+
+    def _url(self, rest_url):
+        """
+        Absolute url of a call, relative urls are resolved against the org instance
         """
         if rest_url.startswith('http:') or rest_url.startswith('https:'):
-            response = requests.get(
-                "{rest_url}".format(
-                    rest_url=rest_url
-                ).replace("{version}", self.api_version),
-                headers=self.sf_headers
-            )
-        else:    
-            response = requests.get(
-                "{org_instance}/{rest_url}".format(
-                    org_instance=self.instance, rest_url=rest_url
-                ).replace("{version}", self.api_version),
-                headers=self.sf_headers
+            url = "{rest_url}".format(rest_url=rest_url)
+        else:
+            url = "{org_instance}/{rest_url}".format(
+                org_instance=self.instance.rstrip('/'), rest_url=rest_url.lstrip('/')
             )
+        return url.replace("{version}", self.api_version)
 
+    def _request(self, method, rest_url, idempotent=None, headers=None, **kwargs):
+        """
+        :param idempotent: the call may be retried, GET and HEAD calls are by default
+        :param headers: headers added to or replacing sf_headers
+        :param stream: requests' stream, the body of a successful response is left
+                       unread and counted by iter_body()
+        """
+        kwargs.setdefault('timeout', SESSION_SETTINGS['timeout'])
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD')
+        start = time.perf_counter()
+        response = sf_scheduler.send(self.org_label, partial(
+            self.session.request,
+            method,
+            self._url(rest_url),
+            headers=dict(self.sf_headers, **headers) if headers else self.sf_headers,
+            **kwargs
+        ), idempotent)
+        elapsed = time.perf_counter() - start
+        metrics.record('sf', elapsed)
+        metrics.REGISTRY.inc('compare_sf_calls_total', org=self.org_label, method=method, status=response.status_code)
+        metrics.REGISTRY.observe('compare_sf_call_seconds', elapsed, org=self.org_label)
+        if not (kwargs.get('stream') and response.status_code == 200):
+            self._received(len(response.content))
+        if response.status_code in (401, 403) and not sf_scheduler.is_limit_error(response):
+            self.user_info_cache.pop(self.token_key)
         return response
 
-    def rest_api_post(self, rest_url, body):
+    def _received(self, size):
+        with self._stats_lock:
+            self.bytes_received += size
+        metrics.REGISTRY.inc('compare_sf_bytes_received_total', size, org=self.org_label)
+
+    def iter_body(self, response, chunk_size=64 * 1024):
+        """
+        Chunks of the body of a streamed response, counted in bytes_received as they arrive
+        """
+        for chunk in response.iter_content(chunk_size):
+            self._received(len(chunk))
+            yield chunk
+
+    def composite(self, composite_url=None, all_or_none=False):
+        """
+        Batch of sub-requests sent through the Composite API
+        :param composite_url: composite resource, ex: urls['tooling_rest'] + 'composite' for tooling calls
+        :return: CompositeBatch
+        """
+        return CompositeBatch(self, composite_url or 'services/data/v{version}/composite', all_or_none)
+
+    def user_info(self):
+        """
+        Userinfo of the token, served from user_info_cache while it is fresh
+        :return: (status_code, JSON dict of the userinfo response), (status_code, body text) when not 200:
+                 an expired or invalid token is answered with a plain text 403 (Bad_OAuth_Token)
+        """
+        info = self.user_info_cache.get(self.token_key)
+        if info is not None:
+            return 200, info
+        response = self.rest_api_get("/services/oauth2/userinfo")
+        if response.status_code != 200:
+            return response.status_code, response.text
+        info = response.json()
+        self.user_info_cache.set(self.token_key, info)
+        return response.status_code, info
+
+    def rest_api_get(self, rest_url):
+        """
+        GET request to the REST API
+        :return: JSON string of the GET response
+        """
+        return self._request('GET', rest_url)
+
+    def rest_api_post(self, rest_url, body, idempotent=False):
         """
         POST request to the REST API
+        :param idempotent: the POST only reads, ex: a composite call made of GETs, and may be retried
         :return: JSON string of the POST response
         """
+        return self._request('POST', rest_url, idempotent=idempotent, data=body)
 
-        if rest_url.startswith('http:') or rest_url.startswith('https:'):
-            response = requests.post(
-                "{rest_url}".format(
-                    rest_url=rest_url
-                ).replace("{version}", self.api_version),
-                data=body,
-                headers=self.sf_headers
-            )
-        else:    
-            response = requests.post(
-                "{org_instance}/{rest_url}".format(
-                    org_instance=self.instance, rest_url=rest_url
-                ).replace("{version}", self.api_version),
-                data=body,
-                headers=self.sf_headers
-            )
-
-        return response
+    def soap_post(self, soap_url, action, envelope, idempotent=False, stream=False):
+        """
+        POST request to a SOAP API, ex: the Metadata API url of the org userinfo
+        :param action: SOAPAction header, ex: 'retrieve'
+        :param idempotent: the call only reads and may be retried
+        :param stream: leave the body unread, to be consumed with iter_body()
+        :return: the response
+        """
+        return self._request('POST', soap_url, idempotent=idempotent, data=envelope.encode('utf-8'), stream=stream,
+                             headers={'Content-Type': 'text/xml; charset=UTF-8', 'SOAPAction': action})
 
     def rest_api_delete(self, rest_url):
         """
         DELETE request to the REST API - Not tested
         :return: JSON string of the DELETE response
         """
-        if rest_url.startswith('http:') or rest_url.startswith('https:'):
-            response = requests.delete(
-                "{rest_url}".format(rest_url=rest_url
-                ).replace("{version}", self.api_version),
-                headers=self.sf_headers
-            )
-        else:    
-            response = requests.delete(
-                "{org_instance}/{rest_url}".format(
-                    org_instance=self.instance, rest_url=rest_url
-                ).replace("{version}", self.api_version),
-                headers=self.sf_headers
-            )
-
-        return response
+        return self._request('DELETE', rest_url)
@@ -1,18 +1,67 @@
-from flask import Flask,render_template,request,jsonify,session,redirect,url_for
+from flask import Flask,render_template,request,jsonify,session,redirect,url_for,Response,stream_with_context,g
+from flask import before_render_template, template_rendered
 import os
 from config import Config
 import requests
 import json
-from REST_Api_ import RESTApi
-from functools import wraps
+from REST_Api_ import RESTApi, CompositeError, configure_sessions
+from ttl_cache import TTLCache
+from concurrent_fetch import run_parallel
+from tooling_query import ToolingQueryError, query_records
+from tooling_deploy import DeployError, start_deploy, deploy_status
+import tooling_query
+from source_compare import NORMALIZE_MODES, DIFFERENT, EQUIVALENT, classify, content_hash, fingerprint, normalize_mode, normalizer
+from diff_engine import DiffResult, line_diff, significant_only
+from diff_cache import DiffCache, cache_key
+import diff_engine
+import diff_pool
+from source_cache import SourceCache
+from jobs import JobStore, DONE
+from org_matrix import build_matrix
+from component_index import ComponentIndex
+from snapshots import SnapshotStore
+from metadata_retrieve import RetrieveError, RetrievedSources, retrieve_sources
+import metadata_retrieve
+import metadata_types
+import concurrent_fetch
+import sf_scheduler
+import metrics
+from functools import wraps, partial
+from collections import OrderedDict
+import re
 import base64
-from urllib.parse import quote
-from diff2html import diff2html as d2h
-import diff_match_patch as dmp_module
+import gzip
+import hashlib
+import time
+from diff2html import diff2html_iter as d2h_iter
 
 app = Flask(__name__)
 app.config.from_object(Config)
 app.debug = True
+configure_sessions(pool_size=app.config['SF_POOL_SIZE'],
+                   max_sessions=app.config['SF_MAX_SESSIONS'],
+                   timeout=(app.config['SF_CONNECT_TIMEOUT'], app.config['SF_READ_TIMEOUT']),
+                   retries=app.config['SF_RETRIES'])
+concurrent_fetch.configure(app.config['ORG_FETCH_WORKERS'])
+diff_engine.DEFAULT_TIMEOUT = app.config['DIFF_TIMEOUT']
+diff_pool.configure(processes=app.config['DIFF_PROCESSES'], serial_below=app.config['DIFF_SERIAL_BELOW_CHARS'])
+sf_scheduler.configure(max_in_flight=app.config['SF_MAX_IN_FLIGHT_PER_ORG'],
+                       retries=app.config['SF_LIMIT_RETRIES'],
+                       backoff_base=app.config['SF_BACKOFF_BASE'],
+                       backoff_max=app.config['SF_BACKOFF_MAX'],
+                       slowdown_at=app.config['SF_LIMIT_SLOWDOWN_AT'],
+                       slowdown_delay=app.config['SF_LIMIT_SLOWDOWN_DELAY'])
+tooling_query.configure(max_in_clause_chars=app.config['QUERY_IN_CLAUSE_CHARS'],
+                        max_in_flight=app.config['QUERY_CHUNKS_IN_FLIGHT'],
+                        max_workers=app.config['QUERY_WORKERS'],
+                        composite=app.config['SF_COMPOSITE'])
+metadata_retrieve.configure(poll_interval=app.config['RETRIEVE_POLL_INTERVAL'], timeout=app.config['RETRIEVE_TIMEOUT'])
+source_cache = SourceCache(app.config['SOURCE_CACHE_PATH'], app.config['SOURCE_CACHE_MAX_BYTES'])
+job_store = JobStore(app.config['JOBS_DB_PATH'], app.config['JOB_WORKERS'], app.config['JOB_STALE_SECONDS'])
+diff_cache = DiffCache(app.config['DIFF_CACHE_MAX_BYTES'], app.config['DIFF_CACHE_PATH'], app.config['DIFF_CACHE_DISK_MAX_BYTES'])
+snapshot_store = SnapshotStore(app.config['SNAPSHOT_DIR'])
+component_index = ComponentIndex(app.config['COMPONENT_INDEX_TTL'], app.config['COMPONENT_INDEX_SIZE'])
+RESTApi.user_info_cache = TTLCache(ttl=app.config['USER_INFO_TTL'], max_size=app.config['USER_INFO_CACHE_SIZE'])
 
 API_VERSION = os.environ['SALESFORCE_API_VERSION']
 CONSUMER_KEY = os.environ['SALESFORCE_CONSUMER_KEY']
@@ -22,26 +71,126 @@ SF_DEF_TOKEN_NAME = 'salesforce_def_token'
 SF_DEF_INSTANCE_URL_TOKEN_NAME = 'salesforce_def_instance_url'
 SF_SEC_TOKEN_NAME = 'salesforce_sec_token'
 SF_SEC_INSTANCE_URL_TOKEN_NAME = 'salesforce_sec_instance_url'
+SF_ORGS_NAME = 'salesforce_orgs'
+DIFF_PARAMS = ('normalize', 'diff_timeout', 'refine', 'context')
+ORG_LABEL = re.compile(r'^[\w-]{1,32}$')
 
 
+@app.before_request
+def start_timings():
+    metrics.start_request()
+
+@app.after_request
+def server_timing_header(response):
+    timings = metrics.current()
+    if timings is not None and app.config['SERVER_TIMING']:
+        # a streamed body is rendered after this point, its time only reaches /metrics
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
+
+@app.teardown_request
+def observe_timings(exc):
+    timings = metrics.current()
+    if timings is not None and not g.get('streamed'):
+        metrics.observe_request(request.endpoint or 'unknown', timings)
+    metrics.end_request()
+
+@before_render_template.connect_via(app)
+def render_started(sender, template, context, **extra):
+    g.setdefault('render_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def render_finished(sender, template, context, **extra):
+    metrics.record('render', time.perf_counter() - g.render_started.pop())
+
+def _session_orgs():
+    """
+    Connected orgs: main and secondary first, then the orgs added under their own label
+    :return: OrderedDict label -> (access_token, instance_url)
+    """
+    orgs = OrderedDict()
+    if SF_DEF_TOKEN_NAME in session and SF_DEF_INSTANCE_URL_TOKEN_NAME in session:
+        orgs['main'] = (session[SF_DEF_TOKEN_NAME], session[SF_DEF_INSTANCE_URL_TOKEN_NAME])
+    if SF_SEC_TOKEN_NAME in session and SF_SEC_INSTANCE_URL_TOKEN_NAME in session:
+        orgs['secondary'] = (session[SF_SEC_TOKEN_NAME], session[SF_SEC_INSTANCE_URL_TOKEN_NAME])
+    for org in session.get(SF_ORGS_NAME, []):
+        orgs[org['label']] = (org['token'], org['instance_url'])
+    return orgs
+
+def _add_session_org(label, access_token, instance_url):
+    orgs = [org for org in session.get(SF_ORGS_NAME, []) if org['label'] != label]
+    orgs.append({'label': label, 'token': access_token, 'instance_url': instance_url})
+    session[SF_ORGS_NAME] = orgs
+
+def _forget_session_org(label):
+    session[SF_ORGS_NAME] = [org for org in session.get(SF_ORGS_NAME, []) if org['label'] != label]
+
+def _logout_org(label):
+    token, instance_url = _session_orgs().get(label, (None, None))
+    RESTApi.user_info_cache.pop((instance_url, token))
+    if label == 'main':
+        session.pop(SF_DEF_TOKEN_NAME, None)
+        session.pop(SF_DEF_INSTANCE_URL_TOKEN_NAME, None)
+    elif label == 'secondary':
+        session.pop(SF_SEC_TOKEN_NAME, None)
+        session.pop(SF_SEC_INSTANCE_URL_TOKEN_NAME, None)
+    else:
+        _forget_session_org(label)
+
+def _resolve_session_orgs(connected):
+    """
+    RESTApi and userinfo of connected orgs, the orgs whose session expired are logged out
+    :param connected: OrderedDict label -> (access_token, instance_url), see _session_orgs
+    :return: OrderedDict label -> (RESTApi, userinfo) of the orgs still connected
+    """
+    rests = [RESTApi(token, instance_url, API_VERSION) for token, instance_url in connected.values()]
+    infos = run_parallel(*[rest.user_info for rest in rests])
+    orgs = OrderedDict()
+    for label, rest, (status, info) in zip(connected, rests, infos):
+        if status in (401, 403):
+            _logout_org(label)
+        elif status == 200:
+            orgs[label] = (rest, info)
+    return orgs
+
+def orgs_required(f=None, minimum=2):
+    """
+    login_required for any number of connected orgs, at least minimum (two by default):
+    f(orgs) where orgs is an OrderedDict label -> (RESTApi, userinfo)
+        ex: @orgs_required or @orgs_required(minimum=1)
+    """
+    if f is None:
+        return partial(orgs_required, minimum=minimum)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        connected = _session_orgs()
+        if len(connected) < minimum:
+            return redirect(url_for('index'))
+        orgs = _resolve_session_orgs(connected)
+        if len(orgs) < len(connected):
+            return redirect(url_for('index'))
+        return f(orgs, *args, **kwargs)
+    return decorated_function
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if SF_DEF_TOKEN_NAME in session and SF_DEF_INSTANCE_URL_TOKEN_NAME in session and SF_SEC_TOKEN_NAME in session and SF_SEC_INSTANCE_URL_TOKEN_NAME in session:
             rest_main_org = RESTApi(session[SF_DEF_TOKEN_NAME],session[SF_DEF_INSTANCE_URL_TOKEN_NAME], API_VERSION)
-            main_org_user_info = rest_main_org.rest_api_get("/services/oauth2/userinfo")            
-            if main_org_user_info.status_code == 403:
+            rest_sec_org = RESTApi(session[SF_SEC_TOKEN_NAME],session[SF_SEC_INSTANCE_URL_TOKEN_NAME], API_VERSION)
+            (main_status, main_org_user_info), (sec_status, sec_org_user_info) = run_parallel(rest_main_org.user_info, rest_sec_org.user_info)
+            if main_status in (401, 403):
                 session.pop(SF_DEF_TOKEN_NAME, None)
                 session.pop(SF_DEF_INSTANCE_URL_TOKEN_NAME, None)
                 return redirect(url_for('index'))
 
-            rest_sec_org = RESTApi(session[SF_SEC_TOKEN_NAME],session[SF_SEC_INSTANCE_URL_TOKEN_NAME], API_VERSION)
-            sec_org_user_info = rest_sec_org.rest_api_get("/services/oauth2/userinfo")
-            
-            if sec_org_user_info.status_code == 403:
+            if sec_status in (401, 403):
                 session.pop(SF_SEC_TOKEN_NAME, None)
                 session.pop(SF_SEC_INSTANCE_URL_TOKEN_NAME, None)
                 return redirect(url_for('index'))
+            if main_status != 200 or sec_status != 200:
+                return redirect(url_for('index'))
             return f(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, *args, **kwargs)
         else:
             return redirect(url_for('index'))
@@ -53,112 +202,49 @@ def index():
     sec_org_user_info = None
     if SF_DEF_TOKEN_NAME in session and SF_DEF_INSTANCE_URL_TOKEN_NAME in session:
         rest_main_org = RESTApi(session[SF_DEF_TOKEN_NAME],session[SF_DEF_INSTANCE_URL_TOKEN_NAME], API_VERSION)
-        main_org_user_info = rest_main_org.rest_api_get("/services/oauth2/userinfo")
+        main_status, main_org_user_info = rest_main_org.user_info()
        
-        if main_org_user_info.status_code == 403:
+        if main_status in (401, 403):
             session.pop(SF_DEF_TOKEN_NAME, None)
             return redirect(url_for('index'))
-        elif main_org_user_info.status_code != 200:
-            return jsonify(main_org_user_info.json())
+        elif main_status != 200:
+            return jsonify({'status': main_status, 'error': main_org_user_info}), 502
 
     if SF_SEC_TOKEN_NAME in session and SF_SEC_INSTANCE_URL_TOKEN_NAME in session:
         rest_sec_org = RESTApi(session[SF_SEC_TOKEN_NAME],session[SF_SEC_INSTANCE_URL_TOKEN_NAME], API_VERSION)
-        sec_org_user_info = rest_sec_org.rest_api_get("/services/oauth2/userinfo")
+        sec_status, sec_org_user_info = rest_sec_org.user_info()
         
-        if sec_org_user_info.status_code == 403:
+        if sec_status in (401, 403):
             session.pop(SF_SEC_TOKEN_NAME, None)
             return redirect(url_for('index'))
-        elif sec_org_user_info.status_code != 200:
-            return jsonify(sec_org_user_info.json())
+        elif sec_status != 200:
+            return jsonify({'status': sec_status, 'error': sec_org_user_info}), 502
         
-    return render_template('index.html', main_org_user_name = None if main_org_user_info is None else main_org_user_info.json().get('name'),
-                    sec_org_user_name = None if sec_org_user_info is None else sec_org_user_info.json().get('name'),
+    other_orgs = [org['label'] for org in session.get(SF_ORGS_NAME, [])]
+    return render_template('index.html', main_org_user_name = None if main_org_user_info is None else main_org_user_info.get('name'),
+                    sec_org_user_name = None if sec_org_user_info is None else sec_org_user_info.get('name'),
+                    other_orgs=other_orgs, matrix=len(_session_orgs()) >= 2,
                     client_key=CONSUMER_KEY)
         
 @app.route('/logout')
 def logout():
-    if request.args.get('org') == 'main':
-        session.pop(SF_DEF_TOKEN_NAME, None)
-        session.pop(SF_DEF_INSTANCE_URL_TOKEN_NAME, None)
-        return redirect(url_for('index'))
-    else:
-        session.pop(SF_SEC_TOKEN_NAME, None)
-        session.pop(SF_SEC_INSTANCE_URL_TOKEN_NAME, None)
-        return redirect(url_for('index'))
+    org = request.args.get('org')
+    # any other value keeps meaning the secondary org
+    _logout_org(org if org == 'main' or org in _session_orgs() else 'secondary')
+    return redirect(url_for('index'))
 
 @app.route('/u')
 @login_required
 def user_info(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    return jsonify(main_org_user_info)
+
+@app.route('/limits')
+def api_limits():
     """
-    query_url_one = main_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT Id,Name,Body,ManageableState from ApexClass WHERE Name = \'TestClass\' AND ManageableState=\'unmanaged\' LIMIT 1')
-    resp_one = rest_main_org.rest_api_get(query_url_one)
-    body_source = resp_one.json().get('records')[0].get('Body')
-    name_source = resp_one.json().get('records')[0].get('Name')
-    s_objects_url = sec_org_user_info.json()['urls']['sobjects'] + 'ApexClass'
-    req_obj ={ "Name" : name_source , "Body" : body_source }
-    
-    resp = rest_sec_org.rest_api_post(s_objects_url,json.dumps(req_obj))
-    return jsonify(resp.json())
-    
-    s_objects_url = main_org_user_info.json()['urls']['sobjects'] + 'ApexClass'    
-    json_str ='{ "Name" : "Mydemoclass1", "Body" : "public class Mydemoclass1{ \n\n public Void sayHello(){ string name= \'HI NAGARAJU\'; system.debug(\'***Name\'+name);}   }" }'
-    print(json.dumps(json_str))
-    #json_str ='{ "Name" : "TestClass", "Body" : "public class TestClass {\n\n    private static String tStr = 'Test class String';\n    \n    \n    public static void method1() {\n        System.debug('do something interesting >>>>');\n    }\n    \n}" }'
-    resp = rest_main_org.rest_api_post(s_objects_url,json_str)
-    print(resp.status_code)
-    print(resp.json())
-    
-    metadata_container_url = main_org_user_info.json()['urls']['tooling_rest'] + 'sobjects/MetadataContainer'
-    json_str = '{"Name":"TestMetadataContainer"}'
-    resp = rest_main_org.rest_api_post(metadata_container_url,json_str)
-    print(resp.status_code)
-    print(resp.json())
-    {'id': '1dc0N000001qnUbQAI', 'success': True, 'errors': [], 'warnings': []}
-    
-    apex_class_member_url = main_org_user_info.json()['urls']['tooling_rest'] + 'sobjects/ApexClassMember'    
-    json_str = '{"MetadataContainerId":"1dc0N000001qnUbQAI","ContentEntityId" : "01p0N00000BFI5UQAX","Body":"public class Mydemoclass1{ public Void sayHello(){ string name= \'HI NAGARAJU\';String Phone = \'9948839625\'; String Email = \'Nag@gmail.com\';system.debug(\'***Name\'+name);}   } "}'
-    resp = rest_main_org.rest_api_post(apex_class_member_url,json_str)
-    print(resp.status_code)
-    print(resp.json())
-    {'id': '4000N0000003WMGQA2', 'success': True, 'errors': [], 'warnings': []}
-    
-    container_async_req_url = main_org_user_info.json()['urls']['tooling_rest'] + 'sobjects/ContainerAsyncRequest'
-    json_str = '{"MetadataContainerId" : "1dc0N000001qnUbQAI", "isCheckOnly": "false"}'
-    resp = rest_main_org.rest_api_post(container_async_req_url,json_str)
-    print(resp.status_code)
-    print(resp.json())
-    {'id': '1dr0N000001MNJ9QAO', 'success': True, 'errors': [], 'warnings': []}
-    
-
-    container_async_req_url = main_org_user_info.json()['urls']['tooling_rest'] + 'sobjects/ContainerAsyncRequest/1dr0N000001MNJ9QAO'    
-    resp = rest_main_org.rest_api_get(container_async_req_url)
-    print(resp.status_code)
-    print(resp.json())
-    {'attributes': {'type': 'ContainerAsyncRequest', 'url': '/services/data/v40.0/tooling/sobjects/ContainerAsyncRequest/1dr0N000001MNJ9QAO'}, 'Id': '1dr0N000001MNJ9QAO', 'IsDeleted': False, 'CreatedDate': '2018-03-13T13:03:40.000+0000', 'CreatedById': '0050N000006ufBmQAI', 'LastModifiedDate': '2018-03-13T13:03:40.000+0000', 'LastModifiedById': '0050N000006ufBmQAI', 'SystemModstamp': '2018-03-13T13:03:40.000+0000', 'MetadataContainerId': '1dc0N000001qnUbQAI', 'MetadataContainerMemberId': None, 'ErrorMsg': None, 'IsRunTests': False, 'State': 'Completed', 'IsCheckOnly': False, 'DeployDetails': {'allComponentMessages': [{'changed': True, 'columnNumber': None, 'componentType': 'ApexClass', 'created': False, 'createdDate': '2018-03-13T13:03:40.621+0000', 'deleted': False, 'fileName': 'classes/Mydemoclass1.cls', 'forPackageManifestFile': False, 'fullName': 'Mydemoclass1', 'id': '01p0N00000BFI5UQAX', 'knownPackagingProblem': False, 'lineNumber': None, 'problem': None, 'problemType': None, 'requiresProductionTestRun': True, 'success': True, 'warning': False}], 'componentFailures': [], 'componentSuccesses': [{'changed': True, 'columnNumber': None, 'componentType': 'ApexClass', 'created': False, 'createdDate': '2018-03-13T13:03:40.621+0000', 'deleted': False, 'fileName': 'classes/Mydemoclass1.cls', 'forPackageManifestFile': False, 'fullName': 'Mydemoclass1', 'id': '01p0N00000BFI5UQAX', 'knownPackagingProblem': False, 'lineNumber': None, 'problem': None, 'problemType': None, 'requiresProductionTestRun': True, 'success': True, 'warning': False}], 'runTestResult': None}}
-    
-    delete_url = main_org_user_info.json()['urls']['sobjects'] + 'ApexClass/01p0N00000BFI5UQAX'    
-    resp = rest_main_org.rest_api_delete(delete_url)
-    print(resp.status_code) #204 No content    
-    """
-    
-    
-    return jsonify(main_org_user_info.json())
-
-
-    """
-        String json ='{ "Name" : "Mydemoclass1", "Body" : "public class Mydemoclass1{ public Void sayHello(){ string name= \'HI NAGARAJU\'; system.debug(\'***Name\'+name);}   }" }';          
-        Httprequest req =new HttpRequest();
-        req.setEndpoint(URL.getSalesforceBaseUrl().toExternalForm()+'/services/data/v28.0/sobjects/ApexClass');
-        req.setMethod('POST');
-        req.setHeader('Content-Type','application/json');
-        req.setHeader('Authorization','OAuth ' + UserInfo.getSessionId());
-        req.setBody(json);
-        Http httpReq =new Http();
-        HttpResponse res = httpReq.send(req);
-        System.debug(res.getBody());
-"""
+    API budget of every connected org as last reported by Salesforce, no call is made
+    """
+    return jsonify(dict((label, sf_scheduler.budget(RESTApi.org_label_of(instance_url)))
+                        for label, (token, instance_url) in _session_orgs().items()))
 
 @app.route('/auth/authorized')
 def authorized():
@@ -186,250 +272,839 @@ def authorized():
         data=body,
         headers=headers
     )
-    if response is None or response.json().get('access_token') is None:
+    token = response.json() if response is not None else {}
+    if token.get('access_token') is None:
         return 'Access denied: reason=%s error=%s' % (
             request.args['error'],
             request.args['error_description']            
         )
 
     if d['org'] == 'main':
-        session[SF_DEF_TOKEN_NAME] = response.json().get('access_token')
-        session[SF_DEF_INSTANCE_URL_TOKEN_NAME] = response.json().get('instance_url')
+        session[SF_DEF_TOKEN_NAME] = token.get('access_token')
+        session[SF_DEF_INSTANCE_URL_TOKEN_NAME] = token.get('instance_url')
+        return redirect(url_for('index'))
+    elif d['org'] != 'secondary' and ORG_LABEL.match(d['org']):
+        _add_session_org(d['org'], token.get('access_token'), token.get('instance_url'))
         return redirect(url_for('index'))
     else:
-        session[SF_SEC_TOKEN_NAME] = response.json().get('access_token')
-        session[SF_SEC_INSTANCE_URL_TOKEN_NAME] = response.json().get('instance_url')
+        session[SF_SEC_TOKEN_NAME] = token.get('access_token')
+        session[SF_SEC_INSTANCE_URL_TOKEN_NAME] = token.get('instance_url')
         return redirect(url_for('index'))
 
+def _cached_sources(rest, user_info, kind, names, seed=None):
+    """
+    Sources of the selected names in an org, only modified ones are downloaded
+    :param seed: bodies already known, see SnapshotStore.seed
+    :return: OrderedDict key -> SourceRecord
+    """
+    return source_cache.fetch(rest, user_info['urls']['tooling_rest'], user_info['organization_id'], kind, names, seed)
+
+def _whole_org_sources(rest, user_info, kinds):
+    """
+    Every unmanaged component of some kinds in an org, through the backend selected by
+    ?backend=tooling|retrieve or SOURCE_BACKEND: tooling queries of the source cache, or
+    a single Metadata API retrieve for all kinds
+    :return: OrderedDict kind -> mapping key -> SourceRecord
+    """
+    if request.values.get('backend', app.config['SOURCE_BACKEND']) == 'retrieve':
+        return retrieve_sources(rest, user_info, kinds)
+    return OrderedDict((kind, _cached_sources(rest, user_info, kind, _list_names(rest, user_info, kind))) for kind in kinds)
+
+def _compare_sources(rest_one, info_one, rest_two, info_two, names):
+    """
+    Sources of several kinds in two orgs, every fetch of both orgs runs in a single run_parallel
+    :param names: OrderedDict kind -> selected names, every unmanaged component of the kind when empty
+    :return: (OrderedDict kind -> sources of the first org, OrderedDict kind -> sources of the second org)
+    """
+    listed = [kind for kind, kind_names in names.items() if kind_names]
+    whole = [kind for kind, kind_names in names.items() if not kind_names]
+    calls = []
+    for kind in listed:
+        calls.append(partial(_cached_sources, rest_one, info_one, kind, names[kind]))
+        calls.append(partial(_cached_sources, rest_two, info_two, kind, names[kind]))
+    if whole:
+        # one call per org, the retrieve backend gets every kind in one retrieve
+        calls.append(partial(_whole_org_sources, rest_one, info_one, whole))
+        calls.append(partial(_whole_org_sources, rest_two, info_two, whole))
+    fetched = run_parallel(*calls)
+    sources_one, sources_two = {}, {}
+    for i, kind in enumerate(listed):
+        sources_one[kind], sources_two[kind] = fetched[2 * i], fetched[2 * i + 1]
+    if whole:
+        sources_one.update(fetched[-2])
+        sources_two.update(fetched[-1])
+    return (OrderedDict((kind, sources_one[kind]) for kind in names),
+            OrderedDict((kind, sources_two[kind]) for kind in names))
+
+def _request_names(kinds):
+    """
+    Names of each kind selected by the request: ?names_<kind>=<comma separated names>,
+    ?names= applies to the kinds without their own parameter
+    :return: OrderedDict kind -> list of names, empty for every component of the kind
+    """
+    shared = request.values.get('names', '')
+    return OrderedDict((kind, [n.strip() for n in request.values.get('names_' + kind, shared).split(',') if n.strip()])
+                       for kind in kinds)
+
+def _result_rows(kind, sources_one, sources_two, normalize):
+    """
+    Rows of the compare pages, one per key of the first org, with the url of their diff fragment
+    """
+    rows = []
+    for key, record_one in sources_one.items():
+        status = _classify(record_one, sources_two.get(key), normalize)
+        rows.append({'name': key,
+                     'status': status,
+                     'diff_present': status == DIFFERENT,
+                     'diff_url': url_for('compare_components_diff', type=kind, component_name=record_one.name, key=key,
+                                         **_diff_params())})
+    return rows
+
+@app.errorhandler(ToolingQueryError)
+@app.errorhandler(DeployError)
+@app.errorhandler(CompositeError)
+def tooling_query_error(error):
+    return jsonify(error.response.json())
+
+@app.errorhandler(RetrieveError)
+def retrieve_error(error):
+    return jsonify({'error': str(error)}), 502
+
 @app.route('/compare/classes',methods=['GET'])
 @login_required
 def compare_classes(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):    
-    query_url = main_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT Id,Name,ManageableState from ApexClass WHERE ManageableState=\'unmanaged\' ORDER BY NAME ASC LIMIT 1000') 
-    resp = rest_main_org.rest_api_get(query_url)
-    if resp.status_code == 200:
-        return render_template('compare_classes.html', options=resp.json()['records'])
-    else:
-        return jsonify(resp.json())
+    return render_template('compare_classes.html', normalize_modes=NORMALIZE_MODES)
 
 @app.route("/compare/classes", methods=['POST'])
 @login_required
 def compare_classes_post(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
     names =request.form.getlist('classes')
-    return redirect(url_for("compare_classes_results", class_names=','.join(names)))
+    if request.form.get('background'):
+        job_id = _start_classes_job(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info,
+                                    names, normalize_mode(request.form.get('normalize')))
+        return redirect(url_for('job_view', job_id=job_id))
+    return redirect(url_for("compare_classes_results", class_names=','.join(names), normalize=request.form.get('normalize')))
 
 @app.route("/compare/classes_result", methods=['GET'])
 @login_required
 def compare_classes_results(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
-    class_names_param = request.args['class_names']
-    class_names = "'"+"','".join(class_names_param.split(","))+"'"
-    
-    query_url_one = main_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT Name,Body,ManageableState from ApexClass WHERE Name IN (' + class_names + ') AND ManageableState=\'unmanaged\' ORDER BY NAME ASC')
-    resp_one = rest_main_org.rest_api_get(query_url_one)
-
-    query_url_two = sec_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT Name,Body,ManageableState from ApexClass WHERE Name IN (' + class_names + ') AND ManageableState=\'unmanaged\' ORDER BY NAME ASC')
-    resp_two = rest_sec_org.rest_api_get(query_url_two)
-    
-    if resp_one.status_code == 200 and resp_two.status_code == 200:
-        resp_one_map = dict((r['Name'],r['Body']) for r in resp_one.json().get('records'))
-        resp_two_map = dict((r['Name'],r['Body']) for r in resp_two.json().get('records'))
-        dmp = dmp_module.diff_match_patch()
-        result = []
-        for key, value in resp_one_map.items():
-            body_one = value
-            body_two = resp_two_map[key] if  key in resp_two_map else ""
-            diff = dmp.diff_main(body_one, body_two)
-            diff_present = bool(0)
-            for op, length in diff:
-                if op != 0: 
-                    diff_present = bool(1)
-                    break
-            """
-            if diff_present:
-                result_html = d2h(diff)
-            else:
-                result_html = '<table class="no-diff"><tr>No differences</tr></table>'
-            """
-            result.append({'name':key, 'diff_present':diff_present})
-        return render_template('compare_classes_results.html', result=result)  
-    else:
-        if resp_one.status_code != 200:
-            return jsonify(resp_one.json())
-        if resp_two.status_code != 200:
-            return jsonify(resp_two.json())
+    class_names = request.args['class_names'].split(",")
+    (sources_one,), (sources_two,) = [fetched.values() for fetched in _compare_sources(
+        rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, {'ApexClass': class_names})]
+    result = _result_rows('ApexClass', sources_one, sources_two, _normalize_mode())
+    return render_template('compare_classes_results.html', result=result, diff_params=_diff_params())  
+
+def stream_template(template_name, **context):
+    """
+    Render a template as a stream, generators in context are consumed while the page is sent
+    """
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(5)
+    g.streamed = True
+    return Response(stream_with_context(metrics.observed_stream(request.endpoint, 'render', stream)))
+
+def _diff_params():
+    """
+    Diff related query parameters of the current request, to forward them to diff links
+    """
+    return dict((k, v) for k, v in request.args.items() if k in DIFF_PARAMS)
+
+def _diff_context():
+    """
+    Equal lines shown around each change: ?context=<lines>, negative values count as 0
+    """
+    return max(request.args.get('context', app.config['DIFF_CONTEXT_LINES'], type=int), 0)
+
+def _diff_options():
+    """
+    Diff settings of the current request: ?diff_timeout=<seconds>&refine=0
+    """
+    return {'timeout': request.args.get('diff_timeout', app.config['DIFF_TIMEOUT'], type=float),
+            'refine': request.args.get('refine') != '0'}
+
+def _normalize_mode():
+    """
+    Normalization mode of the current request: ?normalize=<NORMALIZE_MODES key>
+    """
+    return normalize_mode(request.args.get('normalize'))
+
+def _classify(record_one, record_two, normalize):
+    """
+    Status of a pair of SourceRecord, a missing second record compares as an empty source
+    """
+    if record_two is None:
+        return classify(record_one.body, '', normalize, record_one.hash)
+    return classify(record_one.body, record_two.body, normalize, record_one.hash, record_two.hash)
+
+def _significant(diffs):
+    """
+    Diff array with the hunks hidden by the normalization mode of the request folded into equal text
+    """
+    normalize = _normalize_mode()
+    if normalize == 'exact':
+        return diffs
+    return significant_only(diffs, normalizer(normalize))
+
+def _source(record):
+    """
+    (body, hash) of a SourceRecord, a missing record is an empty source
+    """
+    if record is None:
+        return '', content_hash('')
+    return record.body, record.hash
+
+def _line_diff_key(record_one, record_two):
+    """
+    diff_cache key of the line diff of two SourceRecord with the options of the request
+    """
+    return cache_key('diff', _source(record_one)[1], _source(record_two)[1], dict(_diff_options(), normalize=_normalize_mode()))
+
+def _cached_line_diff(record_one, record_two):
+    """
+    line_diff of two SourceRecord with the options of the request, significant hunks only, memoized in diff_cache
+    :return: DiffResult
+    """
+    key = _line_diff_key(record_one, record_two)
+    cached = diff_cache.get(key)
+    if cached is not None:
+        return DiffResult(cached['diffs'], cached['fell_back'])
+    diff = line_diff(_source(record_one)[0], _source(record_two)[0], **_diff_options())
+    diff = DiffResult(_significant(diff.diffs), diff.fell_back)
+    diff_cache.set(key, {'diffs': diff.diffs, 'fell_back': diff.fell_back})
+    return diff
+
+def _diff_html(record_one, record_two, left_label=None, right_label=None):
+    """
+    Diff table of two SourceRecord, served from diff_cache or rendered while it is streamed and then cached
+    :return: (iterable of html chunks, fell_back)
+    """
+    options = dict(_diff_options(), normalize=_normalize_mode(), context=_diff_context(), labels=[left_label, right_label])
+    key = cache_key('html', _source(record_one)[1], _source(record_two)[1], options)
+    cached = diff_cache.get(key)
+    if cached is not None:
+        return [cached['text']], cached['fell_back']
+    diff = _cached_line_diff(record_one, record_two)
+    chunks = metrics.timed_iter('diff2html', d2h_iter(diff.diffs, left_label, right_label, context=_diff_context()))
+    return diff_cache.capture(key, chunks, {'fell_back': diff.fell_back}), diff.fell_back
+
+def _compare_classes_job(job, rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, class_names, normalize):
+    """
+    Background version of compare_classes_results, every unmanaged class of the main org when class_names is empty
+    """
+    if not class_names:
+        class_names = _list_names(rest_main_org, main_org_user_info, 'ApexClass')
+    job.set_total(len(class_names))
+    batch_size = app.config['JOB_BATCH_SIZE']
+    for i in range(0, len(class_names), batch_size):
+        names = class_names[i:i + batch_size]
+        resp_one_map, resp_two_map = run_parallel(partial(_cached_sources, rest_main_org, main_org_user_info, 'ApexClass', names),
+                                                  partial(_cached_sources, rest_sec_org, sec_org_user_info, 'ApexClass', names))
+        results = []
+        for key, record_one in resp_one_map.items():
+            status = _classify(record_one, resp_two_map.get(key), normalize)
+            results.append({'name': key, 'status': status, 'diff_present': status == DIFFERENT})
+        job.add_results(results, len(names), rest_main_org.bytes_received + rest_sec_org.bytes_received)
+
+def _job_org_ids(main_org_user_info, sec_org_user_info):
+    """
+    Organization ids of the orgs of login_required, the owners of the jobs a session starts and reads
+    """
+    return [main_org_user_info['organization_id'], sec_org_user_info['organization_id']]
+
+def _start_classes_job(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, class_names, normalize):
+    return job_store.submit('classes', json.dumps({'normalize': normalize}), _job_org_ids(main_org_user_info, sec_org_user_info),
+                            _compare_classes_job,
+                            rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, class_names, normalize)
+
+@app.route("/jobs/classes", methods=['POST'])
+@login_required
+def job_start_classes(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    Start a background class comparison: class_names=<comma separated names>, all classes when empty
+    """
+    class_names_param = request.values.get('class_names', '')
+    class_names = [n for n in class_names_param.split(',') if n]
+    job_id = _start_classes_job(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info,
+                                class_names, normalize_mode(request.values.get('normalize')))
+    return jsonify({'id': job_id,
+                    'progress_url': url_for('job_progress', job_id=job_id),
+                    'results_url': url_for('job_results', job_id=job_id)}), 202
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+@login_required
+def job_progress(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, job_id):
+    job = job_store.get(job_id, _job_org_ids(main_org_user_info, sec_org_user_info))
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/results", methods=['GET'])
+@login_required
+def job_results(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, job_id):
+    """
+    Page through the results of a job: ?page=<1 based page>&per_page=<items>
+    """
+    job = job_store.get(job_id, _job_org_ids(main_org_user_info, sec_org_user_info))
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+    return jsonify({'state': job['state'], 'page': page, 'per_page': per_page,
+                    'results': job_store.results(job_id, (page - 1) * per_page, per_page)})
+
+@app.route("/jobs/<job_id>/view", methods=['GET'])
+@login_required
+def job_view(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, job_id):
+    job = job_store.get(job_id, _job_org_ids(main_org_user_info, sec_org_user_info))
+    if job is None:
+        return redirect(url_for('compare_classes'))
+    if job['state'] != DONE:
+        return render_template('job_progress.html', job=job)
+    params = json.loads(job['params'] or '{}')
+    return render_template('compare_classes_results.html', result=job_store.results(job_id),
+                           diff_params={'normalize': normalize_mode(params.get('normalize'))})
 
 @app.route("/compare/classes_diff", methods=['GET'])
 @login_required
 def compare_classes_diff(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
     class_name_param = request.args['class_name']
-    
-    query_url_one = main_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT Name,Body,ManageableState from ApexClass WHERE Name = \'' + class_name_param + '\' AND ManageableState=\'unmanaged\' LIMIT 1')
-    resp_one = rest_main_org.rest_api_get(query_url_one)
-
-    query_url_two = sec_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT Name,Body,ManageableState from ApexClass WHERE Name = \'' + class_name_param + '\' AND ManageableState=\'unmanaged\' LIMIT 1')
-    resp_two = rest_sec_org.rest_api_get(query_url_two)
-    
-    if resp_one.status_code == 200 and resp_two.status_code == 200:
-        body_one = resp_one.json().get('records')[0]['Body'] if len(resp_one.json().get('records')) else ''
-        body_two = resp_two.json().get('records')[0]['Body'] if len(resp_two.json().get('records')) else ''
-        dmp = dmp_module.diff_match_patch()
-        diff = dmp.diff_main(body_one, body_two)
-        result_html = d2h(diff)
-        return render_template('compare_classes_diff.html', result_html=result_html, class_name=class_name_param)
-    else:
-        if resp_one.status_code != 200:
-            return jsonify(resp_one.json())
-        if resp_two.status_code != 200:
-            return jsonify(resp_two.json())
+    sources_one, sources_two = run_parallel(partial(_cached_sources, rest_main_org, main_org_user_info, 'ApexClass', [class_name_param]),
+                                            partial(_cached_sources, rest_sec_org, sec_org_user_info, 'ApexClass', [class_name_param]))
+    result_html, fell_back = _diff_html(sources_one.get(class_name_param), sources_two.get(class_name_param))
+    return stream_template('compare_classes_diff.html', result_html=result_html, class_name=class_name_param, fell_back=fell_back)
 
 @app.route("/compare/classes_deploy", methods=['GET'])
 @login_required
 def compare_classes_deploy(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
-
     """
-    delete_url = main_org_user_info.json()['urls']['sobjects'] + 'ApexClass/01p0N00000BFI5UQAX'    
-    resp = rest_main_org.rest_api_delete(delete_url)
-    print(resp.status_code) #204 No content  
-
-    s_objects_url = main_org_user_info.json()['urls']['sobjects'] + 'ApexClass'
-    json_str ='{ "Name" : "Mydemoclass1", "Body" : "public class Mydemoclass1{ public Void sayHello(){ string name= \'HI NAGARAJU\'; system.debug(\'***Name\'+name);}   }" }'
-    resp = rest_main_org.rest_api_post(s_objects_url,json_str)
-    print(resp.status_code)
-    print(resp.json())
-
+    Deploy classes from one org to the other in a single MetadataContainer:
+    ?class_name=<name>&class_name=<name>... or ?class_names=<comma separated names>, &source=main|secondary
     """
+    class_names = request.args.getlist('class_name') + [n for n in request.args.get('class_names', '').split(',') if n]
+    source_param = request.args['source']
+    sources_one, sources_two = run_parallel(partial(_cached_sources, rest_main_org, main_org_user_info, 'ApexClass', class_names),
+                                            partial(_cached_sources, rest_sec_org, sec_org_user_info, 'ApexClass', class_names))
+    if source_param.lower() == 'main':
+        target, rest_target, target_info, sources, targets = 'secondary', rest_sec_org, sec_org_user_info, sources_one, sources_two
+    else:
+        target, rest_target, target_info, sources, targets = 'main', rest_main_org, main_org_user_info, sources_two, sources_one
 
-    class_name_param = request.args['class_name']
-    source_param = request.args['source']    
-    query_url_one = main_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT Id,Name,Body,ManageableState from ApexClass WHERE Name = \'' + class_name_param + '\' AND ManageableState=\'unmanaged\' LIMIT 1')
-    resp_one = rest_main_org.rest_api_get(query_url_one)
-
-    query_url_two = sec_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT Id,Name,Body,ManageableState from ApexClass WHERE Name = \'' + class_name_param + '\' AND ManageableState=\'unmanaged\' LIMIT 1')
-    resp_two = rest_sec_org.rest_api_get(query_url_two)
-    if resp_one.status_code == 200 and resp_two.status_code == 200:
-        if source_param.lower() == 'main':
-            if len(resp_two.json().get('records')) > 0:                
-                id_to_delete = resp_two.json().get('records')[0].get('Id')                
-                delete_url = sec_org_user_info.json()['urls']['sobjects'] + 'ApexClass/'+id_to_delete                
-                resp = rest_sec_org.rest_api_delete(delete_url)
-                if resp.status_code != 204:
-                    return jsonify(resp.json())
-            
-            if len(resp_one.json().get('records')) > 0:
-
-                body_source = resp_one.json().get('records')[0].get('Body')
-                name_source = resp_one.json().get('records')[0].get('Name')
-                s_objects_url = sec_org_user_info.json()['urls']['sobjects'] + 'ApexClass'
-                req_obj ={ "Name" : name_source , "Body" : body_source }
-                resp = rest_sec_org.rest_api_post(s_objects_url,json.dumps(req_obj))                
-                if resp.status_code != 201:
-                    return jsonify(resp.json())
-        else:
-            if len(resp_one.json().get('records')) > 0:
-                id_to_delete = resp_one.json().get('records')[0].get('Id')
-                delete_url = main_org_user_info.json()['urls']['sobjects'] + 'ApexClass/'+id_to_delete    
-                resp = rest_main_org.rest_api_delete(delete_url)
-                if resp.status_code != 204:
-                    return jsonify(resp.json())
-            
-            if len(resp_two.json().get('records')) > 0:
-                body_source = resp_two.json().get('records')[0].get('Body')
-                name_source = resp_two.json().get('records')[0].get('Name')
-                s_objects_url = main_org_user_info.json()['urls']['sobjects'] + 'ApexClass'
-                req_obj ={ "Name" : name_source , "Body" : body_source }
-                resp = rest_main_org.rest_api_post(s_objects_url,json.dumps(req_obj))                
-                if resp.status_code != 201:
-                    return jsonify(resp.json())
+    deploy = start_deploy(rest_target, target_info['urls'],
+                          dict((name, r.body) for name, r in sources.items()),
+                          dict((name, r.id) for name, r in targets.items()))
+    if deploy['created']:
+        component_index.invalidate(target_info['organization_id'], 'ApexClass')
+    return render_template('compare_classes_deploy.html', deploy=deploy, target=target, class_names=sorted(sources))
 
-        return redirect(url_for('compare_classes'))
+@app.route("/compare/classes_deploy_status", methods=['GET'])
+@login_required
+def compare_classes_deploy_status(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    State of a deploy started by compare_classes_deploy: ?org=main|secondary&request_id=<ContainerAsyncRequest Id>
+    """
+    if request.args['org'] == 'main':
+        status = deploy_status(rest_main_org, main_org_user_info['urls'], request.args['request_id'])
     else:
-        if resp_one.status_code != 200:
-            return jsonify(resp_one.json())
-        if resp_two.status_code != 200:
-            return jsonify(resp_two.json())
+        status = deploy_status(rest_sec_org, sec_org_user_info['urls'], request.args['request_id'])
+    return jsonify(status)
 
 @app.route("/compare/aura", methods=['GET'])
 @login_required
 def compare_aura(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
-    query_url = main_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-         quote('SELECT Id,ApiVersion,Description,DeveloperName,Language'\
-            ',MasterLabel,ManageableState from AuraDefinitionBundle WHERE  ManageableState=\'unmanaged\' ORDER BY DeveloperName ASC LIMIT 1000')
-    resp = rest_main_org.rest_api_get(query_url)
-    if resp.status_code == 200:
-        return render_template('compare_aura.html', options=resp.json()['records'])
-    else:
-        return jsonify(resp.json())
+    return render_template('compare_aura.html', normalize_modes=NORMALIZE_MODES)
 
 @app.route("/compare/aura", methods=['POST'])
 @login_required
 def compare_aura_post(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):    
     names = request.form.getlist('components')
-    return redirect(url_for("compare_aura_results", component_names=','.join(names)))
+    return redirect(url_for("compare_aura_results", component_names=','.join(names), normalize=request.form.get('normalize')))
 
 @app.route("/compare/aura_result", methods=['GET'])
 @login_required
 def compare_aura_results(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
-    component_names_param = request.args['component_names']
-    component_names = "'"+"','".join(component_names_param.split(","))+"'"
-    
-    query_url_one = main_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-            quote('SELECT AuraDefinitionBundle.DeveloperName,AuraDefinitionBundleId,DefType'\
-            ',ManageableState,Source from AuraDefinition WHERE AuraDefinitionBundle.DeveloperName IN (' + component_names + ')'\
-            ' AND ManageableState=\'unmanaged\' AND DefType NOT IN (\'DOCUMENTATION\',\'SVG\') '\
-            ' ORDER BY AuraDefinitionBundle.DeveloperName ASC')
-    resp_one = rest_main_org.rest_api_get(query_url_one)
-
-    query_url_two = sec_org_user_info.json()['urls']['tooling_rest'] +\
-        'query/?q=' +\
-        quote('SELECT AuraDefinitionBundle.DeveloperName,AuraDefinitionBundleId,DefType'\
-            ',ManageableState,Source from AuraDefinition WHERE AuraDefinitionBundle.DeveloperName IN (' + component_names + ')'\
-            ' AND ManageableState=\'unmanaged\' AND DefType NOT IN (\'DOCUMENTATION\',\'SVG\') '\
-            ' ORDER BY AuraDefinitionBundle.DeveloperName ASC')
-    resp_two = rest_sec_org.rest_api_get(query_url_two)
-    
-    if resp_one.status_code == 200 and resp_two.status_code == 200:
-        resp_one_map = dict((r['AuraDefinitionBundle']['DeveloperName'] + r['DefType'],r['Source']) for r in resp_one.json().get('records'))
-        resp_two_map = dict((r['AuraDefinitionBundle']['DeveloperName'] + r['DefType'],r['Source']) for r in resp_two.json().get('records'))
-        dmp = dmp_module.diff_match_patch()
-        result = []
-        for key, value in resp_one_map.items():
-            body_one = value
-            body_two = resp_two_map[key] if  key in resp_two_map else ""
-            diff = dmp.diff_main(body_one, body_two)
-            diff_present = bool(0)
-            for op, length in diff:
-                if op != 0: 
-                    diff_present = bool(1)
-                    break
-
-            if diff_present:
-                result_html = d2h(diff)
+    component_names = request.args['component_names'].split(",")
+    (sources_one,), (sources_two,) = [fetched.values() for fetched in _compare_sources(
+        rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info, {'AuraDefinition': component_names})]
+    result = _result_rows('AuraDefinition', sources_one, sources_two, _normalize_mode())
+    return render_template('compare_aura_results.html', result=result)  
+
+@app.route("/compare/aura_diff", methods=['GET'])
+@login_required
+def compare_aura_diff(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    HTML fragment with the diff of one AuraDefinition, loaded on demand by the results page
+    """
+    return _diff_fragment('AuraDefinition', rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info)
+
+def _diff_fragment(kind, rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    Diff fragment of one record of a kind: ?component_name=<name>&key=<key>, 304 when the client has it
+    """
+    component_name = request.args['component_name']
+    key = request.args['key']
+    sources_one, sources_two = run_parallel(partial(_cached_sources, rest_main_org, main_org_user_info, kind, [component_name]),
+                                            partial(_cached_sources, rest_sec_org, sec_org_user_info, kind, [component_name]))
+    record_one = sources_one.get(key)
+    record_two = sources_two.get(key)
+    etag = hashlib.sha1('{}:{}:{}:{}'.format(kind, record_one.hash if record_one else '',
+                                             record_two.hash if record_two else '',
+                                             request.query_string.decode()).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        result_html, fell_back = _diff_html(record_one, record_two)
+        response = stream_template('compare_components_diff.html', result_html=result_html, fell_back=fell_back)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['DIFF_FRAGMENT_MAX_AGE']
+    return response
+
+@app.route("/compare/components", methods=['GET'])
+@login_required
+def compare_components(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    One picker per type selected by ?type=<kind>&type=<kind>..., Apex classes by default
+    """
+    selected = [kind for kind in request.args.getlist('type') if kind in metadata_types.TYPES] or ['ApexClass']
+    return render_template('compare_components.html', kinds=metadata_types.labels(), selected=selected,
+                           normalize_modes=NORMALIZE_MODES)
+
+@app.route("/compare/components", methods=['POST'])
+@login_required
+def compare_components_post(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    kinds = [kind for kind in request.form.getlist('type') if kind in metadata_types.TYPES]
+    names = dict(('names_' + kind, ','.join(request.form.getlist('names_' + kind))) for kind in kinds
+                 if request.form.getlist('names_' + kind))
+    if not names:
+        return redirect(url_for('compare_components', type=kinds))
+    return redirect(url_for('compare_components_results', types=','.join(k for k in kinds if 'names_' + k in names),
+                            normalize=request.form.get('normalize'), **names))
+
+@app.route("/compare/components_result", methods=['GET'])
+@login_required
+def compare_components_results(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    Several types compared in one page: ?types=<comma separated kinds>&names_<kind>=<comma separated names>
+    (every unmanaged component of a kind without names)&normalize=<mode>
+    """
+    kinds = metadata_types.parse(request.args.get('types'), ['ApexClass'])
+    sources_one, sources_two = _compare_sources(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info,
+                                                _request_names(kinds))
+    normalize = _normalize_mode()
+    sections = [(metadata_types.get(kind).label, _result_rows(kind, sources_one[kind], sources_two[kind], normalize))
+                for kind in kinds]
+    return render_template('compare_components_results.html', sections=sections, kinds=kinds)
+
+@app.route("/compare/components_diff", methods=['GET'])
+@login_required
+def compare_components_diff(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    HTML fragment with the diff of one record: ?type=<kind>&component_name=<name>&key=<key>
+    """
+    kind = request.args.get('type')
+    if kind not in metadata_types.TYPES:
+        return jsonify({'error': 'unknown type'}), 400
+    return _diff_fragment(kind, rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info)
+
+API_PARAMS = ('names', 'normalize', 'diff', 'context', 'diff_timeout', 'refine')
+
+def _list_names(rest, user_info, kind):
+    """
+    Names of every unmanaged component of a kind in the org
+    """
+    metadata_type = metadata_types.get(kind)
+    return [r[metadata_type.list_name_field] for r in query_records(rest, user_info['urls']['tooling_rest'], metadata_type.list_soql())]
+
+def _api_diffs(pairs, diff_format, labels=('main', 'secondary')):
+    """
+    Diffs of many API items: served from diff_cache, the others computed on diff_pool, largest pairs first
+    :param pairs: dict (kind, key) -> (record_one, record_two)
+    :param diff_format: 'unified' or 'structured'
+    :param labels: names of the two sides in the unified diff headers, ex: the orgs or snapshots compared
+    :return: dict (kind, key) -> unified diff text or {'ops', 'fell_back'}
+    """
+    options = _diff_options()
+    results = {}
+    keys = {}
+    tasks = []
+    for key, (record_one, record_two) in pairs.items():
+        (body_one, hash_one), (body_two, hash_two) = _source(record_one), _source(record_two)
+        name = key[1]
+        if diff_format == 'unified':
+            keys[key] = cache_key('unified', hash_one, hash_two, {'key': name, 'context': _diff_context(), 'labels': list(labels)})
+            args = (body_one, body_two, labels[0] + '/' + name, labels[1] + '/' + name, _diff_context())
+        else:
+            keys[key] = _line_diff_key(record_one, record_two)
+            args = (body_one, body_two, options['timeout'], options['refine'])
+        cached = diff_cache.get(keys[key])
+        if cached is None:
+            tasks.append((key, args))
+        else:
+            results[key] = cached
+    for key, value in diff_pool.diff_many(diff_pool.unified_diff if diff_format == 'unified' else diff_pool.line_diff, tasks):
+        if diff_format != 'unified':
+            diffs, fell_back = value
+            value = {'diffs': _significant(diffs), 'fell_back': fell_back}
+        diff_cache.set(keys[key], value)
+        results[key] = value
+    if diff_format == 'unified':
+        return results
+    return dict((key, {'ops': value['diffs'], 'fell_back': value['fell_back']}) for key, value in results.items())
+
+def _api_items(sources_one, sources_two, normalize, diff_format, labels=('main', 'secondary')):
+    """
+    One item per key of either org: status, content hashes and the diff when asked for
+    """
+    return _api_kind_items(OrderedDict([(None, (sources_one, sources_two))]), normalize, diff_format, labels)[None]
+
+def _api_kind_items(sources, normalize, diff_format, labels=('main', 'secondary')):
+    """
+    _api_items of several kinds, the diffs of every kind go to diff_pool as one batch
+    :param sources: OrderedDict kind -> (sources of the first org, sources of the second org)
+    :param labels: names of the two sides, see _api_diffs
+    :return: OrderedDict kind -> items
+    """
+    result = OrderedDict()
+    pairs = OrderedDict()
+    for kind, (sources_one, sources_two) in sources.items():
+        items = result[kind] = []
+        for key in sorted(set(sources_one) | set(sources_two)):
+            record_one = sources_one.get(key)
+            record_two = sources_two.get(key)
+            if record_one is None:
+                status = 'missing_main'
+            elif record_two is None:
+                status = 'missing_secondary'
             else:
-                result_html = '<table class="no-diff"><tr>No differences</tr></table>'
-            result.append({'name':key, 'result_html' : result_html})
-        return render_template('compare_aura_results.html', result=result)  
+                status = _classify(record_one, record_two, normalize)
+            item = {'key': key, 'name': (record_one or record_two).name, 'status': status,
+                    'hash_main': record_one.hash if record_one else None,
+                    'hash_secondary': record_two.hash if record_two else None}
+            if normalize != 'exact':
+                item['fingerprint_main'] = fingerprint(record_one.body, normalize, record_one.hash) if record_one else None
+                item['fingerprint_secondary'] = fingerprint(record_two.body, normalize, record_two.hash) if record_two else None
+            if diff_format in ('unified', 'structured') and status not in ('identical', EQUIVALENT):
+                pairs[(kind, key)] = (record_one, record_two)
+            items.append(item)
+    if pairs:
+        diffs = _api_diffs(pairs, diff_format, labels)
+        for kind, items in result.items():
+            for item in items:
+                if (kind, item['key']) in diffs:
+                    item['diff'] = diffs[(kind, item['key'])]
+    return result
+
+def _api_response(etag, build):
+    """
+    JSON response with a strong ETag, 304 when the client already has it, gzipped when accepted.
+    The gzipped representation gets its own tag, build() only runs when a body is sent.
+    """
+    gzipped = app.config['API_GZIP'] and request.accept_encodings['gzip'] > 0
+    tag = etag + '-gzip' if gzipped else etag
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
     else:
-        if resp_one.status_code != 200:
-            return jsonify(resp_one.json())
-        if resp_two.status_code != 200:
-            return jsonify(resp_two.json())
+        body = json.dumps(build(), separators=(',', ':')).encode('utf-8')
+        response = Response(gzip.compress(body, app.config['API_GZIP_LEVEL']) if gzipped else body, mimetype='application/json')
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(tag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _api_compare(kinds, rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    JSON comparison of several kinds, one type object per kind
+    :return: (ETag, function building the body)
+    """
+    sources_one, sources_two = _compare_sources(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info,
+                                                _request_names(kinds))
+    normalize = _normalize_mode()
+    diff_format = request.args.get('diff')
+    hashes = [(kind, key, sources_one[kind][key].hash if key in sources_one[kind] else None,
+               sources_two[kind][key].hash if key in sources_two[kind] else None)
+              for kind in kinds for key in sorted(set(sources_one[kind]) | set(sources_two[kind]))]
+    options = sorted((k, v) for k, v in request.args.items() if k in API_PARAMS and k != 'names')
+    etag = hashlib.sha1(json.dumps([kinds, main_org_user_info['organization_id'], sec_org_user_info['organization_id'],
+                                    options, hashes]).encode()).hexdigest()
+
+    def build():
+        types = OrderedDict()
+        for kind, items in _api_kind_items(OrderedDict((kind, (sources_one[kind], sources_two[kind])) for kind in kinds),
+                                           normalize, diff_format).items():
+            types[kind] = {'type': kind,
+                           'differences': sum(1 for item in items if item['status'] not in ('identical', EQUIVALENT)),
+                           'items': items}
+        return {'main': main_org_user_info['organization_id'],
+                'secondary': sec_org_user_info['organization_id'],
+                'normalize': normalize,
+                'types': types}
+    return etag, build
+
+def _api_compare_kind(kind, rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    etag, build = _api_compare([kind], rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info)
 
+    def build_kind():
+        body = build()
+        compared = body.pop('types')[kind]
+        body.update(type=kind, differences=compared['differences'], items=compared['items'])
+        return body
+    return _api_response(etag, build_kind)
+
+@app.route("/api/compare/classes", methods=['GET'])
+@login_required
+def api_compare_classes(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    Class comparison as JSON: ?names=<comma separated names, all unmanaged classes when empty>
+    &normalize=<mode>&diff=unified|structured
+    """
+    return _api_compare_kind('ApexClass', rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info)
+
+@app.route("/api/compare/aura", methods=['GET'])
+@login_required
+def api_compare_aura(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    Aura comparison as JSON: ?names=<comma separated bundle names, all unmanaged bundles when empty>
+    &normalize=<mode>&diff=unified|structured
+    """
+    return _api_compare_kind('AuraDefinition', rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info)
+
+@app.route("/api/compare", methods=['GET'])
+@login_required
+def api_compare(rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info):
+    """
+    Several types compared as JSON in one request: ?types=<comma separated metadata_types names>
+    &names=<comma separated names>&names_<type>=<names of one type>(every unmanaged component when empty)
+    &normalize=<mode>&diff=unified|structured
+    """
+    kinds = metadata_types.parse(request.args.get('types'))
+    if not kinds:
+        return jsonify({'error': 'unknown type', 'types': list(metadata_types.TYPES)}), 400
+    return _api_response(*_api_compare(kinds, rest_main_org, main_org_user_info, rest_sec_org, sec_org_user_info))
+
+@app.route("/compare/matrix", methods=['GET'])
+@orgs_required
+def compare_matrix(orgs):
+    return render_template('compare_matrix.html', orgs=list(orgs), kinds=metadata_types.labels(), normalize_modes=NORMALIZE_MODES)
+
+@app.route("/compare/matrix_result", methods=['GET'])
+@orgs_required
+def compare_matrix_results(orgs):
+    """
+    Drift matrix: ?type=<metadata_types name>&org=<label>&org=<label>...(all connected orgs when none)
+    &names=<comma separated names, every unmanaged component of the orgs when empty>&normalize=<mode>&format=json
+    """
+    kind = request.args.get('type', 'ApexClass')
+    if kind not in metadata_types.TYPES:
+        return jsonify({'error': 'unknown type'}), 400
+    selected = [label for label in request.args.getlist('org') if label in orgs] or list(orgs)
+    names = [n.strip() for n in request.args.get('names', '').split(',') if n.strip()]
+    if names:
+        fetched = run_parallel(*[partial(_cached_sources, orgs[label][0], orgs[label][1], kind, names) for label in selected])
+    else:
+        fetched = [sources[kind] for sources in
+                   run_parallel(*[partial(_whole_org_sources, orgs[label][0], orgs[label][1], [kind]) for label in selected])]
+    normalize = _normalize_mode()
+    rows = build_matrix(OrderedDict(zip(selected, fetched)), normalize)
+    if request.args.get('format') == 'json':
+        return jsonify({'type': kind, 'orgs': selected, 'normalize': normalize, 'rows': rows})
+    return render_template('compare_matrix_results.html', rows=rows, orgs=selected, kind=kind, kinds=metadata_types.labels(),
+                           diff_params=_diff_params())
+
+@app.route("/compare/matrix_diff", methods=['GET'])
+@orgs_required
+def compare_matrix_diff(orgs):
+    """
+    Diff of one component between two orgs of the matrix: ?type=<kind>&name=<name>&key=<key>&left=<org>&right=<org>
+    """
+    kind = request.args['type']
+    name = request.args['name']
+    key = request.args['key']
+    left = request.args['left']
+    right = request.args['right']
+    if kind not in metadata_types.TYPES or left not in orgs or right not in orgs:
+        return redirect(url_for('compare_matrix'))
+    sources_one, sources_two = run_parallel(partial(_cached_sources, orgs[left][0], orgs[left][1], kind, [name]),
+                                            partial(_cached_sources, orgs[right][0], orgs[right][1], kind, [name]))
+    result_html, fell_back = _diff_html(sources_one.get(key), sources_two.get(key), left, right)
+    return stream_template('compare_matrix_diff.html', result_html=result_html, key=key, left=left, right=right, fell_back=fell_back)
+
+SNAPSHOT_SIDE = 'snapshot:'
+
+def _connected_org(label):
+    """
+    One connected org by label, without requiring any other org
+    :return: (RESTApi, userinfo), None when the org is not connected or its session expired
+    """
+    token, instance_url = _session_orgs().get(label, (None, None))
+    if token is None:
+        return None
+    rest = RESTApi(token, instance_url, API_VERSION)
+    status, info = rest.user_info()
+    if status in (401, 403):
+        _logout_org(label)
+    if status != 200:
+        return None
+    return rest, info
+
+def _org_ids(orgs):
+    """
+    Organization ids of the orgs of orgs_required, the owners a session reads snapshots for
+    """
+    return [info['organization_id'] for rest, info in orgs.values()]
+
+def _snapshot_side(side, orgs):
+    """
+    Resolve a compare side: 'snapshot:<id>' owned by one of orgs or the label of one of orgs
+    :return: ('snapshot', manifest) or ('org', (RESTApi, userinfo)), None when neither exists
+    """
+    if side.startswith(SNAPSHOT_SIDE):
+        manifest = snapshot_store.manifest(side[len(SNAPSHOT_SIDE):], _org_ids(orgs))
+        return None if manifest is None else ('snapshot', manifest)
+    return ('org', orgs[side]) if side in orgs else None
+
+def _side_label(side, resolved):
+    if resolved[0] == 'snapshot':
+        return '{} ({})'.format(resolved[1]['label'], resolved[1]['id'])
+    return side
+
+def _side_names(resolved, kind):
+    if resolved[0] == 'snapshot':
+        return set(item['name'] for item in resolved[1]['items'] if item['kind'] == kind)
+    rest, info = resolved[1]
+    return set(_list_names(rest, info, kind))
+
+def _side_sources(resolved, other, kind, names):
+    """
+    Sources of one side. A live org compared with a snapshot of itself only downloads
+    the bodies whose SystemModstamp differs from the manifest.
+    :return: OrderedDict key -> SourceRecord
+    """
+    if resolved[0] == 'snapshot':
+        return snapshot_store.load(resolved[1], kind, names)
+    rest, info = resolved[1]
+    seed = None
+    if other[0] == 'snapshot' and other[1]['org_id'] == info['organization_id']:
+        seed = snapshot_store.seed(other[1], kind)
+    return _cached_sources(rest, info, kind, names, seed)
+
+def _resolve_sides(orgs):
+    """
+    Both sides and the component type of a snapshot comparison: ?left=<side>&right=<side>&type=<kind>
+    :return: (left, right, kind), None when a side does not resolve
+    """
+    kind = request.args.get('type', 'ApexClass')
+    left = _snapshot_side(request.args.get('left', ''), orgs)
+    right = _snapshot_side(request.args.get('right', ''), orgs)
+    if kind not in metadata_types.TYPES or left is None or right is None:
+        return None
+    return left, right, kind
+
+@app.route("/snapshots", methods=['GET'])
+@orgs_required(minimum=1)
+def snapshots(orgs):
+    """
+    Snapshots owned by the connected orgs
+    """
+    return render_template('snapshots.html', snapshots=snapshot_store.list(_org_ids(orgs)), orgs=list(orgs),
+                           kinds=metadata_types.labels(), normalize_modes=NORMALIZE_MODES)
+
+@app.route("/snapshots", methods=['POST'])
+@orgs_required(minimum=1)
+def snapshot_create(orgs):
+    """
+    Snapshot every unmanaged component of a connected org: org=<label>&label=<snapshot label>
+    &type=<kind>&type=<kind>... (every registered type when none). Every org of the session owns it.
+    """
+    if request.form.get('org') not in orgs:
+        return redirect(url_for('index'))
+    rest, info = orgs[request.form['org']]
+    kinds = [kind for kind in request.form.getlist('type') if kind in metadata_types.TYPES] or list(metadata_types.TYPES)
+    sources = _whole_org_sources(rest, info, kinds)
+    snapshot_store.create(request.form.get('label') or request.form['org'], info['organization_id'], info.get('name'),
+                          sources, owners=_org_ids(orgs),
+                          seedable=not any(isinstance(records, RetrievedSources) for records in sources.values()))
+    return redirect(url_for('snapshots'))
+
+@app.route("/snapshots/compare", methods=['GET'])
+@orgs_required(minimum=1)
+def snapshot_compare(orgs):
+    """
+    Compare snapshots and live orgs: ?left=<snapshot:id or org label>&right=<snapshot:id or org label>
+    &type=<metadata_types name>&names=<comma separated names, every component of both sides when empty>
+    &normalize=<mode>&format=json. Two snapshots compare offline, without any Salesforce call
+    besides the login check, only snapshots owned by a connected org resolve.
+    """
+    sides = _resolve_sides(orgs)
+    if sides is None:
+        return redirect(url_for('snapshots'))
+    left, right, kind = sides
+    names = [n.strip() for n in request.args.get('names', '').split(',') if n.strip()]
+    if not names:
+        names = sorted(_side_names(left, kind) | _side_names(right, kind))
+    sources_one, sources_two = run_parallel(partial(_side_sources, left, right, kind, names),
+                                            partial(_side_sources, right, left, kind, names))
+    normalize = _normalize_mode()
+    items = _api_items(sources_one, sources_two, normalize, request.args.get('diff'),
+                       (request.args['left'], request.args['right']))
+    if request.args.get('format') == 'json':
+        return jsonify({'type': kind, 'left': request.args['left'], 'right': request.args['right'],
+                        'normalize': normalize, 'items': items})
+    return render_template('snapshot_compare_results.html', items=items, kind=kind, kinds=metadata_types.labels(),
+                           left=request.args['left'], right=request.args['right'],
+                           left_label=_side_label(request.args['left'], left),
+                           right_label=_side_label(request.args['right'], right), diff_params=_diff_params())
+
+@app.route("/snapshots/diff", methods=['GET'])
+@orgs_required(minimum=1)
+def snapshot_diff(orgs):
+    """
+    Diff of one component between two sides: ?left=<side>&right=<side>&type=<kind>&name=<name>&key=<key>
+    """
+    sides = _resolve_sides(orgs)
+    if sides is None:
+        return redirect(url_for('snapshots'))
+    left, right, kind = sides
+    name = request.args['name']
+    key = request.args['key']
+    sources_one, sources_two = run_parallel(partial(_side_sources, left, right, kind, [name]),
+                                            partial(_side_sources, right, left, kind, [name]))
+    left_label = _side_label(request.args['left'], left)
+    right_label = _side_label(request.args['right'], right)
+    result_html, fell_back = _diff_html(sources_one.get(key), sources_two.get(key), left_label, right_label)
+    return stream_template('snapshot_diff.html', result_html=result_html, key=key,
+                           left_label=left_label, right_label=right_label, fell_back=fell_back)
+
+@app.route("/api/components", methods=['GET'])
+def api_components():
+    """
+    Typeahead of the pickers: ?type=<metadata_types name>&q=<prefix or part of a name>&offset=&limit=
+    &org=<label, main by default>&refresh=1. Names starting with q come first, then names containing it.
+    """
+    kind = request.args.get('type', 'ApexClass')
+    if kind not in metadata_types.TYPES:
+        return jsonify({'error': 'unknown type'}), 400
+    org = _connected_org(request.args.get('org', 'main'))
+    if org is None:
+        return jsonify({'error': 'not connected'}), 401
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    index = component_index.get(org[0], org[1], kind, refresh=request.args.get('refresh') == '1')
+    total, page = index.search(request.args.get('q', '').strip(), offset, limit)
+    return jsonify({'type': kind, 'size': len(index), 'total': total, 'offset': offset,
+                    'next_offset': offset + len(page) if offset + len(page) < total else None,
+                    'items': [{'name': c.name, 'modstamp': c.modstamp} for c in page]})
+
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    """
+    Counters and histograms of the worker process in the Prometheus text format
+    """
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 	
 if __name__ == "__main__":
-	app.run()
\ No newline at end of file
+	app.run()
@@ -0,0 +1,194 @@
+"""
+Benchmark of the compare pipeline against the local mock Salesforce (mock_sf.py).
+
+Drives the app routes through the Flask test client for corpora of several
+sizes and reports, per scenario:
+
+    -p50/p95 latency of the warm runs and latency of the cold (first) run
+    -outbound calls and bytes received by the mock per run
+    -CPU time spent in line_diff by the cold run
+    -peak Python memory of one cold run (tracemalloc)
+
+A cold run starts from an empty source cache and an empty diff cache, warm
+runs reuse both, as repeated page loads of a worker do.
+
+    python benchmark.py --sizes 10 100 1000 --repeat 5 --latency 0.02
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+_workdir = tempfile.mkdtemp(prefix='compare-bench-')
+os.environ.setdefault('SALESFORCE_API_VERSION', '42.0')
+os.environ.setdefault('SALESFORCE_CONSUMER_KEY', 'benchmark')
+os.environ.setdefault('SALESFORCE_CONSUMER_SECRET', 'benchmark')
+os.environ.setdefault('SALESFORCE_REDIRECT_URI', 'http://localhost/auth/authorized')
+os.environ['SOURCE_CACHE_PATH'] = os.path.join(_workdir, 'sources.sqlite3')
+os.environ['JOBS_DB_PATH'] = os.path.join(_workdir, 'jobs.sqlite3')
+
+import app as app_module
+from diff_cache import DiffCache
+from mock_sf import MockSalesforce, generate_corpus
+from source_cache import SourceCache
+
+
+class DiffTimer(object):
+    """
+    Wraps app.line_diff and sums the CPU time spent in it
+    """
+
+    def __init__(self):
+        self.cpu = 0.0
+        self.line_diff = app_module.line_diff
+
+    def __call__(self, *args, **kwargs):
+        start = time.process_time()
+        try:
+            return self.line_diff(*args, **kwargs)
+        finally:
+            self.cpu += time.process_time() - start
+
+    def install(self):
+        app_module.line_diff = self
+
+    def uninstall(self):
+        app_module.line_diff = self.line_diff
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def _client(instance_url):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session[app_module.SF_DEF_TOKEN_NAME] = 'main'
+        session[app_module.SF_DEF_INSTANCE_URL_TOKEN_NAME] = instance_url
+        session[app_module.SF_SEC_TOKEN_NAME] = 'secondary'
+        session[app_module.SF_SEC_INSTANCE_URL_TOKEN_NAME] = instance_url
+    return client
+
+
+def scenarios(orgs):
+    """
+    :return: list of (name, url) driven for a corpus
+    """
+    main, secondary = orgs['main'], orgs['secondary']
+    classes = [r['Name'] for r in main.records['ApexClass'].values()]
+    other = dict((r['Name'], r['Body']) for r in secondary.records['ApexClass'].values())
+    changed = [r['Name'] for r in main.records['ApexClass'].values() if other.get(r['Name']) != r['Body']]
+    bundles = [r['DeveloperName'] for r in main.records['AuraDefinitionBundle'].values()]
+    diff_class = changed[0] if changed else classes[0]
+    aura = next(iter(main.records['AuraDefinition'].values()))
+    return [
+        ('classes_result', '/compare/classes_result?class_names=' + ','.join(classes)),
+        ('classes_diff', '/compare/classes_diff?class_name=' + diff_class),
+        ('aura_result', '/compare/aura_result?component_names=' + ','.join(bundles)),
+        ('aura_diff', '/compare/aura_diff?component_name={0}&key={0}{1}'.format(
+            aura['AuraDefinitionBundle.DeveloperName'], aura['DefType'])),
+    ]
+
+
+def _empty_caches():
+    """
+    New empty source cache and diff cache (memory tier only) for a cold run
+    """
+    app_module.source_cache = SourceCache(os.path.join(_workdir, 'sources-%d.sqlite3' % time.time_ns()),
+                                          app_module.app.config['SOURCE_CACHE_MAX_BYTES'])
+    app_module.diff_cache = DiffCache(app_module.app.config['DIFF_CACHE_MAX_BYTES'])
+
+
+def run_scenario(mock, client, url, repeat):
+    """
+    One cold run on empty caches, then `repeat` warm runs
+    :return: dict of measurements
+    """
+    _empty_caches()
+    app_module.RESTApi.user_info_cache.clear()
+    timer = DiffTimer()
+    timer.install()
+    try:
+        latencies = []
+        calls = []
+        received = []
+        cold_diff_cpu = 0.0
+        for i in range(repeat + 1):
+            mock.reset_counters()
+            start = time.perf_counter()
+            response = client.get(url)
+            body = response.get_data()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError('{} answered {}: {}'.format(url, response.status_code, body[:200]))
+            calls.append(mock.total_calls())
+            received.append(mock.bytes_sent)
+            if i == 0:
+                cold_diff_cpu = timer.cpu
+    finally:
+        timer.uninstall()
+    return {
+        'cold': latencies[0],
+        'p50': percentile(latencies[1:] or latencies, 50),
+        'p95': percentile(latencies[1:] or latencies, 95),
+        'cold_calls': calls[0],
+        'warm_calls': calls[-1],
+        'cold_bytes': received[0],
+        'diff_cpu': cold_diff_cpu,
+    }
+
+
+def peak_memory(client, url):
+    """
+    Peak traced memory of one cold run
+    """
+    _empty_caches()
+    tracemalloc.start()
+    try:
+        client.get(url).get_data()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='number of classes')
+    parser.add_argument('--repeat', type=int, default=5, help='warm runs per scenario')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each mock call')
+    parser.add_argument('--diff-rate', type=float, default=0.1)
+    parser.add_argument('--class-lines', type=int, default=200)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    args = parser.parse_args()
+
+    header = '{:>6} {:<15} {:>9} {:>9} {:>9} {:>6} {:>6} {:>10} {:>9} {:>9}'.format(
+        'size', 'scenario', 'cold ms', 'p50 ms', 'p95 ms', 'calls', 'warm', 'bytes', 'diff ms', 'peak MB')
+    print(header)
+    print('-' * len(header))
+    try:
+        for size in args.sizes:
+            orgs = generate_corpus(classes=size, bundles=max(size // 10, 1), diff_rate=args.diff_rate,
+                                   class_lines=args.class_lines)
+            mock = MockSalesforce(orgs, latency=args.latency)
+            instance_url = mock.serve()
+            try:
+                client = _client(instance_url)
+                for name, url in scenarios(orgs):
+                    stats = run_scenario(mock, client, url, args.repeat)
+                    peak = None if args.no_memory else peak_memory(client, url)
+                    print('{:>6} {:<15} {:>9.1f} {:>9.1f} {:>9.1f} {:>6} {:>6} {:>10} {:>9.1f} {:>9}'.format(
+                        size, name, stats['cold'] * 1000, stats['p50'] * 1000, stats['p95'] * 1000,
+                        stats['cold_calls'], stats['warm_calls'], stats['cold_bytes'], stats['diff_cpu'] * 1000,
+                        '-' if peak is None else '%.1f' % (peak / 1048576.0)))
+            finally:
+                mock.shutdown()
+    finally:
+        shutil.rmtree(_workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
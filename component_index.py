@@ -0,0 +1,97 @@
+"""
+Per-org index of component names for the class and bundle pickers.
+
+The names and SystemModstamps of every unmanaged component of a
+metadata_types type (classes, bundles...) of an org are queried once, following every
+nextRecordsUrl, and kept for a TTL. The pickers then page through the index
+with a typeahead (search) instead of rendering every record of the org.
+
+Concurrent requests for an index being built wait for that build instead of
+querying the org again.
+"""
+import bisect
+import threading
+from collections import namedtuple
+
+import metadata_types
+from tooling_query import query_records
+from ttl_cache import TTLCache
+
+Component = namedtuple('Component', ['name', 'id', 'modstamp'])
+
+class Index(object):
+    """
+    Components of one kind in one org, sorted by lower case name
+    """
+
+    def __init__(self, components):
+        self.components = sorted(components, key=lambda c: c.name.lower())
+        self._lower = [c.name.lower() for c in self.components]
+
+    def __len__(self):
+        return len(self.components)
+
+    def search(self, query, offset=0, limit=50):
+        """
+        Names starting with query first, then names containing it, case insensitive
+        :return: (total number of matches, list of Component of the page)
+        """
+        query = (query or '').lower()
+        if not query:
+            return len(self.components), self.components[offset:offset + limit]
+        start = bisect.bisect_left(self._lower, query)
+        end = start
+        while end < len(self._lower) and self._lower[end].startswith(query):
+            end += 1
+        prefixed = list(range(start, end))
+        contained = [i for i, name in enumerate(self._lower) if query in name and not start <= i < end]
+        matches = prefixed + contained
+        return len(matches), [self.components[i] for i in matches[offset:offset + limit]]
+
+
+class ComponentIndex(object):
+    """
+        Index of every org and kind, built on first use and kept ttl seconds
+            -get() returns the Index of an org, querying it when missing or expired
+            -invalidate() drops one, ex: after a deploy
+    """
+
+    def __init__(self, ttl, max_size):
+        """
+        Constructor for ComponentIndex Class
+        :param ttl: seconds an index is served before being queried again
+        :param max_size: max number of (org, kind) indexes kept
+        """
+        self.cache = TTLCache(ttl=ttl, max_size=max_size)
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def get(self, rest, user_info, kind, refresh=False):
+        """
+        :param kind: name of a metadata_types type
+        :param refresh: query the org even when the index is fresh
+        :return: Index
+        """
+        key = (user_info['organization_id'], kind)
+        index = None if refresh else self.cache.get(key)
+        if index is not None:
+            return index
+        with self._lock:
+            build_lock = self._building.setdefault(key, threading.Lock())
+        with build_lock:
+            # built by the request holding the lock before this one
+            index = None if refresh else self.cache.get(key)
+            if index is None:
+                index = self._build(rest, user_info, kind)
+                self.cache.set(key, index)
+        with self._lock:
+            self._building.pop(key, None)
+        return index
+
+    def invalidate(self, org_id, kind):
+        self.cache.pop((org_id, kind))
+
+    def _build(self, rest, user_info, kind):
+        metadata_type = metadata_types.get(kind)
+        return Index(Component(r[metadata_type.list_name_field], r['Id'], r['SystemModstamp'])
+                     for r in query_records(rest, user_info['urls']['tooling_rest'], metadata_type.list_soql()))
@@ -0,0 +1,33 @@
+"""
+Runs independent Salesforce calls side by side, typically the same tooling
+query against the main and the secondary org. Results come back in the order
+of the calls, so callers check them exactly like they did with sequential
+calls. An exception raised by a call is re-raised by run_parallel, the first
+failing call in argument order wins.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import run_in_context
+
+_executor = ThreadPoolExecutor(max_workers=8)
+
+
+def configure(max_workers):
+    """
+    Resize the shared pool
+    :param max_workers: max number of calls in flight for the whole worker process
+    """
+    global _executor
+    old = _executor
+    _executor = ThreadPoolExecutor(max_workers=max_workers)
+    old.shutdown(wait=False)
+
+
+def run_parallel(*calls):
+    """
+    Run every callable on the shared pool and wait for all of them
+    :param calls: callables without arguments (use functools.partial)
+    :return: list of results, in the order of calls
+    """
+    futures = [_executor.submit(run_in_context(call)) for call in calls]
+    return [future.result() for future in futures]
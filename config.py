@@ -1,4 +1,70 @@
 import os
+import tempfile
 
 class Config(object):
-    SECRET_KEY = os.environ.get('SECRET_KEY') or '=@w(^&c*piw%@b!&n3ssiqc=e(r-4u31n4emxicb#*5ftwkiwg'
\ No newline at end of file
+    SECRET_KEY = os.environ.get('SECRET_KEY') or '=@w(^&c*piw%@b!&n3ssiqc=e(r-4u31n4emxicb#*5ftwkiwg'
+    # keep-alive connections kept per org session
+    SF_POOL_SIZE = int(os.environ.get('SF_POOL_SIZE', 10))
+    # org sessions kept per worker
+    SF_MAX_SESSIONS = int(os.environ.get('SF_MAX_SESSIONS', 32))
+    SF_CONNECT_TIMEOUT = float(os.environ.get('SF_CONNECT_TIMEOUT', 5))
+    SF_READ_TIMEOUT = float(os.environ.get('SF_READ_TIMEOUT', 60))
+    SF_RETRIES = int(os.environ.get('SF_RETRIES', 2))
+    # seconds a userinfo response is reused for the same token
+    USER_INFO_TTL = int(os.environ.get('USER_INFO_TTL', 60))
+    USER_INFO_CACHE_SIZE = int(os.environ.get('USER_INFO_CACHE_SIZE', 256))
+    # Salesforce calls run side by side per worker (both orgs of a page)
+    ORG_FETCH_WORKERS = int(os.environ.get('ORG_FETCH_WORKERS', 8))
+    # url encoded size of one WHERE ... IN (...) chunk, and chunks queried at once per org
+    QUERY_IN_CLAUSE_CHARS = int(os.environ.get('QUERY_IN_CLAUSE_CHARS', 4000))
+    QUERY_CHUNKS_IN_FLIGHT = int(os.environ.get('QUERY_CHUNKS_IN_FLIGHT', 4))
+    # query chunks in flight for the whole worker process, across orgs
+    QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', 16))
+    # default time budget in seconds of one diff, ?diff_timeout= overrides it per request
+    DIFF_TIMEOUT = float(os.environ.get('DIFF_TIMEOUT', 1.0))
+    # on-disk cache of ApexClass/AuraDefinition sources, shared by the workers
+    SOURCE_CACHE_PATH = os.environ.get('SOURCE_CACHE_PATH') or os.path.join(tempfile.gettempdir(), 'compare-source-cache.sqlite3')
+    SOURCE_CACHE_MAX_BYTES = int(os.environ.get('SOURCE_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+    # equal lines shown around each change of a diff, ?context= overrides it per request
+    DIFF_CONTEXT_LINES = int(os.environ.get('DIFF_CONTEXT_LINES', 1))
+    # seconds a browser may reuse a diff fragment without asking again
+    DIFF_FRAGMENT_MAX_AGE = int(os.environ.get('DIFF_FRAGMENT_MAX_AGE', 300))
+    # background comparisons: state file shared by the workers, jobs running per worker, classes per batch
+    JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH') or os.path.join(tempfile.gettempdir(), 'compare-jobs.sqlite3')
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', 200))
+    # seconds without heartbeat after which a queued or running job is reported as failed, its worker died
+    JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', 60))
+    # fold independent tooling calls (query chunks, deploy steps) into Composite API calls
+    SF_COMPOSITE = os.environ.get('SF_COMPOSITE', '1') == '1'
+    # send a Server-Timing header (sf, diff, render, total) with every response
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+    # gzip the JSON compare API responses of clients sending Accept-Encoding: gzip
+    API_GZIP = os.environ.get('API_GZIP', '1') == '1'
+    API_GZIP_LEVEL = int(os.environ.get('API_GZIP_LEVEL', 6))
+    # API limit aware scheduling: calls in flight per org, retries of idempotent calls on 503/REQUEST_LIMIT_EXCEEDED,
+    # backoff bounds in seconds, share of the daily allowance past which calls slow down, max spacing of calls
+    SF_MAX_IN_FLIGHT_PER_ORG = int(os.environ.get('SF_MAX_IN_FLIGHT_PER_ORG', 8))
+    SF_LIMIT_RETRIES = int(os.environ.get('SF_LIMIT_RETRIES', 3))
+    SF_BACKOFF_BASE = float(os.environ.get('SF_BACKOFF_BASE', 0.5))
+    SF_BACKOFF_MAX = float(os.environ.get('SF_BACKOFF_MAX', 8))
+    SF_LIMIT_SLOWDOWN_AT = float(os.environ.get('SF_LIMIT_SLOWDOWN_AT', 0.8))
+    SF_LIMIT_SLOWDOWN_DELAY = float(os.environ.get('SF_LIMIT_SLOWDOWN_DELAY', 1.0))
+    # diff/render cache keyed by source hashes: memory tier per worker, optional SQLite tier shared by the workers
+    DIFF_CACHE_MAX_BYTES = int(os.environ.get('DIFF_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    DIFF_CACHE_PATH = os.environ.get('DIFF_CACHE_PATH') or None
+    DIFF_CACHE_DISK_MAX_BYTES = int(os.environ.get('DIFF_CACHE_DISK_MAX_BYTES', 256 * 1024 * 1024))
+    # org snapshots: compressed sources named by hash plus one manifest per snapshot
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') or os.path.join(tempfile.gettempdir(), 'compare-snapshots')
+    # whole-org fetches (snapshots, compare API and matrix without names): 'tooling' queries or one Metadata API 'retrieve' zip, ?backend= overrides it
+    SOURCE_BACKEND = os.environ.get('SOURCE_BACKEND', 'tooling')
+    # seconds between two checkRetrieveStatus calls, and before a retrieve is given up
+    RETRIEVE_POLL_INTERVAL = float(os.environ.get('RETRIEVE_POLL_INTERVAL', 2.0))
+    RETRIEVE_TIMEOUT = float(os.environ.get('RETRIEVE_TIMEOUT', 600))
+    # processes diffing the pairs of a compare API call, per gunicorn worker (0 diffs in the worker itself),
+    # and total characters of a batch below which it is diffed in the worker anyway
+    DIFF_PROCESSES = int(os.environ.get('DIFF_PROCESSES', max(0, min(4, (os.cpu_count() or 1) - 1))))
+    DIFF_SERIAL_BELOW_CHARS = int(os.environ.get('DIFF_SERIAL_BELOW_CHARS', 200000))
+    # seconds the class/bundle names of an org are served to the pickers before being queried again, and orgs x kinds kept
+    COMPONENT_INDEX_TTL = int(os.environ.get('COMPONENT_INDEX_TTL', 300))
+    COMPONENT_INDEX_SIZE = int(os.environ.get('COMPONENT_INDEX_SIZE', 256))
@@ -15,8 +15,13 @@
 """
 Utilities for formating a diff_match_patch diff array into
 a pretty two-column HTML table.
+
+The table is produced in a single pass: rows are yielded as soon as they
+are known, and only the last `context` unchanged lines are kept in memory,
+so the output of diff2html_iter can be streamed to the client.
 """
-from cgi              import escape
+from collections import deque
+from html             import escape
 from diff_match_patch import diff_match_patch as dmp
  
 def _line_iter(diffs):
@@ -36,95 +41,92 @@ def _line_iter(diffs):
         lineno += data.count('\n')
         yield op, lineno, lines[-1]
  
-def _remove_equal_lines(diffs):
+def _lines(diffs):
     """
-    Given a diff array, this function returns a new array where equal
-    lines are removed (except for equal lines directly before and after a
-    change).
- 
-    It returns a new array containing 4-tuples (op, has_change, lineno,
-    data), where::
- 
-        - op and data are equivalent to the corresponding elements in
-        the source array
-        - has_change is True if the current item is in a changed
-        line, and False if it is an extra line (directly before or after
-        a change).
-        - lineno is the number of the current line.
+    Groups the chunks of _line_iter by line, yielding 3-tuples
+    (lineno, chunks, has_change) where chunks is a list of (op, data)
+    and has_change is True if any chunk of the line is not equal.
     """
-    # Identify changed lines.
-    extra   = set()
-    changed = set()
+    current = None
+    chunks  = []
+    changed = False
     for op, lineno, data in _line_iter(diffs):
-        if op != dmp.DIFF_EQUAL:
-            # Mark changed lines, as well as one line before and after it.
-            extra.add(max(1, lineno - 1))
-            changed.add(lineno)
-            extra.add(lineno + 1)
+        if lineno != current:
+            if chunks:
+                yield current, chunks, changed
+            current = lineno
+            chunks  = []
+            changed = False
+        if data:
+            chunks.append((op, data))
+            changed = changed or op != dmp.DIFF_EQUAL
+    if chunks:
+        yield current, chunks, changed
  
-    # Filter changed lines.
-    result = []
-    for op, lineno, data in _line_iter(diffs):
-        if lineno in changed:
-            result.append((op, True, lineno, data))
-        elif lineno in extra:
-            result.append((op, False, lineno, data))
-    return result
- 
-def diff2html(diffs, left_label = None, right_label = None):
+def _remove_equal_lines(diffs, context = 1):
     """
-    Given a diff array, this function returns a pretty two-column HTML
-    table.
+    Given a diff array, this generator yields the lines of _lines that
+    are changed, plus `context` equal lines before and after each
+    change. Equal lines are buffered in a deque of `context` items
+    only, the diff array is walked once.
     """
-    line_html   = []
-    left_html   = []
-    right_html  = []
-    last_lineno = 0
-    for op, has_change, lineno, data in _remove_equal_lines(diffs):
-        # Append the line number to the first column of the table.
-        if lineno > last_lineno + 1:
-            line_html.append('<span><br/></span>')
-            left_html.append('<br/>')
-            right_html.append('<br/>')
-        if lineno != last_lineno:
-            line_html.append('<span>%d<br/></span>' % lineno)
-        last_lineno = lineno
+    before = deque(maxlen = context)
+    after  = 0
+    for line in _lines(diffs):
+        if line[2]:
+            while before:
+                yield before.popleft()
+            yield line
+            after = context
+        elif after > 0:
+            yield line
+            after -= 1
+        elif context:
+            before.append(line)
  
-        # Append the left and right text to the second/third columns of
-        # the table.
-        text = escape(data.rstrip('\n'))
+def _chunks_html(chunks):
+    left_html  = []
+    right_html = []
+    for op, data in chunks:
+        text = escape(data.rstrip('\n'), quote = False)
+        if not text:
+            continue
         if op == dmp.DIFF_INSERT:
-            left_html.append('')
             right_html.append('<ins>%s</ins>' % text)
         elif op == dmp.DIFF_DELETE:
             left_html.append('<del>%s</del>' % text)
-            right_html.append('')
         elif op == dmp.DIFF_EQUAL:
             left_html.append('<span>%s</span>' % text)
             right_html.append('<span>%s</span>' % text)
+    return ''.join(left_html), ''.join(right_html)
  
-        if data.endswith('\n'):
-            left_html.append('<br/>\n')
-            right_html.append('<br/>\n')
+def diff2html_iter(diffs, left_label = None, right_label = None, context = 1):
+    """
+    Given a diff array, this generator yields a pretty two-column HTML
+    table piece by piece, one row per line. `context` is the number of
+    equal lines shown around each change.
+    """
+    yield '<table class="diff">'
+    if left_label or right_label:
+        yield '<tr>' \
+            + '<th></th>' \
+            + '<th>Version: %s</th>' % escape(left_label or '') \
+            + '<th>Version: %s</th>' % escape(right_label or '') \
+            + '</tr>'
+    last_lineno = 0
+    for lineno, chunks, has_change in _remove_equal_lines(diffs, context):
+        if lineno > last_lineno + 1:
+            yield '<tr class="skipped"><td class="line-numbers"></td><td></td><td></td></tr>\n'
+        last_lineno = lineno
+        left, right = _chunks_html(chunks)
+        yield '<tr><td class="line-numbers">%d</td>' % lineno \
+            + '<td class="expand">%s</td>' % left \
+            + '<td class="expand">%s</td></tr>\n' % right
+    yield '</table>'
  
-    if not left_label and not right_label:
-        head = ''
-    else:
-        head = '<tr>' \
-             + '<th></th>' \
-             + '<th>Version: %s</th>' % escape(left_label or '') \
-             + '<th>Version: %s</th>' % escape(right_label or '') \
-             + '</tr>'
-    html = '<table class="diff"><tr>' \
-         + head \
-         + '<td class="line-numbers">' \
-         + '\n'.join(line_html) \
-         + '</td>' \
-         + '<td class="expand">' \
-         + ''.join(left_html) \
-         + '</td>' \
-         + '<td class="expand">' \
-         + ''.join(right_html) \
-         + '</td>' \
-         + '</tr></table>'
-    return html
\ No newline at end of file
+def diff2html(diffs, left_label = None, right_label = None, context = 1):
+    """
+    Given a diff array, this function returns a pretty two-column HTML
+    table.
+    """
+    return ''.join(diff2html_iter(diffs, left_label, right_label, context))
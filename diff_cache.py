@@ -0,0 +1,152 @@
+"""
+Cache of computed diffs and rendered diff tables.
+
+The diff of two sources only depends on their content hashes and on the
+diff options, so entries are keyed by (hash one, hash two, options) and
+can be shared by every user and every org pair holding the same sources.
+
+    -memory tier: LRU of the worker process, bounded by the size of the
+     serialized values
+    -disk tier (optional): SQLite file shared by the gunicorn workers,
+     values stored zlib compressed, least recently used rows evicted first
+
+Lookups are counted in metrics.REGISTRY by tier and result (hit/miss).
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import metrics
+
+metrics.REGISTRY.describe('compare_diff_cache_lookups_total', 'Diff cache lookups by tier and result')
+
+
+def cache_key(kind, hash_one, hash_two, options):
+    """
+    :param kind: what is cached, ex: 'diff' or 'html'
+    :param options: JSON serializable options the value depends on
+    :return: hex sha1
+    """
+    return hashlib.sha1(json.dumps([kind, hash_one, hash_two, options], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class DiffCache(object):
+    """
+        Two tier cache of JSON serializable values
+            -get()/set() by cache_key
+            -capture() stores a streamed value once it has been fully produced
+    """
+
+    def __init__(self, max_bytes, path=None, disk_max_bytes=0):
+        """
+        Constructor for DiffCache Class
+        :param max_bytes: size of the memory tier
+        :param path: SQLite file of the disk tier, None disables it
+        :param disk_max_bytes: size of the disk tier above which rows are evicted
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        if path:
+            with self._connect() as db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('CREATE TABLE IF NOT EXISTS diffs ('
+                           'key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)')
+                db.execute('CREATE INDEX IF NOT EXISTS diffs_accessed ON diffs (accessed)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        """
+        :return: cached value, None when missing from both tiers
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+        if data is not None:
+            metrics.REGISTRY.inc('compare_diff_cache_lookups_total', tier='memory', result='hit')
+            return json.loads(data)
+        metrics.REGISTRY.inc('compare_diff_cache_lookups_total', tier='memory', result='miss')
+        if not self.path:
+            return None
+        with self._connect() as db:
+            row = db.execute('SELECT value FROM diffs WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                db.execute('UPDATE diffs SET accessed = ? WHERE key = ?', (time.time(), key))
+        if row is None:
+            metrics.REGISTRY.inc('compare_diff_cache_lookups_total', tier='disk', result='miss')
+            return None
+        metrics.REGISTRY.inc('compare_diff_cache_lookups_total', tier='disk', result='hit')
+        data = zlib.decompress(row[0]).decode('utf-8')
+        self._remember(key, data)
+        return json.loads(data)
+
+    def set(self, key, value):
+        data = json.dumps(value, separators=(',', ':'))
+        self._remember(key, data)
+        if self.path:
+            blob = zlib.compress(data.encode('utf-8'))
+            with self._connect() as db:
+                db.execute('INSERT OR REPLACE INTO diffs VALUES (?, ?, ?, ?)', (key, blob, len(blob), time.time()))
+            self._evict()
+
+    def capture(self, key, chunks, extra=None):
+        """
+        Generator over chunks of text, their concatenation is stored under key as
+        dict(extra, text=...) once the last chunk was produced. Texts larger than
+        the memory tier are neither buffered nor stored, a huge diff streams in
+        the bounded memory of its renderer.
+        """
+        produced = []
+        size = 0
+        for chunk in chunks:
+            if produced is not None:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    produced = None
+                else:
+                    produced.append(chunk)
+            yield chunk
+        if produced is not None:
+            self.set(key, dict(extra or {}, text=''.join(produced)))
+
+    def _remember(self, key, data):
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[key] = data
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_bytes:
+                evicted_key, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+            metrics.REGISTRY.set('compare_diff_cache_memory_bytes', self._memory_bytes)
+
+    def _evict(self):
+        with self._lock, self._connect() as db:
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM diffs').fetchone()[0]
+            while total > self.disk_max_bytes:
+                rows = db.execute('SELECT rowid, size FROM diffs ORDER BY accessed LIMIT 100').fetchall()
+                if not rows:
+                    break
+                db.executemany('DELETE FROM diffs WHERE rowid = ?', [(rowid,) for rowid, size in rows])
+                total -= sum(size for rowid, size in rows)
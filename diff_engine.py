@@ -0,0 +1,155 @@
+"""
+Line oriented diff for large Apex/Aura sources.
+
+diff_main at character granularity burns the whole Diff_Timeout on big
+classes and then returns a degraded diff. Here both texts are first reduced
+to one character per line (diff_linesToChars), diffed, expanded back
+(diff_charsToLines), and only the replaced hunks are refined character by
+character while the time budget lasts. The result says whether the budget
+was exhausted and a coarser diff was returned. significant_only() folds the
+hunks a normalization mode considers equal back into unchanged text.
+"""
+import time
+from collections import namedtuple
+
+import diff_match_patch as dmp_module
+
+import metrics
+
+DEFAULT_TIMEOUT = 1.0
+
+# diffs: diff_match_patch diff array
+# fell_back: True when the time budget ran out and part of the diff stayed coarse
+DiffResult = namedtuple('DiffResult', ['diffs', 'fell_back'])
+
+
+def line_diff(text_one, text_two, timeout=None, refine=True):
+    """
+    :param timeout: time budget in seconds for the whole diff, 0 means no limit
+    :param refine: diff replaced lines character by character inside changed hunks
+    :return: DiffResult
+    """
+    with metrics.timed('diff'):
+        return _line_diff(text_one, text_two, timeout, refine)
+
+
+def _line_diff(text_one, text_two, timeout, refine):
+    if text_one == text_two:
+        return DiffResult([(dmp_module.diff_match_patch.DIFF_EQUAL, text_one)] if text_one else [], False)
+    timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+    deadline = time.time() + timeout if timeout > 0 else None
+    dmp = dmp_module.diff_match_patch()
+    if deadline is None:
+        # diff_main applies its own 1s Diff_Timeout to a missing deadline
+        dmp.Diff_Timeout = 0
+
+    chars_one, chars_two, line_array = dmp.diff_linesToChars(text_one or '', text_two or '')
+    diffs = dmp.diff_main(chars_one, chars_two, False, deadline)
+    dmp.diff_charsToLines(diffs, line_array)
+    fell_back = _expired(deadline)
+
+    if refine and not fell_back:
+        diffs, fell_back = _refine(dmp, diffs, deadline)
+    return DiffResult(diffs, fell_back)
+
+
+def _expired(deadline):
+    return deadline is not None and time.time() >= deadline
+
+
+def _refine(dmp, diffs, deadline):
+    """
+    Replace every delete+insert hunk by its character level diff
+    :return: (diffs, fell_back)
+    """
+    result = []
+    fell_back = False
+    deleted = []
+    inserted = []
+
+    def flush():
+        nonlocal fell_back
+        text_deleted = ''.join(deleted)
+        text_inserted = ''.join(inserted)
+        if text_deleted and text_inserted and not fell_back:
+            hunk = dmp.diff_main(text_deleted, text_inserted, False, deadline)
+            if _expired(deadline):
+                fell_back = True
+            else:
+                dmp.diff_cleanupSemantic(hunk)
+                result.extend(hunk)
+                del deleted[:], inserted[:]
+                return
+        if text_deleted:
+            result.append((dmp.DIFF_DELETE, text_deleted))
+        if text_inserted:
+            result.append((dmp.DIFF_INSERT, text_inserted))
+        del deleted[:], inserted[:]
+
+    for op, data in diffs:
+        if op == dmp.DIFF_DELETE:
+            deleted.append(data)
+        elif op == dmp.DIFF_INSERT:
+            inserted.append(data)
+        else:
+            flush()
+            result.append((op, data))
+    flush()
+    return result, fell_back
+
+
+def significant_only(diffs, normalize):
+    """
+    Turn every changed line range whose two sides normalize to the same text
+    into an equal chunk holding the text of the second source, so that only
+    the significant changes stay highlighted. Whole lines are normalized, not
+    the character hunks of a refined diff: ' = ' -> '=' is only insignificant
+    when the rest of its line says so. When everything folds but the sources
+    still normalize differently, the diff is returned unchanged.
+    :param normalize: function text -> normalized text, see source_compare.normalizer
+    :return: diff array
+    """
+    equal = dmp_module.diff_match_patch.DIFF_EQUAL
+    delete = dmp_module.diff_match_patch.DIFF_DELETE
+    insert = dmp_module.diff_match_patch.DIFF_INSERT
+    result = []
+    # changes and the equal text between them on the same lines
+    region = []
+    # start of the first line of the region, already in result
+    state = {'prefix': ''}
+
+    def append(op, data):
+        if result and op == equal and result[-1][0] == equal:
+            result[-1] = (equal, result[-1][1] + data)
+        elif data:
+            result.append((op, data))
+
+    def flush(suffix):
+        text_one = state['prefix'] + ''.join(data for op, data in region if op != insert) + suffix
+        text_two = state['prefix'] + ''.join(data for op, data in region if op != delete) + suffix
+        if normalize(text_one) == normalize(text_two):
+            append(equal, ''.join(data for op, data in region if op != delete))
+        else:
+            for op, data in region:
+                append(op, data)
+        del region[:]
+
+    for op, data in diffs:
+        if op == equal and not region:
+            append(equal, data)
+            state['prefix'] = data.rsplit('\n', 1)[1] if '\n' in data else state['prefix'] + data
+        elif op == equal and '\n' in data:
+            flush(data.split('\n', 1)[0] + '\n')
+            append(equal, data)
+            state['prefix'] = data.rsplit('\n', 1)[1]
+        else:
+            region.append((op, data))
+    if region:
+        flush('')
+
+    if all(op == equal for op, data in result):
+        text_one = ''.join(data for op, data in diffs if op != insert)
+        text_two = ''.join(data for op, data in diffs if op != delete)
+        if normalize(text_one) != normalize(text_two):
+            return diffs
+    return result
@@ -0,0 +1,131 @@
+"""
+Diffs of many source pairs spread over a pool of processes.
+
+diff_match_patch and difflib are pure Python: within one worker every diff
+of a compare runs on one core under the GIL. diff_many() sends the pairs to
+a bounded ProcessPoolExecutor instead, largest pairs first so that a big
+class started last does not hold the whole batch back, and yields results
+as they complete. Small batches, where pickling and process hops cost more
+than the diffs, run in the calling process.
+
+The pool is created on first use, inside the gunicorn worker, with the spawn
+start method so that no lock or socket of the worker is inherited. If a pool
+process dies, the pool is dropped and the remaining pairs run serially.
+"""
+import difflib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import diff_engine
+import metrics
+
+SETTINGS = {
+    # processes of the pool, 0 disables it
+    'processes': 2,
+    # batches whose sources total fewer characters run serially
+    'serial_below': 200000,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+metrics.REGISTRY.describe('compare_diff_pairs_total', 'Source pairs diffed by mode (serial or pool)')
+
+
+def configure(processes=None, serial_below=None):
+    """
+    Change the pool settings, a running pool is shut down
+    """
+    global _pool
+    with _pool_lock:
+        if processes is not None:
+            SETTINGS['processes'] = processes
+        if serial_below is not None:
+            SETTINGS['serial_below'] = serial_below
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=SETTINGS['processes'],
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _drop_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def line_diff(text_one, text_two, timeout=None, refine=True):
+    """
+    diff_engine.line_diff of a pool process, the DiffResult is sent back as a tuple
+    """
+    return tuple(diff_engine.line_diff(text_one, text_two, timeout, refine))
+
+
+def unified_diff(text_one, text_two, label_one, label_two, context):
+    """
+    difflib unified diff as one string, a last line without a newline gets the
+    '\\ No newline at end of file' marker of diff -u (Apex bodies usually end that way)
+    """
+    with metrics.timed('diff'):
+        lines = []
+        for line in difflib.unified_diff(text_one.splitlines(True), text_two.splitlines(True),
+                                         label_one, label_two, n=context):
+            if line.endswith('\n'):
+                lines.append(line)
+            else:
+                lines.append(line + '\n\\ No newline at end of file\n')
+        return ''.join(lines)
+
+
+def diff_many(fn, tasks):
+    """
+    Run fn(*args) for every task, in the pool when the batch is big enough
+    :param fn: module level function of this module (it has to be picklable), ex: line_diff
+    :param tasks: list of (key, args) where the first two args are the two sources
+    :return: generator of (key, fn result), in completion order
+    """
+    tasks = sorted(tasks, key=lambda task: len(task[1][0] or '') + len(task[1][1] or ''), reverse=True)
+    size = sum(len(args[0] or '') + len(args[1] or '') for key, args in tasks)
+    if SETTINGS['processes'] < 1 or len(tasks) < 2 or size < SETTINGS['serial_below']:
+        for key, result in _serial(fn, tasks):
+            yield key, result
+        return
+
+    pool = _get_pool()
+    futures = {}
+    done = set()
+    try:
+        for key, args in tasks:
+            futures[pool.submit(fn, *args)] = key
+        for future in metrics.timed_iter('diff', as_completed(futures)):
+            result = future.result()
+            key = futures.pop(future)
+            done.add(key)
+            metrics.REGISTRY.inc('compare_diff_pairs_total', mode='pool')
+            yield key, result
+    except BrokenProcessPool:
+        _drop_pool(pool)
+        futures.clear()
+        for key, result in _serial(fn, [(key, args) for key, args in tasks if key not in done]):
+            yield key, result
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _serial(fn, tasks):
+    for key, args in tasks:
+        metrics.REGISTRY.inc('compare_diff_pairs_total', mode='serial')
+        yield key, fn(*args)
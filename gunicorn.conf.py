@@ -0,0 +1,33 @@
+"""
+Gunicorn settings, read from the environment so that the Procfile stays the same.
+
+WEB_WORKER_CLASS=gevent serves every request of a worker in a greenlet: the
+worker is patched by gevent before app.py is imported, so requests' sockets,
+the thread pools and their locks become cooperative and a request waiting
+on Salesforce no longer pins the worker. The diff itself is still CPU
+bound and holds the worker for at most DIFF_TIMEOUT per diff.
+Do not combine it with --preload, the app must be imported after patching.
+
+    WEB_WORKER_CLASS        sync (default), gthread or gevent
+    WEB_WORKER_CONNECTIONS  concurrent requests per gevent worker
+    WEB_THREADS             threads per gthread worker
+
+load_test.py measures the concurrent compares a single worker sustains.
+"""
+import os
+
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'sync')
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 100))
+threads = int(os.environ.get('WEB_THREADS', 1))
+# query chunks one org fetch runs at once, each fetch of the fetch pool may have that many in the query pool
+chunks_in_flight = int(os.environ.get('QUERY_CHUNKS_IN_FLIGHT', 4))
+
+if worker_class == 'gevent':
+    # the shared fetch and query pools and the per org connection pools would
+    # otherwise cap a worker at a few Salesforce calls in flight, whatever its connections
+    os.environ.setdefault('ORG_FETCH_WORKERS', str(worker_connections * 2))
+    os.environ.setdefault('QUERY_WORKERS', str(worker_connections * 2 * chunks_in_flight))
+    os.environ.setdefault('SF_POOL_SIZE', str(worker_connections))
+elif worker_class == 'gthread':
+    os.environ.setdefault('ORG_FETCH_WORKERS', str(threads * 2))
+    os.environ.setdefault('QUERY_WORKERS', str(threads * 2 * chunks_in_flight))
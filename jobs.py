@@ -0,0 +1,195 @@
+"""
+Background jobs for comparisons too long for one gunicorn request.
+
+Jobs run on a local thread pool of the worker that started them, their
+state, progress and results are kept in a SQLite file, so any worker can
+answer progress polls and serve result pages.
+
+A job is only readable by a session connected to one of its owners, the
+organization ids of the orgs that started it. While a job is queued or
+running, its worker refreshes its heartbeat; a job whose heartbeat is older
+than stale_after seconds lost its worker and is reported as failed.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    """
+    Handle given to a job function to report its progress and results
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.id = job_id
+        self.done = 0
+        self.position = 0
+
+    def set_total(self, total):
+        self.store.update(self.id, total=total)
+
+    def add_results(self, results, processed, bytes_fetched=None):
+        """
+        :param results: list of dicts with name, status and diff_present
+        :param processed: number of items handled to produce results
+        :param bytes_fetched: bytes received from Salesforce so far
+        """
+        self.store.add_results(self.id, self.position, results)
+        self.position += len(results)
+        self.done += processed
+        fields = {'done': self.done}
+        if bytes_fetched is not None:
+            fields['bytes_fetched'] = bytes_fetched
+        self.store.update(self.id, **fields)
+
+
+class JobStore(object):
+    """
+        Job state stored in a SQLite file
+            -submit() queues a job function on the local pool
+            -get() and results() can be called from any worker
+    """
+
+    def __init__(self, path, max_workers, stale_after=60):
+        """
+        Constructor for JobStore Class
+        :param path: SQLite file, created when missing
+        :param max_workers: jobs running at the same time in this worker
+        :param stale_after: seconds without heartbeat after which a queued or running job is failed
+        """
+        self.path = path
+        self.stale_after = stale_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._active = set()
+        self._active_lock = threading.Lock()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                       'id TEXT PRIMARY KEY, kind TEXT, state TEXT, total INTEGER, done INTEGER,'
+                       'bytes_fetched INTEGER, error TEXT, params TEXT, created REAL, updated REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS job_results ('
+                       'job_id TEXT, position INTEGER, name TEXT, diff_present INTEGER, status TEXT,'
+                       'PRIMARY KEY (job_id, position))')
+            # files created before results kept their status
+            if 'status' not in [row[1] for row in db.execute('PRAGMA table_info(job_results)')]:
+                db.execute('ALTER TABLE job_results ADD COLUMN status TEXT')
+            # files created before jobs had owners and a heartbeat
+            columns = [row[1] for row in db.execute('PRAGMA table_info(jobs)')]
+            if 'owners' not in columns:
+                db.execute('ALTER TABLE jobs ADD COLUMN owners TEXT')
+            if 'heartbeat' not in columns:
+                db.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+        heartbeat = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def submit(self, kind, params, owners, fn, *args):
+        """
+        Create a job and run fn(job, *args) in the background
+        :param kind: type of job, ex: 'classes'
+        :param params: string kept with the job, ex: the query string of its results page
+        :param owners: organization ids allowed to read the job, ex: both orgs of the session
+        :return: job id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute('INSERT INTO jobs (id, kind, state, total, done, bytes_fetched, error, params, created, updated,'
+                       ' owners, heartbeat) VALUES (?, ?, ?, 0, 0, 0, NULL, ?, ?, ?, ?, ?)',
+                       (job_id, kind, QUEUED, params, now, now, json.dumps(sorted(set(owners))), now))
+        with self._active_lock:
+            self._active.add(job_id)
+        self._executor.submit(self._run, Job(self, job_id), fn, args)
+        return job_id
+
+    def _run(self, job, fn, args):
+        self.update(job.id, state=RUNNING)
+        try:
+            fn(job, *args)
+        except Exception as e:
+            # the traceback stays in the server log, the browser only gets the message
+            logger.exception('job %s failed', job.id)
+            self.update(job.id, state=FAILED, error=str(e) or e.__class__.__name__)
+        else:
+            self.update(job.id, state=DONE)
+        finally:
+            with self._active_lock:
+                self._active.discard(job.id)
+
+    def _beat(self):
+        """
+        Heartbeat of the queued and running jobs of this worker, until the process exits
+        """
+        while True:
+            time.sleep(self.stale_after / 4.0)
+            with self._active_lock:
+                active = list(self._active)
+            if active:
+                try:
+                    with self._connect() as db:
+                        db.executemany('UPDATE jobs SET heartbeat = ? WHERE id = ?', [(time.time(), job_id) for job_id in active])
+                except sqlite3.Error:
+                    logger.exception('job heartbeat failed')
+
+    def update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        columns = sorted(fields)
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET %s WHERE id = ?' % ', '.join(c + ' = ?' for c in columns),
+                       [fields[c] for c in columns] + [job_id])
+
+    def add_results(self, job_id, start, results):
+        with self._connect() as db:
+            db.executemany('INSERT OR REPLACE INTO job_results (job_id, position, name, diff_present, status)'
+                           ' VALUES (?, ?, ?, ?, ?)',
+                           [(job_id, start + i, r['name'], int(r['diff_present']), r.get('status'))
+                            for i, r in enumerate(results)])
+
+    def get(self, job_id, org_ids):
+        """
+        :param org_ids: organization ids of the caller
+        :return: dict of the job columns plus remaining, None for an unknown id or a job none of org_ids owns
+        """
+        with self._connect() as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or not set(json.loads(row['owners'] or '[]')) & set(org_ids):
+            return None
+        job = dict(row)
+        del job['owners']
+        if job['state'] in (QUEUED, RUNNING) and (job['heartbeat'] or job['updated']) < time.time() - self.stale_after:
+            job['state'], job['error'] = FAILED, 'the worker running this job stopped'
+            self.update(job_id, state=FAILED, error=job['error'])
+        job['remaining'] = max(job['total'] - job['done'], 0)
+        return job
+
+    def results(self, job_id, offset=0, limit=None):
+        """
+        :return: list of dicts with name, status and diff_present, in job order
+        """
+        with self._connect() as db:
+            rows = db.execute('SELECT name, diff_present, status FROM job_results WHERE job_id = ?'
+                              ' ORDER BY position LIMIT ? OFFSET ?',
+                              (job_id, -1 if limit is None else limit, offset)).fetchall()
+        return [{'name': r['name'], 'status': r['status'], 'diff_present': bool(r['diff_present'])} for r in rows]
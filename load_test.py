@@ -0,0 +1,164 @@
+"""
+Load test of one gunicorn worker against the local mock Salesforce (mock_sf.py).
+
+Starts the mock in its own process with an injected latency, then for each worker class a
+single-worker gunicorn serving app.py, and keeps `concurrency` clients busy
+on /compare/classes_result for a few seconds. Reports throughput and
+latency per concurrency level, and the highest level a worker sustains:
+no errors and a p95 under `--max-slowdown` times the single client p50.
+
+    python load_test.py --worker-class sync gevent --concurrency 1 8 32 64 --latency 0.2
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from benchmark import percentile
+from config import Config
+
+
+def session_cookie(instance_url):
+    """
+    Signed Flask session of the main and secondary mocked orgs
+    """
+    signer = Flask('load_test')
+    signer.config['SECRET_KEY'] = Config.SECRET_KEY
+    return SecureCookieSessionInterface().get_signing_serializer(signer).dumps({
+        'salesforce_def_token': 'main', 'salesforce_def_instance_url': instance_url,
+        'salesforce_sec_token': 'secondary', 'salesforce_sec_instance_url': instance_url,
+    })
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_until_up(url, process, what):
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('%s did not start' % what)
+
+
+def start_mock(port, classes, latency):
+    process = subprocess.Popen([sys.executable, 'mock_sf.py', '--port', str(port), '--classes', str(classes),
+                                '--bundles', '1', '--latency', str(latency)],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return wait_until_up('http://127.0.0.1:%d/' % port, process, 'mock_sf')
+
+
+def start_worker(worker_class, port, workdir, threads):
+    env = dict(os.environ,
+               WEB_WORKER_CLASS=worker_class,
+               # gunicorn turns a sync worker with threads into a gthread one
+               WEB_THREADS=str(threads if worker_class == 'gthread' else 1),
+               SALESFORCE_API_VERSION='42.0',
+               SALESFORCE_CONSUMER_KEY='load-test',
+               SALESFORCE_CONSUMER_SECRET='load-test',
+               SALESFORCE_REDIRECT_URI='http://localhost/auth/authorized',
+               SOURCE_CACHE_PATH=os.path.join(workdir, worker_class + '-sources.sqlite3'),
+               JOBS_DB_PATH=os.path.join(workdir, worker_class + '-jobs.sqlite3'))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app', '--config', 'gunicorn.conf.py',
+                                '--workers', '1', '--bind', '127.0.0.1:%d' % port, '--log-level', 'warning'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    return wait_until_up('http://127.0.0.1:%d/metrics' % port, process, 'gunicorn %s worker' % worker_class)
+
+
+def run_level(url, cookie, concurrency, duration):
+    """
+    Keep `concurrency` clients busy on url for `duration` seconds
+    :return: (latencies, errors, seconds until the last client finished)
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    started = time.time()
+    stop = started + duration
+
+    def client():
+        session = requests.Session()
+        session.cookies.set('session', cookie)
+        while time.time() < stop:
+            start = time.perf_counter()
+            try:
+                response = session.get(url, timeout=120, allow_redirects=False)
+                failed = response.status_code != 200
+            except requests.RequestException:
+                failed = True
+            with lock:
+                (errors if failed else latencies).append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return latencies, errors, time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker-class', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds added to each mock call')
+    parser.add_argument('--classes', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=8, help='threads of the gthread worker')
+    parser.add_argument('--max-slowdown', type=float, default=2.0)
+    args = parser.parse_args()
+
+    mock_port = free_port()
+    mock = start_mock(mock_port, args.classes, args.latency)
+    cookie = session_cookie('http://127.0.0.1:%d' % mock_port)
+    names = ','.join('Class{:05d}'.format(i) for i in range(args.classes))
+    workdir = tempfile.mkdtemp(prefix='compare-load-')
+
+    print('{:<8} {:>6} {:>9} {:>9} {:>9} {:>7}'.format('worker', 'conc', 'req/s', 'p50 ms', 'p95 ms', 'errors'))
+    try:
+        for worker_class in args.worker_class:
+            port = free_port()
+            process = start_worker(worker_class, port, workdir, args.threads)
+            url = 'http://127.0.0.1:%d/compare/classes_result?class_names=%s' % (port, names)
+            try:
+                # warm the source cache and the userinfo cache
+                run_level(url, cookie, 1, 0.1)
+                baseline = None
+                sustained = 0
+                for concurrency in args.concurrency:
+                    latencies, errors, elapsed = run_level(url, cookie, concurrency, args.duration)
+                    p50 = percentile(latencies, 50) if latencies else float('nan')
+                    p95 = percentile(latencies, 95) if latencies else float('nan')
+                    baseline = baseline or p50
+                    if not errors and latencies and p95 <= baseline * args.max_slowdown:
+                        sustained = concurrency
+                    print('{:<8} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>7}'.format(
+                        worker_class, concurrency, len(latencies) / elapsed, p50 * 1000, p95 * 1000, len(errors)))
+                print('{:<8} sustains {} concurrent compares per worker'.format(worker_class, sustained))
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == '__main__':
+    main()
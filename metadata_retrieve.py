@@ -0,0 +1,267 @@
+"""
+Whole-org source retrieval through the Metadata API.
+
+Instead of paging tooling queries (JSON bodies of every record), one
+retrieve() of the metadata types of every selected metadata_types type
+(ApexClass, AuraDefinitionBundle...) returns every source of the org as a
+single zip:
+
+    -retrieve() starts the async request, checkRetrieveStatus() is polled
+     until it is done
+    -the final response is streamed: its XML is parsed incrementally and the
+     base64 zipFile element is decoded straight into an anonymous temp file,
+     the archive is never held in memory as text or bytes
+    -the file is memory-mapped and opened as a ZipFile, RetrievedSources
+     decompresses a member only when its record is looked up
+
+RetrievedSources answers like the OrderedDict key -> SourceRecord of
+SourceCache.fetch, so either backend feeds the same compare pipeline. Its
+records are not tooling records though: modstamp is the lastModifiedDate of
+the fileProperties and bundle members get '<bundle Id>/<file name>' Ids, they
+cannot be matched against tooling SystemModstamps (see SnapshotStore.seed).
+"""
+import base64
+import mmap
+import tempfile
+import time
+import xml.sax
+import zipfile
+from collections import OrderedDict
+from collections.abc import Mapping
+from xml.sax.saxutils import escape
+
+import metadata_types
+import metrics
+from source_cache import SourceRecord
+from source_compare import content_hash
+
+SETTINGS = {
+    'poll_interval': 2.0,
+    'timeout': 600.0,
+}
+
+_ENVELOPE = ('<?xml version="1.0" encoding="utf-8"?>'
+             '<env:Envelope xmlns:env="http://schemas.xmlsoap.org/soap/envelope/"'
+             ' xmlns="http://soap.sforce.com/2006/04/metadata">'
+             '<env:Header><SessionHeader><sessionId>{session}</sessionId></SessionHeader></env:Header>'
+             '<env:Body>{body}</env:Body></env:Envelope>')
+
+
+class _MappedFile(mmap.mmap):
+    """
+    Read-only memory map usable as the file of a ZipFile
+    """
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=0):
+        # ZipFile probes before the start of small archives and expects the OSError of a real file
+        try:
+            return super(_MappedFile, self).seek(pos, whence)
+        except ValueError as e:
+            raise OSError(str(e))
+
+
+class RetrieveError(Exception):
+    """
+    Raised when the retrieve fails or does not finish in time
+    """
+
+
+def configure(poll_interval=None, timeout=None):
+    if poll_interval is not None:
+        SETTINGS['poll_interval'] = poll_interval
+    if timeout is not None:
+        SETTINGS['timeout'] = timeout
+
+
+def _envelope(rest, body):
+    return _ENVELOPE.format(session=escape(rest.access_token), body=body)
+
+
+def _retrieve_request(api_version, metadata_types):
+    types = ''.join('<types><members>*</members><name>{}</name></types>'.format(t) for t in metadata_types)
+    return ('<retrieve><retrieveRequest><apiVersion>{0}</apiVersion><singlePackage>true</singlePackage>'
+            '<unpackaged>{1}<version>{0}</version></unpackaged></retrieveRequest></retrieve>').format(api_version, types)
+
+
+class _ResultHandler(xml.sax.ContentHandler):
+    """
+    SAX handler of retrieve/checkRetrieveStatus responses, zipFile is decoded into out while it is parsed
+    """
+
+    def __init__(self, out=None):
+        xml.sax.ContentHandler.__init__(self)
+        self.out = out
+        self.fields = {}
+        self.file_properties = []
+        self._path = []
+        self._text = []
+        self._base64 = ''
+
+    def startElement(self, name, attrs):
+        name = name.split(':')[-1]
+        self._path.append(name)
+        self._text = []
+        if name == 'fileProperties':
+            self.file_properties.append({})
+
+    def characters(self, content):
+        if self._path and self._path[-1] == 'zipFile':
+            if self.out is None:
+                raise RetrieveError('unexpected zipFile')
+            data = self._base64 + ''.join(content.split())
+            usable = len(data) - len(data) % 4
+            self.out.write(base64.b64decode(data[:usable]))
+            self._base64 = data[usable:]
+        else:
+            self._text.append(content)
+
+    def endElement(self, name):
+        name = name.split(':')[-1]
+        self._path.pop()
+        text = ''.join(self._text)
+        if self._path and self._path[-1] == 'fileProperties':
+            self.file_properties[-1][name] = text
+        elif name in ('done', 'id', 'status', 'success', 'errorMessage', 'faultstring', 'problem'):
+            self.fields.setdefault(name, text)
+        self._text = []
+
+
+def _parse(rest, response, out=None):
+    """
+    Parse a SOAP response while its body is read
+    :return: _ResultHandler
+    """
+    handler = _ResultHandler(out)
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    # error bodies were already read by RESTApi and may not even be XML
+    chunks = rest.iter_body(response) if response.status_code == 200 else [response.content]
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+    except xml.sax.SAXParseException:
+        raise RetrieveError('HTTP {}: unreadable response'.format(response.status_code))
+    if response.status_code != 200 or 'faultstring' in handler.fields:
+        raise RetrieveError(handler.fields.get('faultstring') or 'HTTP {}'.format(response.status_code))
+    return handler
+
+
+def _metadata_url(rest, user_info):
+    return user_info.get('urls', {}).get('metadata') or 'services/Soap/m/{version}'
+
+
+def retrieve_zip(rest, user_info, metadata_types):
+    """
+    Retrieve every unpackaged component of the metadata types as one zip
+    :return: (zipfile.ZipFile over a memory-mapped temp file, list of fileProperties dicts)
+    """
+    url = _metadata_url(rest, user_info)
+    with metrics.timed('retrieve'):
+        response = rest.soap_post(url, 'retrieve', _envelope(rest, _retrieve_request(rest.api_version, metadata_types)),
+                                  stream=True)
+        async_id = _parse(rest, response).fields.get('id')
+        if not async_id:
+            raise RetrieveError('retrieve did not return a request id')
+        check = _envelope(rest, '<checkRetrieveStatus><asyncProcessId>{}</asyncProcessId>'
+                                '<includeZip>true</includeZip></checkRetrieveStatus>'.format(escape(async_id)))
+        deadline = time.time() + SETTINGS['timeout']
+        while True:
+            out = tempfile.TemporaryFile()
+            try:
+                result = _parse(rest, rest.soap_post(url, 'checkRetrieveStatus', check, idempotent=True, stream=True), out)
+                if result.fields.get('done') == 'true':
+                    if result.fields.get('status') not in (None, 'Succeeded'):
+                        raise RetrieveError(result.fields.get('errorMessage') or result.fields.get('status'))
+                    out.flush()
+                    archive = zipfile.ZipFile(_MappedFile(out.fileno(), 0, access=mmap.ACCESS_READ))
+                    return archive, result.file_properties
+            finally:
+                # the mapping keeps its own handle on the unlinked file
+                out.close()
+            if time.time() > deadline:
+                raise RetrieveError('retrieve {} did not finish in {}s'.format(async_id, SETTINGS['timeout']))
+            time.sleep(SETTINGS['poll_interval'])
+
+
+class RetrievedSources(Mapping):
+    """
+    Read-only mapping key -> SourceRecord over the members of a retrieved zip.
+    Bodies are decompressed from the mapped archive on every lookup, only the
+    content hashes are kept.
+    """
+
+    def __init__(self, archive, members):
+        """
+        :param members: OrderedDict key -> (zip member name, record Id, name, modstamp)
+        """
+        self.archive = archive
+        self.members = members
+        self._hashes = {}
+
+    def __getitem__(self, key):
+        member, record_id, name, modstamp = self.members[key]
+        body = self.archive.read(member).decode('utf-8')
+        body_hash = self._hashes.get(key)
+        if body_hash is None:
+            body_hash = self._hashes[key] = content_hash(body)
+        return SourceRecord(record_id, name, key, modstamp, body, body_hash)
+
+    def __contains__(self, key):
+        return key in self.members
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __len__(self):
+        return len(self.members)
+
+
+def _members(archive, file_properties, kind, names):
+    metadata_type = metadata_types.get(kind)
+    folder = metadata_type.retrieve_folder
+    zipped = set(archive.namelist())
+    # <folder>/<bundle>/<file> grouped by bundle
+    bundle_files = {}
+    for member in sorted(zipped):
+        parts = member.split('/')
+        if len(parts) == 3 and parts[0] == folder:
+            bundle_files.setdefault(parts[1], []).append(parts[2])
+    members = []
+    for props in file_properties:
+        if props.get('type') != metadata_type.retrieve_type or props.get('manageableState', 'unmanaged') != 'unmanaged':
+            continue
+        name = props['fullName']
+        if names is not None and name not in names:
+            continue
+        if metadata_type.member_key is None:
+            member = '{}/{}{}'.format(folder, name, metadata_type.retrieve_suffix)
+            if member in zipped:
+                members.append((name, name, member, props.get('id')))
+            continue
+        for file_name in bundle_files.get(name, []):
+            key = metadata_type.member_key(name, file_name)
+            if key is not None:
+                # bundle members have no Id of their own in a retrieve
+                members.append((name, key, '{}/{}/{}'.format(folder, name, file_name),
+                                '{}/{}'.format(props.get('id'), file_name)))
+    members.sort()
+    props_by_name = dict((p['fullName'], p) for p in file_properties if p.get('type') == metadata_type.retrieve_type)
+    return OrderedDict((key, (member, record_id, name, props_by_name[name].get('lastModifiedDate')))
+                       for name, key, member, record_id in members)
+
+
+def retrieve_sources(rest, user_info, kinds, names=None):
+    """
+    Every unmanaged source of several kinds in one retrieve
+    :param kinds: names of retrievable metadata_types types
+    :param names: component names to keep, all when None
+    :return: OrderedDict kind -> RetrievedSources
+    """
+    archive, file_properties = retrieve_zip(rest, user_info, [metadata_types.get(kind).retrieve_type for kind in kinds])
+    names = set(names) if names else None
+    return OrderedDict((kind, RetrievedSources(archive, _members(archive, file_properties, kind, names))) for kind in kinds)
+
@@ -0,0 +1,183 @@
+"""
+Registry of the metadata types the app compares.
+
+A type declares where its sources live and how its records are named, every
+fetch/compare step reads it from here instead of holding its own SOQL:
+
+    -SourceCache.fetch: metadata_soql() then bodies_soql() of the modified records
+    -pickers, component index, whole-org fetches: list_soql()
+    -Metadata API retrieve: retrieve_type, retrieve_folder and member_key()
+    -compare pages, API, drift matrix and snapshots: key_of() and labels()
+
+Another type is added with register(MetadataType(...)), nothing else has to
+change for it to be fetched, cached, compared, snapshotted and retrieved.
+"""
+from collections import OrderedDict
+
+_UNMANAGED = "ManageableState='unmanaged'"
+
+
+def field_value(record, field):
+    """
+    Value of a field of a tooling record, relationship fields are nested dicts
+        ex: field_value(r, 'AuraDefinitionBundle.DeveloperName')
+    """
+    value = record
+    for part in field.split('.'):
+        value = (value or {}).get(part)
+    return value
+
+
+class MetadataType(object):
+    """
+        One comparable metadata type
+            -records of tooling_object hold the sources, in source_field
+            -name_field is the name chosen in the pickers, key_fields (joined)
+             name a record in the compare pages, several records may share a name
+            -list_object/list_name_field list the names of the org, ex: the
+             bundles of bundle members
+    """
+
+    def __init__(self, name, label, tooling_object, name_field, source_field, key_fields=None, filters=(_UNMANAGED,),
+                 list_object=None, list_name_field=None, list_filters=(_UNMANAGED,),
+                 retrieve_type=None, retrieve_folder=None, retrieve_suffix=None, member_key=None):
+        """
+        Constructor for MetadataType Class
+        :param name: registry key, ex: 'ApexClass'
+        :param label: plural shown in the pages, ex: 'Apex classes'
+        :param filters: SOQL conditions on tooling_object
+        :param retrieve_type: Metadata API type of a retrieve, None when the type cannot be retrieved
+        :param retrieve_folder: folder of the type in a retrieved zip
+        :param retrieve_suffix: file suffix of single file types, ex: '.cls'
+        :param member_key: for bundles, function (bundle name, file name in the bundle folder) -> key or None to skip
+        """
+        self.name = name
+        self.label = label
+        self.tooling_object = tooling_object
+        self.name_field = name_field
+        self.source_field = source_field
+        self.key_fields = tuple(key_fields or (name_field,))
+        self.filters = tuple(filters)
+        self.list_object = list_object or tooling_object
+        self.list_name_field = list_name_field or name_field
+        self.list_filters = tuple(list_filters)
+        self.retrieve_type = retrieve_type
+        self.retrieve_folder = retrieve_folder
+        self.retrieve_suffix = retrieve_suffix
+        self.member_key = member_key
+
+    def metadata_soql(self):
+        """
+        Cheap query of the records of some names, {names} is the IN clause
+        """
+        fields = ['Id'] + [f for f in self.key_fields if f != 'Id'] + ['SystemModstamp']
+        where = [self.name_field + ' IN ({names})'] + list(self.filters)
+        return 'SELECT {} from {} WHERE {} ORDER BY {} ASC'.format(','.join(fields), self.tooling_object,
+                                                                   ' AND '.join(where), self.name_field)
+
+    def bodies_soql(self):
+        """
+        Sources of records by Id, {names} is the IN clause of Ids
+        """
+        return 'SELECT Id,{},SystemModstamp from {} WHERE Id IN ({{names}})'.format(self.source_field, self.tooling_object)
+
+    def list_soql(self):
+        """
+        Every name of the org with its Id and SystemModstamp
+        """
+        where = ' WHERE ' + ' AND '.join(self.list_filters) if self.list_filters else ''
+        return 'SELECT Id,{0},SystemModstamp from {1}{2} ORDER BY {0} ASC'.format(self.list_name_field, self.list_object, where)
+
+    def name_of(self, record):
+        return field_value(record, self.name_field)
+
+    def key_of(self, record):
+        return ''.join(field_value(record, field) or '' for field in self.key_fields)
+
+    def source_of(self, record):
+        return record.get(self.source_field) or ''
+
+    def retrievable(self):
+        return self.retrieve_type is not None
+
+    def __repr__(self):
+        return 'MetadataType({!r})'.format(self.name)
+
+
+TYPES = OrderedDict()
+
+
+def register(metadata_type):
+    TYPES[metadata_type.name] = metadata_type
+    return metadata_type
+
+
+def get(name):
+    """
+    :raise KeyError: unknown type
+    """
+    return TYPES[name]
+
+
+def labels():
+    """
+    :return: OrderedDict type name -> label, for the pickers
+    """
+    return OrderedDict((name, t.label) for name, t in TYPES.items())
+
+
+def parse(value, default=None):
+    """
+    Types named by a request parameter, comma separated, unknown names dropped
+    :return: list of type names
+    """
+    names = [n.strip() for n in (value or '').split(',') if n.strip() in TYPES]
+    return names or list(default or [])
+
+
+# file name suffix of an Aura bundle member -> DefType, DOCUMENTATION and SVG are not compared
+AURA_SUFFIXES = (
+    ('Controller.js', 'CONTROLLER'),
+    ('Helper.js', 'HELPER'),
+    ('Renderer.js', 'RENDERER'),
+    ('.cmp', 'COMPONENT'),
+    ('.app', 'APPLICATION'),
+    ('.evt', 'EVENT'),
+    ('.intf', 'INTERFACE'),
+    ('.design', 'DESIGN'),
+    ('.tokens', 'TOKENS'),
+    ('.css', 'STYLE'),
+)
+
+
+def _aura_member_key(bundle, file_name):
+    for suffix, def_type in AURA_SUFFIXES:
+        if file_name == bundle + suffix:
+            return bundle + def_type
+    return None
+
+
+def _lwc_member_key(bundle, file_name):
+    # FilePath of a LightningComponentResource is the path of the file in a retrieve
+    return bundle + 'lwc/{}/{}'.format(bundle, file_name)
+
+
+register(MetadataType('ApexClass', 'Apex classes', 'ApexClass', 'Name', 'Body',
+                      retrieve_type='ApexClass', retrieve_folder='classes', retrieve_suffix='.cls'))
+register(MetadataType('ApexTrigger', 'Apex triggers', 'ApexTrigger', 'Name', 'Body',
+                      retrieve_type='ApexTrigger', retrieve_folder='triggers', retrieve_suffix='.trigger'))
+register(MetadataType('ApexPage', 'Visualforce pages', 'ApexPage', 'Name', 'Markup',
+                      retrieve_type='ApexPage', retrieve_folder='pages', retrieve_suffix='.page'))
+register(MetadataType('ApexComponent', 'Visualforce components', 'ApexComponent', 'Name', 'Markup',
+                      retrieve_type='ApexComponent', retrieve_folder='components', retrieve_suffix='.component'))
+register(MetadataType('AuraDefinition', 'Aura components', 'AuraDefinition', 'AuraDefinitionBundle.DeveloperName', 'Source',
+                      key_fields=('AuraDefinitionBundle.DeveloperName', 'DefType'),
+                      filters=(_UNMANAGED, "DefType NOT IN ('DOCUMENTATION','SVG')"),
+                      list_object='AuraDefinitionBundle', list_name_field='DeveloperName',
+                      retrieve_type='AuraDefinitionBundle', retrieve_folder='aura', member_key=_aura_member_key))
+register(MetadataType('LightningComponentResource', 'Lightning web components', 'LightningComponentResource',
+                      'LightningComponentBundle.DeveloperName', 'Source',
+                      key_fields=('LightningComponentBundle.DeveloperName', 'FilePath'),
+                      filters=("LightningComponentBundle.ManageableState='unmanaged'",),
+                      list_object='LightningComponentBundle', list_name_field='DeveloperName',
+                      retrieve_type='LightningComponentBundle', retrieve_folder='lwc', member_key=_lwc_member_key))
@@ -0,0 +1,259 @@
+"""
+Timers and counters of the hot paths: Salesforce calls, diff computation,
+diff2html and template rendering.
+
+Two views of the same measurements:
+
+    -per request: timed()/record() add to the timings of the request being
+     served, sent back as a Server-Timing header (see server_timing)
+    -per process: REGISTRY aggregates counters and histograms across
+     requests, rendered in the Prometheus text format for /metrics
+
+The timings of a request live in a context variable, calls submitted to a
+thread pool through concurrent_fetch/tooling_query carry it along. Outside
+of a request (background jobs) only REGISTRY is updated.
+"""
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram(object):
+    """
+    Cumulative histogram, counts[i] is the number of values <= buckets[i]
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry(object):
+    """
+    Process wide counters, gauges and histograms, a metric is a name plus a label dict
+    """
+
+    def __init__(self):
+        self.counters = OrderedDict()
+        self.gauges = OrderedDict()
+        self.histograms = OrderedDict()
+        self.descriptions = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """
+        :return: every metric in the Prometheus text exposition format
+        """
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self.descriptions:
+                    lines.append('# HELP {} {}'.format(name, self.descriptions[name]))
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                header(name, 'counter')
+                lines.append('{}{} {}'.format(name, _labels(labels), _number(value)))
+            for (name, labels), value in sorted(self.gauges.items()):
+                header(name, 'gauge')
+                lines.append('{}{} {}'.format(name, _labels(labels), _number(value)))
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                header(name, 'histogram')
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', _number(bound)),)), count))
+                lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', '+Inf'),)), histogram.count))
+                lines.append('{}_sum{} {}'.format(name, _labels(labels), _number(histogram.sum)))
+                lines.append('{}_count{} {}'.format(name, _labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+REGISTRY.describe('compare_request_seconds', 'Time spent serving a request, streamed bodies included')
+REGISTRY.describe('compare_stage_seconds', 'Time spent in one stage (sf, diff, diff2html, render) per request')
+REGISTRY.describe('compare_sf_calls_total', 'Salesforce REST calls sent')
+REGISTRY.describe('compare_sf_bytes_received_total', 'Bytes of the Salesforce responses')
+REGISTRY.describe('compare_sf_call_seconds', 'Duration of one Salesforce REST call')
+REGISTRY.describe('compare_sf_retries_total', 'Salesforce calls retried after a 503 or REQUEST_LIMIT_EXCEEDED')
+REGISTRY.describe('compare_sf_api_used', 'API requests used in the last 24 hours, from Sforce-Limit-Info')
+REGISTRY.describe('compare_sf_api_max', 'API request allowance of 24 hours, from Sforce-Limit-Info')
+
+
+class RequestTimings(object):
+    """
+    Stage durations and counts of one request
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, count + 1)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+_current = contextvars.ContextVar('compare_request_timings', default=None)
+
+
+def start_request():
+    """
+    Start collecting the timings of the request handled by the current context
+    :return: RequestTimings
+    """
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def end_request():
+    _current.set(None)
+
+
+def current():
+    return _current.get()
+
+
+def record(stage, seconds):
+    """
+    Add seconds to a stage of the current request, no-op outside of a request
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed_iter(stage, iterable):
+    """
+    Generator over iterable, the time spent producing items is recorded as stage
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            record(stage, time.perf_counter() - start)
+            return
+        record(stage, time.perf_counter() - start)
+        yield item
+
+
+def server_timing(timings):
+    """
+    Server-Timing header value of a request, durations in milliseconds
+        ex: sf;dur=182.4;desc="6 calls", diff;dur=12.0, total;dur=201.3
+    """
+    parts = []
+    for stage, (seconds, count) in list(timings.stages.items()):
+        part = '{};dur={:.1f}'.format(stage, seconds * 1000)
+        if stage == 'sf':
+            part += ';desc="{} call{}"'.format(count, '' if count == 1 else 's')
+        parts.append(part)
+    parts.append('total;dur={:.1f}'.format(timings.elapsed() * 1000))
+    return ', '.join(parts)
+
+
+def observe_request(route, timings):
+    """
+    Aggregate the timings of a finished request into REGISTRY
+    """
+    REGISTRY.observe('compare_request_seconds', timings.elapsed(), route=route)
+    for stage, (seconds, count) in list(timings.stages.items()):
+        REGISTRY.observe('compare_stage_seconds', seconds, route=route, stage=stage)
+
+
+def observed_stream(route, stage, iterable):
+    """
+    Generator over a streamed response body, producing it is recorded as stage.
+    The body is sent after the request is torn down: it runs under the timings
+    of the request that created it and aggregates them once it is complete.
+    """
+    timings = _current.get()
+
+    def generate():
+        _current.set(timings)
+        try:
+            for item in timed_iter(stage, iterable):
+                yield item
+        finally:
+            if timings is not None:
+                observe_request(route, timings)
+            end_request()
+    return generate()
+
+
+def run_in_context(fn):
+    """
+    Wrap fn so that it runs with the context variables of the caller, for thread pools
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
@@ -0,0 +1,520 @@
+"""
+Local stand-in for the Salesforce endpoints used by the app.
+
+Serves synthetic Apex/Visualforce/Aura/LWC corpora so the compare pipeline can be measured
+without two live orgs:
+
+    -/services/oauth2/userinfo
+    -tooling query/ with nextRecordsUrl paging
+    -tooling sobjects MetadataContainer, ApexClassMember, ContainerAsyncRequest
+    -sobjects/ApexClass, ApexClass, ApexTrigger, ApexPage, ApexComponent,
+     AuraDefinitionBundle, AuraDefinition, LightningComponentBundle,
+     LightningComponentResource
+    -composite (data and tooling)
+    -Metadata API (SOAP) retrieve/checkRetrieveStatus of the Apex and
+     Visualforce types and of Aura and LWC bundles, answering with a zip like
+     a real retrieve
+
+The access token selects the org: a corpus is a dict token -> Org. Every
+call is counted per org in MockSalesforce.calls and can be slowed down by
+an injected latency.
+"""
+import base64
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+from collections import Counter, OrderedDict
+from xml.sax.saxutils import escape
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+AURA_DEF_TYPES = ('COMPONENT', 'CONTROLLER', 'HELPER', 'STYLE')
+
+_SELECT = re.compile(r'SELECT\s+(.*?)\s+from\s+(\w+)', re.IGNORECASE | re.DOTALL)
+_IN = re.compile(r'([\w.]+)\s+(NOT\s+)?IN\s*\(([^)]*)\)', re.IGNORECASE)
+_EQUALS = re.compile(r"([\w.]+)\s*=\s*'((?:[^'\\]|\\.)*)'")
+_LIMIT = re.compile(r'LIMIT\s+(\d+)', re.IGNORECASE)
+_LITERAL = re.compile(r"'((?:[^'\\]|\\.)*)'")
+_REFERENCE = re.compile(r'@\{(\w+)\.(\w+)\}')
+_SESSION_ID = re.compile(r'<(?:\w+:)?sessionId>([^<]*)<')
+_ASYNC_ID = re.compile(r'<(?:\w+:)?asyncProcessId>([^<]*)<')
+_TYPE_NAME = re.compile(r'<(?:\w+:)?name>(\w+)<')
+_QUERY_PATH = re.compile(r'/query(All)?(/|$)')
+# Salesforce limits of one composite request: sub-requests, of which query/queryAll operations
+COMPOSITE_LIMIT = 25
+COMPOSITE_QUERY_LIMIT = 5
+# DefType -> file name suffix in a retrieved bundle
+AURA_FILE_SUFFIXES = {'COMPONENT': '.cmp', 'CONTROLLER': 'Controller.js', 'HELPER': 'Helper.js', 'STYLE': '.css'}
+# single file types: sobject -> (Id prefix, source field, folder and suffix in a retrieve)
+APEX_SOBJECTS = OrderedDict([
+    ('ApexClass', ('01p', 'Body', 'classes', '.cls')),
+    ('ApexTrigger', ('01q', 'Body', 'triggers', '.trigger')),
+    ('ApexPage', ('066', 'Markup', 'pages', '.page')),
+    ('ApexComponent', ('099', 'Markup', 'components', '.component')),
+])
+
+
+class Org(object):
+    """
+    Content of one mocked org, records are flat dicts keyed by field name
+    """
+
+    _ids = itertools.count(1)
+    _stamps = itertools.count(int(time.time() * 1000))
+
+    def __init__(self, org_id, user_name):
+        self.org_id = org_id
+        self.user_name = user_name
+        self.records = dict((sobject, OrderedDict()) for sobject in list(APEX_SOBJECTS) + [
+            'AuraDefinitionBundle', 'AuraDefinition', 'LightningComponentBundle', 'LightningComponentResource'])
+        self.lock = threading.Lock()
+
+    @classmethod
+    def new_id(cls, prefix):
+        return '{}{:015d}'.format(prefix, next(cls._ids))
+
+    @classmethod
+    def modstamp(cls):
+        # one millisecond apart, so every modification gets a new SystemModstamp
+        millis = next(cls._stamps)
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(millis // 1000)) + '.{:03d}+0000'.format(millis % 1000)
+
+    def add_class(self, name, body):
+        return self.add_apex('ApexClass', name, body)
+
+    def add_apex(self, sobject, name, source):
+        """
+        :param sobject: key of APEX_SOBJECTS
+        """
+        prefix, source_field = APEX_SOBJECTS[sobject][:2]
+        record = {'Id': self.new_id(prefix), 'Name': name, source_field: source, 'ManageableState': 'unmanaged',
+                  'SystemModstamp': self.modstamp()}
+        self.records[sobject][record['Id']] = record
+        return record
+
+    def add_lwc(self, name, files):
+        """
+        :param files: dict file name in the bundle folder -> source
+        """
+        bundle = {'Id': self.new_id('0Rb'), 'DeveloperName': name, 'MasterLabel': name, 'ApiVersion': 48.0,
+                  'ManageableState': 'unmanaged', 'SystemModstamp': self.modstamp()}
+        self.records['LightningComponentBundle'][bundle['Id']] = bundle
+        for file_name, source in files.items():
+            record = {'Id': self.new_id('0Rd'), 'LightningComponentBundleId': bundle['Id'],
+                      'LightningComponentBundle.DeveloperName': name, 'LightningComponentBundle.ManageableState': 'unmanaged',
+                      'FilePath': 'lwc/{}/{}'.format(name, file_name), 'Format': file_name.rsplit('.', 1)[-1],
+                      'Source': source, 'SystemModstamp': self.modstamp()}
+            self.records['LightningComponentResource'][record['Id']] = record
+        return bundle
+
+    def add_bundle(self, name, sources):
+        """
+        :param sources: dict DefType -> source
+        """
+        bundle = {'Id': self.new_id('0Ab'), 'DeveloperName': name, 'MasterLabel': name, 'ApiVersion': 42.0,
+                  'Description': None, 'Language': 'en_US', 'ManageableState': 'unmanaged',
+                  'SystemModstamp': self.modstamp()}
+        self.records['AuraDefinitionBundle'][bundle['Id']] = bundle
+        for def_type, source in sources.items():
+            record = {'Id': self.new_id('0Ad'), 'AuraDefinitionBundleId': bundle['Id'],
+                      'AuraDefinitionBundle.DeveloperName': name, 'DefType': def_type, 'Source': source,
+                      'ManageableState': 'unmanaged', 'SystemModstamp': self.modstamp()}
+            self.records['AuraDefinition'][record['Id']] = record
+        return bundle
+
+
+def _apex_class(name, lines, rnd):
+    body = ['public with sharing class {} {{'.format(name)]
+    for i in range(lines):
+        body.append('    public static Integer method{0}(Integer value) {{ return value + {1}; }}'.format(i, rnd.randint(0, 9)))
+    body.append('}')
+    return '\n'.join(body) + '\n'
+
+
+def _change(source, rnd):
+    lines = source.split('\n')
+    i = rnd.randrange(1, max(len(lines) - 2, 2))
+    lines[i] = lines[i] + ' // changed'
+    return '\n'.join(lines)
+
+
+def generate_corpus(classes=100, bundles=10, diff_rate=0.1, class_lines=200, seed=0,
+                    triggers=0, pages=0, vf_components=0, lwc=0):
+    """
+    Two orgs holding the same components, diff_rate of them differ
+    :param triggers, pages, vf_components, lwc: number of ApexTrigger, ApexPage, ApexComponent and LWC bundles
+    :return: dict token -> Org with the tokens 'main' and 'secondary'
+    """
+    rnd = random.Random(seed)
+    main = Org('00D000000000001', 'main@example.com')
+    secondary = Org('00D000000000002', 'secondary@example.com')
+    for i in range(classes):
+        name = 'Class{:05d}'.format(i)
+        body = _apex_class(name, class_lines, rnd)
+        main.add_class(name, body)
+        secondary.add_class(name, _change(body, rnd) if rnd.random() < diff_rate else body)
+    for i in range(bundles):
+        name = 'bundle{:04d}'.format(i)
+        sources = OrderedDict((t, '<!-- {} {} -->\n'.format(name, t) + 'x = 1;\n' * class_lines) for t in AURA_DEF_TYPES)
+        main.add_bundle(name, sources)
+        secondary.add_bundle(name, OrderedDict((t, _change(s, rnd) if rnd.random() < diff_rate else s)
+                                               for t, s in sources.items()))
+    for sobject, count, template in (('ApexTrigger', triggers, 'trigger {0} on Account (before insert) {{\n'),
+                                     ('ApexPage', pages, '<apex:page controller="{0}">\n'),
+                                     ('ApexComponent', vf_components, '<apex:component>\n<!-- {0} -->\n')):
+        for i in range(count):
+            name = '{}{:04d}'.format(sobject[4:], i)
+            source = template.format(name) + '    <!-- line -->\n' * class_lines + '}\n'
+            main.add_apex(sobject, name, source)
+            secondary.add_apex(sobject, name, _change(source, rnd) if rnd.random() < diff_rate else source)
+    for i in range(lwc):
+        name = 'lwc{:04d}'.format(i)
+        files = OrderedDict([(name + '.js', '// {}\n'.format(name) + 'const x = 1;\n' * class_lines),
+                             (name + '.html', '<template>\n' + '<p></p>\n' * class_lines + '</template>\n'),
+                             (name + '.js-meta.xml', '<LightningComponentBundle/>\n')])
+        main.add_lwc(name, files)
+        secondary.add_lwc(name, OrderedDict((f, _change(s, rnd) if rnd.random() < diff_rate else s) for f, s in files.items()))
+    return {'main': main, 'secondary': secondary}
+
+
+def _parse_soql(soql):
+    select = _SELECT.search(soql)
+    fields = [f.strip() for f in select.group(1).split(',')]
+    where = soql[select.end():]
+    filters = []
+    for field, negated, values in _IN.findall(where):
+        filters.append((field, bool(negated), set(v.replace("\\'", "'") for v in _LITERAL.findall(values))))
+    for field, value in _EQUALS.findall(_IN.sub('', where)):
+        filters.append((field, False, {value.replace("\\'", "'")}))
+    limit = _LIMIT.search(where)
+    return select.group(2), fields, filters, int(limit.group(1)) if limit else None
+
+
+def _project(record, fields):
+    out = {'attributes': {'type': 'record'}}
+    for field in fields:
+        value = record.get(field)
+        if '.' in field:
+            relation, sub = field.split('.', 1)
+            out.setdefault(relation, {})[sub] = value
+        else:
+            out[field] = value
+    return out
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class MockSalesforce(object):
+    """
+        Flask app answering like the Salesforce instance of every org of a corpus
+            -latency: seconds slept before each answer
+            -page_size: records per query page, the rest goes behind nextRecordsUrl
+            -calls: Counter (token, kind) -> number of calls
+            -api_limit: daily allowance reported in Sforce-Limit-Info, calls past
+             it answer 403 REQUEST_LIMIT_EXCEEDED
+            -failure_rate: share of calls answering 503
+            -retrieve_polls: checkRetrieveStatus calls answering InProgress before the zip
+    """
+
+    def __init__(self, orgs, latency=0.0, page_size=2000, api_limit=15000, failure_rate=0.0, retrieve_polls=1):
+        self.orgs = orgs
+        self.latency = latency
+        self.page_size = page_size
+        self.api_limit = api_limit
+        self.failure_rate = failure_rate
+        self.retrieve_polls = retrieve_polls
+        self._retrieves = {}
+        self.api_usage = Counter()
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self._cursors = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+        self.app = self._create_app()
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.bytes_sent = 0
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def _org(self):
+        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        if not token and request.path.startswith('/services/Soap/'):
+            match = _SESSION_ID.search(request.get_data(as_text=True))
+            token = match.group(1) if match else ''
+        return token, self.orgs.get(token)
+
+    def _create_app(self):
+        app = Flask('mock_sf')
+        mock = self
+
+        @app.before_request
+        def before():
+            token, org = mock._org()
+            if org is None and request.path == '/services/oauth2/userinfo':
+                # the userinfo endpoint answers a bad token in plain text, not JSON
+                return Response('Bad_OAuth_Token', status=403, mimetype='text/plain')
+            if org is None:
+                return jsonify([{'errorCode': 'INVALID_SESSION_ID', 'message': 'Session expired or invalid'}]), 401
+            if not request.environ.get('mock_sf.composite'):
+                with mock._lock:
+                    mock.calls[(token, request.endpoint)] += 1
+                    mock.api_usage[token] += 1
+                    usage = mock.api_usage[token]
+                if mock.latency:
+                    time.sleep(mock.latency)
+                if usage > mock.api_limit:
+                    return jsonify([{'errorCode': 'REQUEST_LIMIT_EXCEEDED', 'message': 'TotalRequests Limit exceeded.'}]), 403
+                if mock.failure_rate and random.random() < mock.failure_rate:
+                    return jsonify([{'errorCode': 'SERVER_UNAVAILABLE', 'message': 'Service unavailable'}]), 503
+
+        @app.after_request
+        def after(response):
+            if not request.environ.get('mock_sf.composite'):
+                token, org = mock._org()
+                response.headers['Sforce-Limit-Info'] = 'api-usage={}/{}'.format(mock.api_usage[token], mock.api_limit)
+                with mock._lock:
+                    mock.bytes_sent += response.calculate_content_length() or 0
+            return response
+
+        @app.route('/services/oauth2/userinfo')
+        def userinfo():
+            token, org = mock._org()
+            base = request.host_url + 'services/data/v{version}/'
+            return jsonify({'name': org.user_name, 'organization_id': org.org_id,
+                            'urls': {'sobjects': base + 'sobjects/', 'tooling_rest': base + 'tooling/',
+                                     'rest': base, 'query': base + 'query/',
+                                     'metadata': request.host_url + 'services/Soap/m/{version}/' + org.org_id}})
+
+        @app.route('/services/data/v<version>/tooling/query/')
+        def query(version):
+            token, org = mock._org()
+            try:
+                sobject, fields, filters, limit = _parse_soql(request.args['q'])
+            except AttributeError:
+                return jsonify([{'errorCode': 'MALFORMED_QUERY', 'message': request.args.get('q')}]), 400
+            with org.lock:
+                rows = [_project(r, fields) for r in org.records.get(sobject, {}).values()
+                        if all((r.get(f) in values) != negated for f, negated, values in filters)]
+            if limit is not None:
+                rows = rows[:limit]
+            return mock._page(version, rows, 0)
+
+        @app.route('/services/data/v<version>/tooling/query/<cursor>-<int:offset>')
+        def query_more(version, cursor, offset):
+            rows = mock._cursors.get(cursor)
+            if rows is None:
+                return jsonify([{'errorCode': 'INVALID_QUERY_LOCATOR', 'message': cursor}]), 400
+            return mock._page(version, rows, offset, cursor)
+
+        @app.route('/services/data/v<version>/sobjects/ApexClass', methods=['POST'])
+        def create_class(version):
+            token, org = mock._org()
+            body = request.get_json(force=True)
+            with org.lock:
+                record = org.add_class(body['Name'], body['Body'])
+            return jsonify({'id': record['Id'], 'success': True, 'errors': []}), 201
+
+        @app.route('/services/data/v<version>/sobjects/ApexClass/<record_id>', methods=['DELETE'])
+        def delete_class(version, record_id):
+            token, org = mock._org()
+            with org.lock:
+                org.records['ApexClass'].pop(record_id, None)
+            return '', 204
+
+        @app.route('/services/data/v<version>/tooling/sobjects/<sobject>', methods=['POST'])
+        def tooling_create(version, sobject):
+            token, org = mock._org()
+            body = request.get_json(force=True)
+            record_id = Org.new_id({'MetadataContainer': '1dc', 'ApexClassMember': '400',
+                                    'ContainerAsyncRequest': '1dr'}.get(sobject, '000'))
+            with mock._lock:
+                mock._requests[record_id] = dict(body, Id=record_id, sobject=sobject)
+            if sobject == 'ContainerAsyncRequest':
+                mock._compile(org, body['MetadataContainerId'])
+            return jsonify({'id': record_id, 'success': True, 'errors': [], 'warnings': []}), 201
+
+        @app.route('/services/data/v<version>/tooling/sobjects/<sobject>/<record_id>', methods=['GET', 'DELETE'])
+        def tooling_record(version, sobject, record_id):
+            with mock._lock:
+                record = mock._requests.get(record_id)
+                if request.method == 'DELETE':
+                    mock._requests.pop(record_id, None)
+                    return '', 204
+            if record is None:
+                return jsonify([{'errorCode': 'NOT_FOUND', 'message': record_id}]), 404
+            return jsonify({'Id': record_id, 'State': 'Completed', 'ErrorMsg': None,
+                            'MetadataContainerId': record.get('MetadataContainerId'),
+                            'DeployDetails': {'componentFailures': [], 'componentSuccesses': []}})
+
+        @app.route('/services/data/v<version>/composite', methods=['POST'])
+        @app.route('/services/data/v<version>/tooling/composite', methods=['POST'])
+        def composite(version):
+            try:
+                return jsonify({'compositeResponse': mock._composite(request.get_json(force=True))})
+            except ValueError as e:
+                return jsonify([{'errorCode': 'LIMIT_EXCEEDED', 'message': str(e)}]), 400
+
+        @app.route('/services/Soap/m/<version>', methods=['POST'])
+        @app.route('/services/Soap/m/<version>/<org_id>', methods=['POST'])
+        def metadata(version, org_id=None):
+            token, org = mock._org()
+            action = request.headers.get('SOAPAction', '').strip('"')
+            envelope = request.get_data(as_text=True)
+            if action == 'retrieve':
+                retrieve_id = Org.new_id('09S')
+                with mock._lock:
+                    mock._retrieves[retrieve_id] = {'types': _TYPE_NAME.findall(envelope), 'polls': 0}
+                return mock._soap('retrieve', '<done>false</done><id>{}</id><state>Queued</state>'.format(retrieve_id))
+            match = _ASYNC_ID.search(envelope)
+            job = mock._retrieves.get(match.group(1)) if match and action == 'checkRetrieveStatus' else None
+            if job is None:
+                return mock._soap_fault('INVALID_ID', action)
+            with mock._lock:
+                job['polls'] += 1
+                pending = job['polls'] <= mock.retrieve_polls
+            if pending:
+                return mock._soap('checkRetrieveStatus', '<done>false</done><id>{}</id><status>InProgress</status>'.format(match.group(1)))
+            return mock._soap('checkRetrieveStatus', mock._retrieve_result(org, match.group(1), job['types']))
+
+        return app
+
+    def _soap(self, operation, result):
+        return Response('<?xml version="1.0" encoding="UTF-8"?>'
+                        '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"'
+                        ' xmlns="http://soap.sforce.com/2006/04/metadata"><soapenv:Body>'
+                        '<{0}Response><result>{1}</result></{0}Response>'
+                        '</soapenv:Body></soapenv:Envelope>'.format(operation, result), mimetype='text/xml')
+
+    def _soap_fault(self, code, message):
+        return Response('<?xml version="1.0" encoding="UTF-8"?>'
+                        '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body>'
+                        '<soapenv:Fault><faultcode>{}</faultcode><faultstring>{}</faultstring></soapenv:Fault>'
+                        '</soapenv:Body></soapenv:Envelope>'.format(code, escape(message)), status=500, mimetype='text/xml')
+
+    def _retrieve_result(self, org, retrieve_id, types):
+        """
+        checkRetrieveStatus result of a finished retrieve: fileProperties and the base64 zip
+        """
+        buffer = io.BytesIO()
+        properties = []
+        with org.lock, zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for sobject, (prefix, source_field, folder, suffix) in APEX_SOBJECTS.items():
+                if sobject not in types:
+                    continue
+                for record in org.records[sobject].values():
+                    file_name = '{}/{}{}'.format(folder, record['Name'], suffix)
+                    archive.writestr(file_name, record[source_field])
+                    archive.writestr(file_name + '-meta.xml', '<{}/>'.format(sobject))
+                    properties.append((sobject, record['Name'], file_name, record['Id'], record['SystemModstamp']))
+            if 'AuraDefinitionBundle' in types:
+                for bundle in org.records['AuraDefinitionBundle'].values():
+                    name = bundle['DeveloperName']
+                    for record in org.records['AuraDefinition'].values():
+                        if record['AuraDefinitionBundleId'] == bundle['Id']:
+                            archive.writestr('aura/{0}/{0}{1}'.format(name, AURA_FILE_SUFFIXES[record['DefType']]), record['Source'])
+                    properties.append(('AuraDefinitionBundle', name, 'aura/' + name, bundle['Id'], bundle['SystemModstamp']))
+            if 'LightningComponentBundle' in types:
+                for bundle in org.records['LightningComponentBundle'].values():
+                    name = bundle['DeveloperName']
+                    for record in org.records['LightningComponentResource'].values():
+                        if record['LightningComponentBundleId'] == bundle['Id']:
+                            archive.writestr(record['FilePath'], record['Source'])
+                    properties.append(('LightningComponentBundle', name, 'lwc/' + name, bundle['Id'], bundle['SystemModstamp']))
+        result = ''.join('<fileProperties><fileName>{}</fileName><fullName>{}</fullName><id>{}</id>'
+                         '<lastModifiedDate>{}</lastModifiedDate><manageableState>unmanaged</manageableState>'
+                         '<type>{}</type></fileProperties>'.format(escape(file_name), escape(name), record_id, modstamp, kind)
+                         for kind, name, file_name, record_id, modstamp in
+                         # dateTime of the Metadata API, not the SystemModstamp format of tooling records
+                         [(k, n, f, i, m.replace('+0000', 'Z')) for k, n, f, i, m in properties])
+        return '<done>true</done>{}<id>{}</id><status>Succeeded</status><success>true</success><zipFile>{}</zipFile>'.format(
+            result, retrieve_id, base64.b64encode(buffer.getvalue()).decode('ascii'))
+
+    def _page(self, version, rows, offset, cursor=None):
+        end = offset + self.page_size
+        page = {'totalSize': len(rows), 'done': end >= len(rows), 'records': rows[offset:end]}
+        if not page['done']:
+            if cursor is None:
+                cursor = Org.new_id('01g')
+                with self._lock:
+                    self._cursors[cursor] = rows
+            page['nextRecordsUrl'] = '/services/data/v{}/tooling/query/{}-{}'.format(version, cursor, end)
+        return jsonify(page)
+
+    def _compile(self, org, container_id):
+        with self._lock:
+            members = [r for r in self._requests.values()
+                       if r['sobject'] == 'ApexClassMember' and r['MetadataContainerId'] == container_id]
+        with org.lock:
+            for member in members:
+                record = org.records['ApexClass'].get(member['ContentEntityId'])
+                if record is not None:
+                    record['Body'] = member['Body']
+                    record['SystemModstamp'] = Org.modstamp()
+
+    def _composite(self, payload):
+        """
+        :raise ValueError: more sub-requests than Salesforce accepts in one call
+        """
+        requests = payload['compositeRequest']
+        if len(requests) > COMPOSITE_LIMIT:
+            raise ValueError('A composite request can contain at most {} subrequests'.format(COMPOSITE_LIMIT))
+        if sum(1 for sub in requests if _QUERY_PATH.search(sub['url'].split('?')[0])) > COMPOSITE_QUERY_LIMIT:
+            raise ValueError('A composite request can contain at most {} query operations'.format(COMPOSITE_QUERY_LIMIT))
+        client = self.app.test_client()
+        known = {}
+        results = []
+        for sub in payload['compositeRequest']:
+            body = sub.get('body')
+            if body is not None:
+                body = json.loads(_REFERENCE.sub(lambda m: str(known.get(m.group(1), {}).get(m.group(2))), json.dumps(body)))
+            response = client.open(sub['url'], method=sub['method'], json=body,
+                                   headers={'Authorization': request.headers['Authorization']},
+                                   environ_overrides={'mock_sf.composite': True})
+            known[sub['referenceId']] = response.get_json(silent=True)
+            results.append({'referenceId': sub['referenceId'], 'httpStatusCode': response.status_code,
+                            'body': known[sub['referenceId']], 'httpHeaders': {}})
+        return results
+
+    def serve(self, host='127.0.0.1', port=0):
+        """
+        Start a threaded server in the background
+        :return: base url of the server, usable as an instance url
+        """
+        server = make_server(host, port, self.app, threaded=True, request_handler=_QuietHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.server = server
+        return 'http://{}:{}'.format(host, server.server_port)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve a synthetic pair of orgs, tokens "main" and "secondary"')
+    parser.add_argument('--classes', type=int, default=100)
+    parser.add_argument('--bundles', type=int, default=10)
+    parser.add_argument('--diff-rate', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--api-limit', type=int, default=15000)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=5050)
+    args = parser.parse_args()
+    MockSalesforce(generate_corpus(args.classes, args.bundles, args.diff_rate), args.latency,
+                   api_limit=args.api_limit, failure_rate=args.failure_rate).app.run(port=args.port, threaded=True)
@@ -0,0 +1,63 @@
+"""
+Drift matrix of components across N orgs.
+
+The sources of every org are fetched once, then each component is grouped
+by fingerprint: orgs holding the same content share a variant (A, B, ...).
+A diff is only ever needed between the first org of two distinct variants,
+so N orgs cost N fetches and at most (variants - 1) diffs per component,
+instead of N*(N-1)/2 pairwise comparisons.
+"""
+import string
+from collections import OrderedDict
+
+from source_compare import fingerprint
+
+MISSING = None
+
+
+def variant_label(index):
+    """
+    0 -> 'A', 25 -> 'Z', 26 -> 'AA'
+    """
+    label = ''
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        label = string.ascii_uppercase[rest] + label
+    return label
+
+
+def build_matrix(sources_by_org, mode='exact'):
+    """
+    :param sources_by_org: OrderedDict org label -> OrderedDict key -> SourceRecord
+    :param mode: normalization mode of the fingerprints, see source_compare.NORMALIZE_MODES
+    :return: list of dicts, one per key of any org, sorted by key:
+        key, name,
+        cells: OrderedDict org label -> variant label, None when the org lacks the key
+        variants: OrderedDict variant label -> first org label holding it
+        drift: True when the orgs holding the key do not all share one variant,
+               or some org lacks it
+    """
+    keys = set()
+    for sources in sources_by_org.values():
+        keys.update(sources)
+    rows = []
+    for key in sorted(keys):
+        cells = OrderedDict()
+        variants = OrderedDict()
+        by_fingerprint = {}
+        name = None
+        for org, sources in sources_by_org.items():
+            record = sources.get(key)
+            if record is None:
+                cells[org] = MISSING
+                continue
+            name = name or record.name
+            value = fingerprint(record.body, mode, record.hash)
+            if value not in by_fingerprint:
+                by_fingerprint[value] = variant_label(len(by_fingerprint))
+                variants[by_fingerprint[value]] = org
+            cells[org] = by_fingerprint[value]
+        rows.append({'key': key, 'name': name, 'cells': cells, 'variants': variants,
+                     'drift': len(variants) > 1 or MISSING in cells.values()})
+    return rows
@@ -0,0 +1,172 @@
+"""
+API limit aware scheduling of the Salesforce calls of a worker process.
+
+    -the Sforce-Limit-Info header of every response (api-usage=used/max)
+     updates the API budget of its org, budget(org) exposes it to the app
+    -at most SETTINGS['max_in_flight'] calls of one org run at once; past
+     SETTINGS['slowdown_at'] of the daily allowance the cap shrinks towards
+     one call and calls are spaced out, up to SETTINGS['slowdown_delay']
+     seconds apart when the allowance is spent
+    -idempotent calls answering 503 or REQUEST_LIMIT_EXCEEDED are retried
+     with full-jitter exponential backoff, other calls are never retried
+
+Orgs are identified by the label RESTApi gives them (the instance host).
+"""
+import random
+import re
+import threading
+import time
+
+import metrics
+
+SETTINGS = {
+    'max_in_flight': 8,
+    'retries': 3,
+    'backoff_base': 0.5,
+    'backoff_max': 8.0,
+    'slowdown_at': 0.8,
+    'slowdown_delay': 1.0,
+}
+
+_API_USAGE = re.compile(r'api-usage=(\d+)/(\d+)')
+_RETRY_STATUS = (503,)
+
+
+def configure(max_in_flight=None, retries=None, backoff_base=None, backoff_max=None, slowdown_at=None, slowdown_delay=None):
+    for name, value in (('max_in_flight', max_in_flight), ('retries', retries), ('backoff_base', backoff_base),
+                        ('backoff_max', backoff_max), ('slowdown_at', slowdown_at), ('slowdown_delay', slowdown_delay)):
+        if value is not None:
+            SETTINGS[name] = value
+
+
+def parse_limit_info(header):
+    """
+    :param header: Sforce-Limit-Info value, ex: 'api-usage=18/15000'
+    :return: (used, max) or None
+    """
+    match = _API_USAGE.search(header or '')
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def is_limit_error(response):
+    if response.status_code != 403:
+        return False
+    return b'REQUEST_LIMIT_EXCEEDED' in response.content
+
+
+def backoff(attempt):
+    """
+    Seconds to wait before retry number attempt (0 based), full jitter
+    """
+    return random.uniform(0, min(SETTINGS['backoff_max'], SETTINGS['backoff_base'] * 2 ** attempt))
+
+
+class OrgScheduler(object):
+    """
+    Budget and in-flight calls of one org
+    """
+
+    def __init__(self, org):
+        self.org = org
+        self.used = None
+        self.max = None
+        self.updated = None
+        self.in_flight = 0
+        self.next_slot = 0.0
+        self._cond = threading.Condition()
+
+    def ratio(self):
+        if not self.max:
+            return 0.0
+        return min(float(self.used) / self.max, 1.0)
+
+    def _pressure(self):
+        """
+        0 below slowdown_at, growing to 1 when the allowance is spent
+        """
+        slowdown_at = SETTINGS['slowdown_at']
+        if slowdown_at >= 1:
+            return 0.0
+        return max(self.ratio() - slowdown_at, 0.0) / (1 - slowdown_at)
+
+    def cap(self):
+        return max(1, int(round(SETTINGS['max_in_flight'] * (1 - self._pressure()))))
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.cap():
+                self._cond.wait()
+            self.in_flight += 1
+            delay = SETTINGS['slowdown_delay'] * self._pressure()
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + delay
+        if slot > now:
+            time.sleep(slot - now)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def observe(self, response):
+        usage = parse_limit_info(response.headers.get('Sforce-Limit-Info'))
+        if usage is None:
+            return
+        with self._cond:
+            self.used, self.max = usage
+            self.updated = time.time()
+            # the cap may have grown back
+            self._cond.notify_all()
+        metrics.REGISTRY.set('compare_sf_api_used', usage[0], org=self.org)
+        metrics.REGISTRY.set('compare_sf_api_max', usage[1], org=self.org)
+
+    def budget(self):
+        return {'used': self.used, 'max': self.max,
+                'remaining': None if self.max is None else self.max - self.used,
+                'ratio': self.ratio(), 'in_flight': self.in_flight, 'cap': self.cap(), 'updated': self.updated}
+
+
+_orgs = {}
+_orgs_lock = threading.Lock()
+
+
+def for_org(org):
+    with _orgs_lock:
+        scheduler = _orgs.get(org)
+        if scheduler is None:
+            scheduler = _orgs[org] = OrgScheduler(org)
+        return scheduler
+
+
+def budget(org):
+    """
+    :return: API budget of an org as a dict, used/max/remaining are None until a response told them
+    """
+    return for_org(org).budget()
+
+
+def send(org, send_call, idempotent):
+    """
+    Run send_call() under the in-flight cap of org, retrying idempotent calls
+    :param send_call: function sending the request, returns a requests.Response
+    :param idempotent: True when the call may be repeated, ex: GET
+    :return: the last response
+    """
+    scheduler = for_org(org)
+    attempt = 0
+    while True:
+        scheduler.acquire()
+        try:
+            response = send_call()
+        finally:
+            scheduler.release()
+        scheduler.observe(response)
+        retryable = response.status_code in _RETRY_STATUS or is_limit_error(response)
+        if not (idempotent and retryable and attempt < SETTINGS['retries']):
+            return response
+        metrics.REGISTRY.inc('compare_sf_retries_total', org=org, status=response.status_code)
+        time.sleep(backoff(attempt))
+        attempt += 1
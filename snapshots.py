@@ -0,0 +1,164 @@
+"""
+Offline snapshots of the sources of an org, one or several metadata_types types.
+
+On disk, under one root directory:
+
+    objects/<2 hex>/<38 hex>     zlib compressed source, named by its sha1
+                                 (source_compare.content_hash), so a source
+                                 shared by several snapshots is stored once
+    manifests/<snapshot id>.json.gz
+                                 label, org, owners, creation time and one
+                                 item per record: kind, Id, name, key,
+                                 SystemModstamp, hash, size
+
+A snapshot holds the source of an org, it is only readable by a session
+connected to one of its owners: the organization ids connected when it was
+taken. list() and manifest() filter on the organization ids of the caller.
+
+A snapshot loads as the same OrderedDict key -> SourceRecord that
+SourceCache.fetch returns, so it can stand on either side of a comparison.
+Against the live org it was taken from, seed() lets SourceCache.fetch reuse
+the snapshot body of every record whose SystemModstamp did not change.
+"""
+import gzip
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from source_cache import SourceRecord
+from source_compare import content_hash
+
+_SNAPSHOT_ID = re.compile(r'^[\w-]{1,64}$')
+
+
+class SnapshotStore(object):
+    """
+        Content addressed snapshot store
+            -create() writes the sources of an org
+            -list(), manifest(), load() and seed() read them back
+    """
+
+    def __init__(self, root):
+        """
+        Constructor for SnapshotStore Class
+        :param root: directory of the store, created when missing
+        """
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'manifests'), exist_ok=True)
+
+    def _object_path(self, body_hash):
+        return os.path.join(self.root, 'objects', body_hash[:2], body_hash[2:])
+
+    def _manifest_path(self, snapshot_id):
+        if not _SNAPSHOT_ID.match(snapshot_id or ''):
+            raise KeyError(snapshot_id)
+        return os.path.join(self.root, 'manifests', snapshot_id + '.json.gz')
+
+    def _write(self, path, data):
+        """
+        Atomic write, a reader never sees a partial file
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def put(self, body):
+        """
+        Store a source unless already present
+        :return: its hash
+        """
+        body_hash = content_hash(body)
+        path = self._object_path(body_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write(path, zlib.compress(body.encode('utf-8'), 9))
+        return body_hash
+
+    def get(self, body_hash):
+        with open(self._object_path(body_hash), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def create(self, label, org_id, user_name, sources, owners=(), seedable=True):
+        """
+        :param sources: dict kind -> OrderedDict key -> SourceRecord, ex: the results of SourceCache.fetch
+        :param owners: organization ids allowed to read the snapshot besides org_id, ex: every org of the session
+        :param seedable: the records hold tooling Ids and SystemModstamps, False for a Metadata API retrieve
+                         (lastModifiedDate, no Id of bundle members) which seed() cannot match
+        :return: manifest dict of the new snapshot
+        """
+        items = []
+        for kind, records in sources.items():
+            for record in records.values():
+                items.append({'kind': kind, 'id': record.id, 'name': record.name, 'key': record.key,
+                              'modstamp': record.modstamp, 'hash': self.put(record.body), 'size': len(record.body)})
+        manifest = {'id': time.strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:6],
+                    'label': label, 'org_id': org_id, 'owners': sorted(set(owners) | {org_id}), 'user': user_name,
+                    'created': time.time(), 'seedable': seedable, 'items': items}
+        self._write(self._manifest_path(manifest['id']), gzip.compress(json.dumps(manifest).encode('utf-8')))
+        return manifest
+
+    def _read(self, snapshot_id):
+        try:
+            with gzip.open(self._manifest_path(snapshot_id), 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (KeyError, IOError):
+            return None
+
+    @staticmethod
+    def _owned(manifest, org_ids):
+        return bool(set(manifest.get('owners') or [manifest['org_id']]) & set(org_ids))
+
+    def manifest(self, snapshot_id, org_ids):
+        """
+        :param org_ids: organization ids of the caller
+        :return: manifest dict, None for an unknown id or a snapshot none of org_ids owns
+        """
+        manifest = self._read(snapshot_id)
+        if manifest is None or not self._owned(manifest, org_ids):
+            return None
+        return manifest
+
+    def list(self, org_ids):
+        """
+        :param org_ids: organization ids of the caller
+        :return: manifests of the snapshots owned by org_ids without their items, newest first
+        """
+        snapshots = []
+        for name in sorted(os.listdir(os.path.join(self.root, 'manifests')), reverse=True):
+            if name.endswith('.json.gz'):
+                manifest = self.manifest(name[:-len('.json.gz')], org_ids)
+                if manifest is not None:
+                    summary = dict((k, v) for k, v in manifest.items() if k != 'items')
+                    summary['count'] = len(manifest['items'])
+                    snapshots.append(summary)
+        return snapshots
+
+    def load(self, manifest, kind, names=None):
+        """
+        :param names: component names to keep, all when None
+        :return: OrderedDict key -> SourceRecord, like SourceCache.fetch
+        """
+        names = set(names) if names else None
+        result = OrderedDict()
+        for item in manifest['items']:
+            if item['kind'] == kind and (names is None or item['name'] in names):
+                result[item['key']] = SourceRecord(item['id'], item['name'], item['key'], item['modstamp'],
+                                                   self.get(item['hash']), item['hash'])
+        return result
+
+    def seed(self, manifest, kind):
+        """
+        Bodies known for records of the snapshot org, for SourceCache.fetch
+        :return: dict record Id -> (modstamp, function returning (body, hash)), empty when not seedable
+        """
+        if not manifest.get('seedable', True):
+            return {}
+        return dict((item['id'], (item['modstamp'], lambda h=item['hash']: (self.get(h), h)))
+                    for item in manifest['items'] if item['kind'] == kind)
@@ -0,0 +1,135 @@
+"""
+On-disk cache of the sources of every metadata_types type.
+
+A metadata-only query (Id, key fields, SystemModstamp) tells which records
+changed since they were cached, only those bodies are downloaded again.
+Entries are keyed by (organization id, object, record Id) and live in a
+SQLite file shared by all gunicorn workers, so they survive worker
+restarts. The file is bounded in size, least recently used rows go first.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import metadata_types
+from source_compare import content_hash
+from tooling_query import query_in_chunks
+
+SourceRecord = namedtuple('SourceRecord', ['id', 'name', 'key', 'modstamp', 'body', 'hash'])
+
+# max number of bound parameters of one sqlite statement
+_SQL_CHUNK = 500
+
+
+class SourceCache(object):
+    """
+        Source cache stored in a SQLite file
+            -fetch() returns every record of the selected names with its body,
+             downloading only new or modified bodies
+            -max_bytes bounds the total size of cached bodies
+    """
+
+    def __init__(self, path, max_bytes):
+        """
+        Constructor for SourceCache Class
+        :param path: SQLite file, created when missing
+        :param max_bytes: size of cached bodies above which rows are evicted
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS sources ('
+                       'org_id TEXT, object TEXT, record_id TEXT, modstamp TEXT,'
+                       'body TEXT, hash TEXT, size INTEGER, accessed REAL,'
+                       'PRIMARY KEY (org_id, object, record_id))')
+            db.execute('CREATE INDEX IF NOT EXISTS sources_accessed ON sources (accessed)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def fetch(self, rest, tooling_url, org_id, kind, names, seed=None):
+        """
+        :param rest: RESTApi of the org
+        :param tooling_url: urls['tooling_rest'] of the org userinfo
+        :param org_id: organization_id of the org userinfo
+        :param kind: name of a metadata_types type
+        :param names: names selected in the picker
+        :param seed: bodies known elsewhere, ex: SnapshotStore.seed(),
+                     dict record Id -> (modstamp, function returning (body, hash))
+        :return: OrderedDict key -> SourceRecord, in query order
+        """
+        metadata_type = metadata_types.get(kind)
+        metadata = list(query_in_chunks(rest, tooling_url, metadata_type.metadata_soql(), names))
+        cached = self._load(org_id, kind, metadata)
+        if seed:
+            seeded = []
+            for r in metadata:
+                known = seed.get(r['Id'])
+                if r['Id'] not in cached and known is not None and known[0] == r['SystemModstamp']:
+                    cached[r['Id']] = body, body_hash = known[1]()
+                    seeded.append((org_id, kind, r['Id'], r['SystemModstamp'], body, body_hash, len(body), time.time()))
+            if seeded:
+                self._store(seeded)
+
+        missing = [r['Id'] for r in metadata if r['Id'] not in cached]
+        if missing:
+            fetched = []
+            for r in query_in_chunks(rest, tooling_url, metadata_type.bodies_soql(), missing):
+                body = metadata_type.source_of(r)
+                cached[r['Id']] = (body, content_hash(body))
+                fetched.append((org_id, kind, r['Id'], r['SystemModstamp'], body, cached[r['Id']][1], len(body), time.time()))
+            self._store(fetched)
+
+        result = OrderedDict()
+        for r in metadata:
+            if r['Id'] in cached:
+                body, body_hash = cached[r['Id']]
+                key = metadata_type.key_of(r)
+                result[key] = SourceRecord(r['Id'], metadata_type.name_of(r), key, r['SystemModstamp'], body, body_hash)
+        return result
+
+    def _load(self, org_id, kind, metadata):
+        """
+        :return: dict record Id -> (body, hash) of the cached rows still up to date
+        """
+        modstamps = dict((r['Id'], r['SystemModstamp']) for r in metadata)
+        ids = list(modstamps)
+        found = {}
+        with self._connect() as db:
+            for i in range(0, len(ids), _SQL_CHUNK):
+                chunk = ids[i:i + _SQL_CHUNK]
+                rows = db.execute('SELECT record_id, modstamp, body, hash FROM sources'
+                                  ' WHERE org_id = ? AND object = ? AND record_id IN (%s)' % ','.join('?' * len(chunk)),
+                                  [org_id, kind] + chunk)
+                for record_id, modstamp, body, body_hash in rows:
+                    if modstamp == modstamps[record_id]:
+                        found[record_id] = (body, body_hash)
+            now = time.time()
+            db.executemany('UPDATE sources SET accessed = ? WHERE org_id = ? AND object = ? AND record_id = ?',
+                           [(now, org_id, kind, record_id) for record_id in found])
+        return found
+
+    def _store(self, rows):
+        with self._connect() as db:
+            db.executemany('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self._evict()
+
+    def _evict(self):
+        with self._lock, self._connect() as db:
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM sources').fetchone()[0]
+            while total > self.max_bytes:
+                rows = db.execute('SELECT rowid, size FROM sources ORDER BY accessed LIMIT 100').fetchall()
+                if not rows:
+                    break
+                db.executemany('DELETE FROM sources WHERE rowid = ?', [(rowid,) for rowid, size in rows])
+                total -= sum(size for rowid, size in rows)
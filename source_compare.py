@@ -0,0 +1,123 @@
+"""
+Cheap equality checks for Apex/Aura sources.
+
+Sources are compared through a content hash first, the character diff only
+runs for pairs whose hashes differ and only when it is actually displayed.
+
+A normalization mode hides differences nobody cares about (line endings,
+whitespace, comments). Each source gets one fingerprint per mode, the hash
+of its normalized text, memoized by raw content hash. Pairs are classified
+by comparing hashes then fingerprints, before any diff runs.
+"""
+import hashlib
+import re
+from collections import OrderedDict
+
+from ttl_cache import TTLCache
+
+_TRAILING_WHITESPACE = re.compile(r'[ \t]+$', re.MULTILINE)
+_INNER_WHITESPACE = re.compile(r'[ \t]+')
+# string literals are matched first and kept, so '//' inside a string is not a comment
+_COMMENTS = re.compile(r'("(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\')|/\*.*?\*/|//[^\n]*|<!--.*?-->', re.DOTALL)
+
+IDENTICAL = 'identical'
+EQUIVALENT = 'equivalent'
+DIFFERENT = 'different'
+
+
+def normalize_line_endings(text):
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def normalize_source(text):
+    """
+    Drop differences nobody cares about: CRLF/CR line endings and trailing whitespace
+    """
+    return _TRAILING_WHITESPACE.sub('', normalize_line_endings(text))
+
+
+def normalize_whitespace(text):
+    """
+    Line endings, indentation, runs of blanks and blank lines
+    """
+    lines = (_INNER_WHITESPACE.sub(' ', line).strip() for line in normalize_line_endings(text).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def normalize_comments(text):
+    """
+    Whitespace plus // and /* */ comments (Apex, JavaScript, CSS) and <!-- --> comments (markup)
+    """
+    return normalize_whitespace(_COMMENTS.sub(lambda m: m.group(1) or '', normalize_line_endings(text)))
+
+
+# mode -> (normalize function, label of the pickers), None compares the raw text
+NORMALIZE_MODES = OrderedDict([
+    ('exact', (None, 'Nothing, exact comparison')),
+    ('line_endings', (normalize_line_endings, 'Line endings')),
+    ('trailing_whitespace', (normalize_source, 'Line endings and trailing whitespace')),
+    ('whitespace', (normalize_whitespace, 'All whitespace and blank lines')),
+    ('comments', (normalize_comments, 'Whitespace and comments')),
+])
+
+_fingerprints = TTLCache(ttl=3600, max_size=50000)
+
+
+def normalize_mode(value):
+    """
+    Mode named by a request parameter, '1' is the former on/off normalize flag
+    :return: key of NORMALIZE_MODES, 'exact' for unknown values
+    """
+    if value in (True, '1'):
+        return 'trailing_whitespace'
+    return value if value in NORMALIZE_MODES else 'exact'
+
+
+def normalizer(mode):
+    """
+    :return: normalize function of a mode, identity for 'exact'
+    """
+    return NORMALIZE_MODES[normalize_mode(mode)][0] or (lambda text: text)
+
+
+def content_hash(text, normalize=False):
+    """
+    :param text: source body, None is treated as an empty source
+    :param normalize: hash the normalized version of text, True or a NORMALIZE_MODES key
+    :return: hex sha1 of the source
+    """
+    text = text or ''
+    if normalize:
+        text = normalizer(normalize)(text)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def fingerprint(text, mode, raw_hash=None):
+    """
+    Hash of the normalized text, computed once per (raw content, mode)
+    :param raw_hash: content_hash(text) when already known, ex: SourceRecord.hash
+    """
+    mode = normalize_mode(mode)
+    raw_hash = raw_hash or content_hash(text)
+    if mode == 'exact':
+        return raw_hash
+    value = _fingerprints.get((raw_hash, mode))
+    if value is None:
+        value = content_hash(text, mode)
+        _fingerprints.set((raw_hash, mode), value)
+    return value
+
+
+def classify(text_one, text_two, mode='exact', hash_one=None, hash_two=None):
+    """
+    :return: IDENTICAL, EQUIVALENT (same fingerprint under mode) or DIFFERENT
+    """
+    if text_one == text_two:
+        return IDENTICAL
+    hash_one = hash_one or content_hash(text_one)
+    hash_two = hash_two or content_hash(text_two)
+    if hash_one == hash_two:
+        return IDENTICAL
+    if fingerprint(text_one, mode, hash_one) == fingerprint(text_two, mode, hash_two):
+        return EQUIVALENT
+    return DIFFERENT
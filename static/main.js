@@ -42,5 +42,143 @@ $(document).ready(function () {
 		window.location =  oauthUrl;
 
 	})
+
+	$('#other-login').click(function() {
+		var label = $.trim($('#other_org_label').val())
+		if ( !/^[\w-]{1,32}$/.test(label) || label == 'main' || label == 'secondary' ) {
+			$('#other_org_label').focus()
+			return
+		}
+		var oauthUrl = "https://login.salesforce.com"
+		if ( $('#other_org_env').val() == 'Sandbox' ) {
+			var oauthUrl = "https://test.salesforce.com"
+		}
+		var clientid = $("#client-id").val()
+		var baseHostUrl = location.protocol + '//' + location.host;
+		var callBackUrl = baseHostUrl + "/auth/authorized";
+		var state = {
+			org: label,
+			type: $('#other_org_env').val()
+		}
+		oauthUrl += "/services/oauth2/authorize?" +
+			"response_type=code&client_id=" + clientid +
+			"&prompt=login" +
+			"&redirect_uri=" + callBackUrl + "&state=" + btoa(JSON.stringify(state));
+
+		window.location =  oauthUrl;
+
+	})
+
+	$('.show-diff').click(function() {
+		var button = $(this)
+		var fragment = button.next('.diff-fragment')
+		if ( button.data('loaded') ) {
+			fragment.toggle()
+			return
+		}
+		button.prop('disabled', true)
+		$.get(button.data('url'), function(html) {
+			fragment.html(html)
+			button.data('loaded', true)
+		}).always(function() {
+			button.prop('disabled', false)
+		})
+	})
+
+	function pickerOption(name, field, checked) {
+		var id = 'pick-' + field + '-' + name
+		var input = $('<input type="checkbox" />').attr({id: id, name: field, value: name}).prop('checked', checked)
+		var label = $('<label class="slds-checkbox__label">').attr('for', id)
+			.append('<span class="slds-checkbox_faux"></span>')
+			.append($('<span class="slds-form-element__label">').text(name))
+		return $('<div class="slds-form-element">').attr('data-name', name)
+			.append($('<div class="slds-form-element__control">').append($('<span class="slds-checkbox">').append(input, label)))
+	}
+
+	function pickerLoad(picker, append) {
+		var offset = append ? picker.data('next-offset') : 0
+		var query = picker.find('.picker-search').val()
+		var seq = (picker.data('seq') || 0) + 1
+		picker.data('seq', seq)
+		$.getJSON(picker.data('url'), {q: query, offset: offset, limit: 50}, function(page) {
+			if ( picker.data('seq') != seq ) {
+				return
+			}
+			var results = picker.find('.picker-results')
+			if ( !append ) {
+				results.empty()
+			}
+			var selected = picker.find('.picker-selected')
+			$.each(page.items, function(i, item) {
+				if ( !selected.find('[data-name="' + item.name.replace(/"/g, '') + '"]').length ) {
+					results.append(pickerOption(item.name, picker.data('name'), false))
+				}
+			})
+			picker.find('.picker-count').text(page.total + ' of ' + page.size)
+			picker.data('next-offset', page.next_offset)
+			picker.find('.picker-more').prop('hidden', page.next_offset === null)
+		})
+	}
+
+	$('.picker').each(function() {
+		var picker = $(this)
+		var timer = null
+		picker.find('.picker-search').on('input', function() {
+			clearTimeout(timer)
+			timer = setTimeout(function() { pickerLoad(picker, false) }, 200)
+		})
+		picker.find('.picker-more').click(function() {
+			pickerLoad(picker, true)
+		})
+		picker.on('change', '.picker-results input', function() {
+			$(this).closest('.slds-form-element').appendTo(picker.find('.picker-selected'))
+		})
+		picker.on('change', '.picker-selected input', function() {
+			$(this).closest('.slds-form-element').remove()
+		})
+		pickerLoad(picker, false)
+	})
+
+	function pollJob() {
+		var progress = $('#job-progress')
+		$.getJSON(progress.data('url'), function(job) {
+			progress.find('.job-state').text(job.state)
+			progress.find('.job-done').text(job.done)
+			progress.find('.job-remaining').text(job.remaining)
+			progress.find('.job-bytes').text(job.bytes_fetched)
+			if ( job.state == 'done' ) {
+				window.location = progress.data('view-url')
+			} else if ( job.state == 'failed' ) {
+				$('.job-error').text(job.error)
+			} else {
+				setTimeout(pollJob, 2000)
+			}
+		})
+	}
+
+	if ( $('#job-progress').length && $('.job-state').text() != 'failed' ) {
+		setTimeout(pollJob, 1000)
+	}
+
+	function pollDeploy() {
+		var status = $('#deploy-status')
+		$.getJSON(status.data('url'), function(deploy) {
+			status.find('.deploy-state').text(deploy.state)
+			if ( !deploy.done ) {
+				setTimeout(pollDeploy, 2000)
+				return
+			}
+			if ( deploy.error ) {
+				$('.deploy-failures').append($('<li>').text(deploy.error))
+			}
+			$.each(deploy.failures, function(i, failure) {
+				$('.deploy-failures').append($('<li>').text(failure.name + ' line ' + failure.line + ': ' + failure.problem))
+			})
+		})
+	}
+
+	if ( $('#deploy-status').length ) {
+		setTimeout(pollDeploy, 1000)
+	}
 		
 })
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+Batched ApexClass deploy through the Tooling API.
+
+All classes of a deploy go into one MetadataContainer as ApexClassMember
+records and are compiled by a single ContainerAsyncRequest, so the target
+org is never left without a class between a delete and a create. Classes
+missing from the target are created first (sobjects/ApexClass), a member
+needs the Id of an existing class. Creates, and the container with its
+members and request, are each folded into composite calls. The async
+request is polled with deploy_status(), which never blocks.
+"""
+import uuid
+
+# ContainerAsyncRequest states after which nothing changes anymore
+FINAL_STATES = ('Completed', 'Failed', 'Error', 'Aborted', 'Invalidated')
+
+
+class DeployError(Exception):
+    """
+    Raised when a Tooling API call of the deploy fails, keeps the failing response
+    """
+
+    def __init__(self, response):
+        super(DeployError, self).__init__(response.status_code)
+        self.response = response
+
+
+def _execute(batch):
+    """
+    Run a composite batch, the first failed sub-request raises DeployError
+    """
+    results = batch.execute()
+    for result in results:
+        if result.status_code >= 400:
+            raise DeployError(result)
+    return results
+
+
+def start_deploy(rest, urls, sources, target_ids):
+    """
+    Create the container, its members and the async compile request
+    :param rest: RESTApi of the target org
+    :param urls: urls of the target org userinfo
+    :param sources: dict class name -> body to deploy
+    :param target_ids: dict class name -> ApexClass Id of the classes already in the target
+    :return: dict with request_id (None when only new classes were deployed) and created class names
+    """
+    created = sorted(set(sources) - set(target_ids))
+    if created:
+        batch = rest.composite()
+        for name in created:
+            batch.add('POST', urls['sobjects'] + 'ApexClass', {'Name': name, 'Body': sources[name]})
+        _execute(batch)
+
+    updated = sorted(set(sources) & set(target_ids))
+    if not updated:
+        return {'request_id': None, 'created': created}
+
+    batch = rest.composite(urls['tooling_rest'] + 'composite', all_or_none=True)
+    batch.add('POST', urls['tooling_rest'] + 'sobjects/MetadataContainer',
+              {'Name': 'Compare' + uuid.uuid4().hex[:24]}, reference_id='container')
+    for name in updated:
+        batch.add('POST', urls['tooling_rest'] + 'sobjects/ApexClassMember',
+                  {'MetadataContainerId': '@{container.id}', 'ContentEntityId': target_ids[name], 'Body': sources[name]})
+    batch.add('POST', urls['tooling_rest'] + 'sobjects/ContainerAsyncRequest',
+              {'MetadataContainerId': '@{container.id}', 'IsCheckOnly': False}, reference_id='request')
+    request_id = _execute(batch)[-1].json()['id']
+    return {'request_id': request_id, 'created': created}
+
+
+def deploy_status(rest, urls, request_id):
+    """
+    One look at the async compile request, the container is deleted once it is finished
+    :return: dict with state, done, error and the failures of the compile
+    """
+    response = rest.rest_api_get(urls['tooling_rest'] + 'sobjects/ContainerAsyncRequest/' + request_id)
+    if response.status_code != 200:
+        raise DeployError(response)
+    record = response.json()
+    details = record.get('DeployDetails') or {}
+    status = {
+        'state': record.get('State'),
+        'done': record.get('State') in FINAL_STATES,
+        'error': record.get('ErrorMsg'),
+        'failures': [{'name': f.get('fullName'), 'problem': f.get('problem'), 'line': f.get('lineNumber')}
+                     for f in details.get('componentFailures') or []],
+    }
+    if status['done']:
+        rest.rest_api_delete(urls['tooling_rest'] + 'sobjects/MetadataContainer/' + record['MetadataContainerId'])
+    return status
@@ -0,0 +1,162 @@
+"""
+Tooling API query helpers built on RESTApi.rest_api_get.
+
+Long name lists are split into IN clauses that keep the GET url under a safe
+length, every chunk follows nextRecordsUrl so big result sets are never
+truncated, and records are yielded lazily instead of being collected into
+one response. Chunks are folded COMPOSITE_QUERY_LIMIT (the most queries
+Salesforce accepts in one composite request) at a time into Composite API
+calls, and those calls run concurrently, at most max_in_flight at a time.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from REST_Api_ import COMPOSITE_QUERY_LIMIT
+from metrics import run_in_context
+
+# url encoded length of one IN clause, the whole GET url must stay below ~16k
+MAX_IN_CLAUSE_CHARS = 4000
+MAX_IN_FLIGHT = 4
+# send the first page of several chunks in one composite call
+COMPOSITE = True
+
+# separate from concurrent_fetch: org level calls run there and submit chunks here
+_executor = ThreadPoolExecutor(max_workers=16)
+
+
+class ToolingQueryError(Exception):
+    """
+    Raised when a query page does not answer 200, keeps the failing response
+    """
+
+    def __init__(self, response):
+        super(ToolingQueryError, self).__init__(response.status_code)
+        self.response = response
+
+
+def configure(max_in_clause_chars=None, max_in_flight=None, max_workers=None, composite=None):
+    global MAX_IN_CLAUSE_CHARS, MAX_IN_FLIGHT, COMPOSITE, _executor
+    if composite is not None:
+        COMPOSITE = composite
+    if max_in_clause_chars is not None:
+        MAX_IN_CLAUSE_CHARS = max_in_clause_chars
+    if max_in_flight is not None:
+        MAX_IN_FLIGHT = max_in_flight
+    if max_workers is not None:
+        old = _executor
+        _executor = ThreadPoolExecutor(max_workers=max_workers)
+        old.shutdown(wait=False)
+
+
+def soql_quote(value):
+    """
+    Quote a value for a SOQL string literal
+    """
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def chunk_names(names, max_chars=None):
+    """
+    Split names into lists whose quoted IN clause stays under max_chars once url encoded
+    :return: generator of lists of names
+    """
+    max_chars = max_chars or MAX_IN_CLAUSE_CHARS
+    chunk = []
+    size = 0
+    for name in names:
+        name_size = len(quote(soql_quote(name))) + 1
+        if chunk and size + name_size > max_chars:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(name)
+        size += name_size
+    if chunk:
+        yield chunk
+
+
+def in_clause(names):
+    return ','.join(soql_quote(name) for name in names)
+
+
+def _query_url(tooling_url, soql):
+    return tooling_url + 'query/?q=' + quote(soql)
+
+
+def _pages(rest, page):
+    """
+    Records of a query page and of the pages following it through nextRecordsUrl
+    """
+    while True:
+        for record in page.get('records', []):
+            yield record
+        if page.get('done', True) or not page.get('nextRecordsUrl'):
+            return
+        response = rest.rest_api_get(page['nextRecordsUrl'])
+        if response.status_code != 200:
+            raise ToolingQueryError(response)
+        page = response.json()
+
+
+def query_records(rest, tooling_url, soql):
+    """
+    Run a query and follow nextRecordsUrl until the last page
+    :param rest: RESTApi of the org
+    :param tooling_url: urls['tooling_rest'] of the org userinfo
+    :return: generator of records
+    """
+    response = rest.rest_api_get(_query_url(tooling_url, soql))
+    if response.status_code != 200:
+        raise ToolingQueryError(response)
+    for record in _pages(rest, response.json()):
+        yield record
+
+
+def _fetch_group(rest, tooling_url, soqls):
+    """
+    Records of several queries, their first pages are fetched by one composite call
+    """
+    if len(soqls) == 1:
+        return list(query_records(rest, tooling_url, soqls[0]))
+    batch = rest.composite(tooling_url + 'composite')
+    for soql in soqls:
+        batch.add('GET', _query_url(tooling_url, soql))
+    records = []
+    for result in batch.execute():
+        if result.status_code != 200:
+            raise ToolingQueryError(result)
+        records.extend(_pages(rest, result.json()))
+    return records
+
+
+def query_in_chunks(rest, tooling_url, soql, names, max_in_flight=None):
+    """
+    Run soql once per chunk of names, {names} in soql is replaced by the IN clause list
+        ex: SELECT Name,Body FROM ApexClass WHERE Name IN ({names})
+    Records are yielded in chunk order, so an ORDER BY on sorted names stays sorted
+    :return: generator of records
+    """
+    max_in_flight = max_in_flight or MAX_IN_FLIGHT
+    soqls = [soql.replace('{names}', in_clause(chunk)) for chunk in chunk_names(sorted(set(names)))]
+    if not soqls:
+        return
+    if len(soqls) == 1:
+        for record in query_records(rest, tooling_url, soqls[0]):
+            yield record
+        return
+
+    group_size = COMPOSITE_QUERY_LIMIT if COMPOSITE else 1
+    pending = deque()
+    try:
+        for i in range(0, len(soqls), group_size):
+            pending.append(_executor.submit(run_in_context(_fetch_group), rest, tooling_url, soqls[i:i + group_size]))
+            if len(pending) >= max_in_flight:
+                for record in pending.popleft().result():
+                    yield record
+        while pending:
+            for record in pending.popleft().result():
+                yield record
+    finally:
+        for future in pending:
+            future.cancel()